@@ -28,6 +28,11 @@ def aggregate_sum(da):
     return da.sum('time')
 
 def aggregate_matrix(da, matrix, index):
-    da = da.stack(spatial=('y', 'x')).transpose('spatial', 'time')
-    return xr.DataArray(matrix * da,
-                        [index, da.coords['time']])
+    # Further dimensions besides time (f.ex. orientation or panel of pv)
+    # are kept
+    da = da.stack(spatial=('y', 'x'))
+    dims = ['time'] + [d for d in da.dims if d not in ('spatial', 'time')]
+    da = da.transpose('spatial', *dims)
+    values = matrix * da.values.reshape(len(da.indexes['spatial']), -1)
+    return xr.DataArray(values.reshape((matrix.shape[0],) + da.shape[1:]),
+                        [index] + [da.coords[d] for d in dims])
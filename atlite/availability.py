@@ -0,0 +1,260 @@
+## Copyright 2016-2017 Gorm Andresen (Aarhus University), Jonas Hoersch (FIAS), Tom Brown (FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Renewable Energy Atlas Lite (Atlite)
+
+Light-weight version of Aarhus RE Atlas for converting weather data to power systems data
+"""
+
+from __future__ import absolute_import
+
+import numpy as np
+import pandas as pd
+import scipy as sp, scipy.sparse
+import pyproj
+from six import string_types
+from multiprocessing import Pool
+import rasterio as rio
+import rasterio.features
+
+from .gis import (reproject_shapes, regrid_raster, Resampling, RotProj,
+                  _regular_spacing)
+
+import logging
+logger = logging.getLogger(__name__)
+
+def _rotated_pole_crs(projection):
+    # RotProj maps geographic to rotated coordinates with the inverse of its
+    # ob_tran definition, GDAL with the forward one. For a pole at
+    # (o_lon_p, o_lat_p) and lon_0=180, as of the CORDEX grids, this is the
+    # ob_tran projection with o_lon_p=0 and lon_0 shifted by the pole longitude
+    params = dict(p.lstrip('+').split('=', 1)
+                  for p in projection.srs.split() if '=' in p)
+    if (float(params.pop('lon_0', 0.)) != 180. or
+        params.pop('o_proj', None) not in ('latlong', 'longlat')):
+        raise NotImplementedError("Availability matrices are only supported for rotated pole "
+                                  "grids defined with o_proj=latlong and lon_0=180, not `{}`."
+                                  .format(projection.srs))
+    lon_0 = (float(params.pop('o_lon_p', 0.)) + 360.) % 360. - 180.
+    params.update(proj='ob_tran', o_proj='longlat', o_lon_p='0', lon_0=repr(lon_0))
+    return ' '.join('+{}={}'.format(k, v) for k, v in sorted(params.items()))
+
+def _as_crs(projection):
+    if isinstance(projection, RotProj):
+        return _rotated_pole_crs(projection)
+    if isinstance(projection, pyproj.Proj):
+        return projection.srs
+    if projection == 'latlong':
+        return 'EPSG:4326'
+    return projection
+
+def _as_raster_exclusion(r):
+    if isinstance(r, string_types):
+        r = dict(raster=r)
+    r = dict(r)
+    r.setdefault('codes', None)
+    r.setdefault('func', None)
+    r.setdefault('band', 1)
+    r.setdefault('invert', False)
+    return r
+
+def _as_geometry_exclusion(g, crs):
+    if not isinstance(g, dict):
+        g = dict(geometry=g)
+    g = dict(g)
+    shapes = g['geometry']
+    if hasattr(shapes, 'geometry'):
+        shapes = shapes.geometry
+    shapes = list(shapes)
+
+    buffer = g.get('buffer', 0)
+    if buffer:
+        shapes = [s.buffer(buffer) for s in shapes]
+    shapes = reproject_shapes(shapes, g.get('proj', 'latlong'), crs)
+
+    return dict(geometry=shapes,
+                bounds=np.array([s.bounds for s in shapes]).reshape(-1, 4),
+                invert=g.get('invert', False))
+
+_worker_exclusions = None
+
+def _init_availability_worker(exclusions):
+    global _worker_exclusions
+    _worker_exclusions = exclusions
+
+def _excluded_by_raster(r, x, y, crs):
+    values = regrid_raster(r['raster'], x, y, dst_crs=crs, band=r['band'],
+                           resampling=Resampling.nearest, dtype=np.float32,
+                           dst_nodata=np.nan).values
+    if r['func'] is not None:
+        excluded = np.asarray(r['func'](values), dtype=bool)
+    elif r['codes'] is not None:
+        excluded = np.isin(values, r['codes'])
+    else:
+        excluded = ~np.isnan(values) & (values != 0)
+    return ~excluded if r['invert'] else excluded
+
+def _excluded_by_geometry(g, shape, transform, bounds):
+    minx, miny, maxx, maxy = bounds
+    b = g['bounds']
+    close = ((b[:, 0] <= maxx) & (b[:, 2] >= minx) &
+             (b[:, 1] <= maxy) & (b[:, 3] >= miny))
+    geometries = [s for s, c in zip(g['geometry'], close) if c]
+    if geometries:
+        excluded = rio.features.rasterize(geometries, out_shape=shape, transform=transform,
+                                          fill=0, default_value=1, dtype=np.uint8).astype(bool)
+    else:
+        excluded = np.zeros(shape, dtype=bool)
+    return ~excluded if g['invert'] else excluded
+
+def _availability_task(task):
+    # Eligible share of the area of the cutout cells in the window of a shape,
+    # computed on a grid of `resolution` x `resolution` pixels per cell,
+    # which is aligned with the cells of the cutout
+    k = task['resolution']
+    (ix0, ix1), (iy0, iy1) = task['ix'], task['iy']
+    x, y, dx, dy = task['x'], task['y'], task['dx'], task['dy']
+
+    fine_x = x[ix0] - dx/2. + (np.arange((ix1 - ix0) * k) + 0.5) * dx/k
+    fine_y = y[iy0] - dy/2. + (np.arange((iy1 - iy0) * k) + 0.5) * dy/k
+    shape = len(fine_y), len(fine_x)
+    transform = rio.transform.from_origin(fine_x[0] - dx/k/2., fine_y[0] - dy/k/2.,
+                                          dx/k, -dy/k)
+    bounds = (fine_x[0] - dx/k/2., fine_y[-1] + dy/k/2.,
+              fine_x[-1] + dx/k/2., fine_y[0] - dy/k/2.)
+
+    eligible = rio.features.rasterize([task['shape']], out_shape=shape, transform=transform,
+                                      fill=0, default_value=1, dtype=np.uint8).astype(bool)
+
+    for r in _worker_exclusions['rasters']:
+        if not eligible.any(): break
+        eligible &= ~_excluded_by_raster(r, fine_x, fine_y, task['crs'])
+    for g in _worker_exclusions['geometries']:
+        if not eligible.any(): break
+        eligible &= ~_excluded_by_geometry(g, shape, transform, bounds)
+
+    share = eligible.reshape(iy1 - iy0, k, ix1 - ix0, k).mean(axis=(1, 3))
+    iy, ix = np.nonzero(share)
+    return (iy + iy0) * len(x) + (ix + ix0), share[iy, ix]
+
+def compute_availabilitymatrix(cutout, shapes, rasters=(), geometries=(),
+                               shapes_proj='latlong', resolution=20, nprocesses=None):
+    """
+    Compute the eligible share of the area of the cutout cells in each of the
+    `shapes`, excluding the areas marked by rasters and vector geometries.
+
+    Each shape is evaluated on a grid of `resolution` x `resolution` pixels
+    per cutout cell, which is aligned with the cutout grid. Only the windows
+    of the rasters covering the shape are read and reprojected onto this
+    grid, the shapes are processed in parallel.
+
+    Rotated pole cutouts (as of CORDEX) are supported for poles defined by
+    `o_lon_p` and `o_lat_p` with `lon_0=180`; the shapes and rasters are
+    then reprojected onto the rotated grid.
+
+    The result can be passed as `matrix` to `convert_and_aggregate` (f.ex.
+    to `cutout.wind`), possibly scaled by the capacity per unit of cell area.
+
+    Parameters
+    ----------
+    cutout : Cutout
+    shapes : list or pd.Series of shapely.geometry.Polygon
+      Regions to compute the availability for
+    rasters : list of str or dict
+      Exclusion rasters, given by their filename or a dict with the keys:
+      - raster : filename of a raster readable by rasterio
+      - codes : excluded raster values; without codes, all non-zero values
+        are excluded
+      - func : alternatively a function mapping the raster values to a
+        boolean exclusion array, f.ex. `lambda v: v > 20` for slopes
+      - band : band of the raster to read (default: 1)
+      - invert : exclude all but the marked areas (default: False)
+    geometries : list of shape collections or dict
+      Exclusion geometries, given by a list or GeoSeries of shapes or a dict
+      with the keys:
+      - geometry : the shapes
+      - buffer : distance by which to buffer the shapes, in the units of
+        their projection (default: 0)
+      - proj : projection of the shapes (default: latlong)
+      - invert : exclude all but the given areas (default: False)
+    shapes_proj : str or pyproj.Proj
+      Projection of `shapes` (default: latlong)
+    resolution : int
+      Number of pixels per cutout cell along each axis (default: 20)
+    nprocesses : int
+      Number of processes (defaults to all processors); with 1 or a single
+      shape the shapes are processed in the calling process
+
+    Returns
+    -------
+    A : sp.sparse.csr_matrix
+      Availability matrix of shape (number of shapes, number of cells), with
+      the cells ordered as by `Cutout.grid_cells`
+    """
+
+    x, y = cutout.coords['x'].values, cutout.coords['y'].values
+    dx, dy = _regular_spacing(x), _regular_spacing(y)
+    if dx is None or dy is None or dx < 0 or dy > 0:
+        raise ValueError("Availability matrices need a regular cutout grid "
+                         "from west to east and north to south.")
+    crs = _as_crs(cutout.projection)
+
+    if isinstance(shapes, pd.Series):
+        shapes = shapes.values
+    shapes = reproject_shapes(list(shapes), shapes_proj, cutout.projection)
+
+    exclusions = dict(rasters=[_as_raster_exclusion(r) for r in rasters],
+                      geometries=[_as_geometry_exclusion(g, cutout.projection)
+                                  for g in geometries])
+
+    def cell_range(c, step, lo, hi):
+        # Indices of the cells covering the interval [lo, hi]
+        a, b = sorted(((lo - c[0]) / step + 0.5, (hi - c[0]) / step + 0.5))
+        return max(int(np.floor(a)), 0), min(int(np.ceil(b)), len(c))
+
+    tasks = []
+    for shape in shapes:
+        minx, miny, maxx, maxy = shape.bounds
+        tasks.append(dict(shape=shape, x=x, y=y, dx=dx, dy=dy, crs=crs,
+                          resolution=resolution,
+                          ix=cell_range(x, dx, minx, maxx),
+                          iy=cell_range(y, dy, miny, maxy)))
+
+    # Shapes outside of the cutout get empty rows
+    valid = [i for i, t in enumerate(tasks)
+             if t['ix'][0] < t['ix'][1] and t['iy'][0] < t['iy'][1]]
+
+    if nprocesses == 1 or len(valid) <= 1:
+        _init_availability_worker(exclusions)
+        try:
+            results = [_availability_task(tasks[i]) for i in valid]
+        finally:
+            _init_availability_worker(None)
+    else:
+        pool = Pool(processes=nprocesses, initializer=_init_availability_worker,
+                    initargs=(exclusions,))
+        try:
+            results = pool.map(_availability_task, [tasks[i] for i in valid])
+        finally:
+            pool.close()
+            pool.join()
+
+    rows = np.concatenate([np.full(len(c), i) for i, (c, _) in zip(valid, results)] + [[]])
+    cols = np.concatenate([c for c, _ in results] + [[]])
+    data = np.concatenate([d for _, d in results] + [[]])
+    return sp.sparse.csr_matrix((data, (rows.astype(int), cols.astype(int))),
+                                shape=(len(shapes), len(x) * len(y)))
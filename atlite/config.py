@@ -1,6 +1,12 @@
 #Dataset Settings
 gebco_path = '/home/vres-climate/data/GEBCO_2014_2D.nc'
 cutout_dir = '/home/vres/data/cutouts'
+cache_dir = '/home/vres/data/cache'
+# Maximal size in bytes of the indicator matrices kept in cache_dir
+indicatormatrix_cache_size = 2**30
+# Maximal size in bytes of the time and location terms of the solar position
+# kept in memory
+solar_position_cache_size = 2**26
 ncep_dir = '/home/vres-climate/data/rda_ucar'
 cordex_dir = '/home/vres-climate/data/cordex/RCP8.5'
 sarah_dir = '/home/vres-climate/data/sarah_v2'
@@ -36,9 +36,10 @@ from .aggregate import aggregate_sum, aggregate_matrix
 from .gis import spdiag, compute_indicatormatrix
 
 from .pv.solar_position import SolarPosition
-from .pv.irradiation import TiltedIrradiation
+from .pv.irradiation import TiltedIrradiation, HorizontalIrradiation
 from .pv.solar_panel_model import SolarPanelModel
 from .pv.orientation import get_orientation, SurfaceOrientation
+from .pv.fused import FusedSolarPV, has_numba
 
 from . import hydro as hydrom
 from . import wind as windm
@@ -48,13 +49,18 @@ from .resource import (get_windturbineconfig, get_solarpanelconfig,
                        solarpanel_rated_capacity_per_unit,
                        windturbine_smooth)
 
+import logging
+logger = logging.getLogger(__name__)
+
 from .utils import make_optional_progressbar
 
 def convert_and_aggregate(cutout, convert_func, matrix=None,
                           index=None, layout=None, shapes=None,
-                          shapes_proj='latlong', per_unit=False,
+                          shapes_proj='latlong', points=None,
+                          points_proj='latlong', points_method='nearest',
+                          per_unit=False,
                           return_capacity=False, capacity_factor=False,
-                          show_progress=True, **convert_kwds):
+                          show_progress=True, nprocesses=1, **convert_kwds):
     """
     Convert and aggregate a weather-based renewable generation time-series.
 
@@ -78,6 +84,17 @@ def convert_and_aggregate(cutout, convert_func, matrix=None,
         Defaults to 'latlong'. If different to the map projection of the
         cutout, the shapes are reprojected using pyproj.transform to match
         cutout.projection (defaults to 'latlong').
+    points : pd.DataFrame or N x 2 - np.array
+        If given, matrix samples the grid at the points, f.ex. plants, given
+        by the columns x and y (or lon and lat) of a DataFrame, whose index
+        determines the bus index. An optional column capacity weights the
+        points.
+    points_proj : str or pyproj.Proj
+        Projection of the points (defaults to 'latlong').
+    points_method : str
+        'nearest' to take the cell containing a point or 'bilinear' to
+        interpolate between the four surrounding cells (defaults to
+        'nearest').
     per_unit : boolean
         Returns the time-series in per-unit units, instead of in MW (defaults
         to False).
@@ -90,6 +107,10 @@ def convert_and_aggregate(cutout, convert_func, matrix=None,
     show_progress : boolean|string
         Whether to show a progress bar if boolean and its label if given as a
         string (defaults to True).
+    nprocesses : int
+        Number of processes to compute the indicatormatrix of `shapes` on
+        (defaults to 1, None for all processors), see
+        `Cutout.indicatormatrix`.
 
     Returns
     -------
@@ -112,7 +133,16 @@ def convert_and_aggregate(cutout, convert_func, matrix=None,
         if isinstance(shapes, pd.Series) and index is None:
             index = shapes.index
 
-        matrix = cutout.indicatormatrix(shapes, shapes_proj)
+        matrix = cutout.indicatormatrix(shapes, shapes_proj, nprocesses=nprocesses)
+
+    if points is not None:
+        assert shapes is None, "Only one of `shapes` and `points` may be given"
+        if isinstance(points, pd.DataFrame) and index is None:
+            index = points.index
+
+        matrix = cutout.pointmatrix(points, points_proj, points_method)
+        if isinstance(points, pd.DataFrame) and 'capacity' in points.columns:
+            matrix = spdiag(points['capacity'].values).dot(matrix)
 
     if layout is not None:
         if isinstance(layout, xr.DataArray):
@@ -149,9 +179,9 @@ def convert_and_aggregate(cutout, convert_func, matrix=None,
     maybe_progressbar = make_optional_progressbar(show_progress, prefix, len(yearmonths))
 
     for ym in maybe_progressbar(yearmonths):
-        with xr.open_dataset(cutout.datasetfn(ym)) as ds:
-            if 'view' in cutout.meta.attrs:
-                ds = ds.sel(**cutout.meta.attrs['view'])
+        # Static variables (f.ex. roughness and height of CORDEX) are only
+        # stored once in the meta data, `open_dataset` adds them to each month
+        with cutout.open_dataset(ym) as ds:
             da = convert_func(ds, **convert_kwds)
             results.append(aggregate_func(da, **aggregate_kwds).load())
     if 'time' in results[0].coords:
@@ -166,7 +196,7 @@ def convert_and_aggregate(cutout, convert_func, matrix=None,
 
     if per_unit or return_capacity:
         assert aggregate_func is aggregate_matrix, \
-            "One of `matrix`, `shapes` and `layout` must be given for `per_unit`"
+            "One of `matrix`, `shapes`, `points` and `layout` must be given for `per_unit`"
         capacity = xr.DataArray(np.asarray(matrix.sum(axis=1)).reshape(-1), [index])
 
     if per_unit:
@@ -353,11 +383,14 @@ def solar_thermal(cutout, orientation={'slope': 45., 'azimuth': 180.},
 def convert_wind(ds, turbine):
     """Convert wind speeds for turbine to wind energy generation."""
 
-    V, POW, hub_height, P = itemgetter('V', 'POW', 'hub_height', 'P')(turbine)
+    wnd_hub = windm.extrapolate_wind_speed(ds, to_height=turbine['hub_height'])
+    power_curve = windm.get_power_curve(turbine)
 
-    wnd_hub = windm.extrapolate_wind_speed(ds, to_height=hub_height)
-
-    return xr.DataArray(np.interp(wnd_hub, V, POW/P), coords=wnd_hub.coords)
+    # Extrapolated wind speeds are not used anymore and can be overwritten
+    out = (wnd_hub.values
+           if wnd_hub.name not in ds and wnd_hub.dtype == np.float64
+           else None)
+    return xr.DataArray(power_curve(wnd_hub.values, out=out), coords=wnd_hub.coords)
 
 def wind(cutout, turbine, smooth=False, **params):
     """
@@ -399,36 +432,117 @@ def wind(cutout, turbine, smooth=False, **params):
 
 ## solar PV
 
-def convert_pv(ds, panel, orientation, trigon_model='simple', clearsky_model='simple'):
+def _convert_pv_multiple(ds, panel, orientation, trigon_model, clearsky_model, fused,
+                         power_table):
+    # Only the surface orientation and the tilted irradiation are computed
+    # per orientation and only the panel model per panel
+    panels = panel if isinstance(panel, pd.Series) else pd.Series([panel])
+    orientations = (orientation if isinstance(orientation, pd.Series)
+                    else pd.Series([orientation]))
+
+    solar_position = SolarPosition(ds)
+    if not fused:
+        horizontal = HorizontalIrradiation(ds, solar_position, clearsky_model)
+
+    def concat(das, labels, dim):
+        if isinstance(labels, pd.Series):
+            return xr.concat(das, dim=pd.Index(labels.index, name=dim))
+        return das[0]
+
+    results = []
+    for orient in orientations:
+        if fused:
+            per_panel = [FusedSolarPV(ds, pc, orient, trigon_model=trigon_model,
+                                      clearsky_model=clearsky_model)
+                         for pc in panels]
+        else:
+            surface_orientation = SurfaceOrientation(ds, solar_position, orient)
+            irradiation = TiltedIrradiation(ds, solar_position, surface_orientation,
+                                            trigon_model=trigon_model,
+                                            clearsky_model=clearsky_model,
+                                            horizontal=horizontal)
+            per_panel = [SolarPanelModel(ds, irradiation, pc, power_table=power_table)
+                         for pc in panels]
+        results.append(concat(per_panel, panel, 'panel'))
+    return concat(results, orientation, 'orientation')
+
+def convert_pv(ds, panel, orientation, trigon_model='simple', clearsky_model='simple',
+               fused=False, power_table=False):
+    if isinstance(panel, pd.Series) or isinstance(orientation, pd.Series):
+        return _convert_pv_multiple(ds, panel, orientation, trigon_model,
+                                    clearsky_model, fused, power_table)
+
+    if fused:
+        return FusedSolarPV(ds, panel, orientation, trigon_model=trigon_model,
+                            clearsky_model=clearsky_model)
+
     solar_position = SolarPosition(ds)
     surface_orientation = SurfaceOrientation(ds, solar_position, orientation)
     irradiation = TiltedIrradiation(ds, solar_position, surface_orientation,
                                     trigon_model=trigon_model,
                                     clearsky_model=clearsky_model)
-    solar_panel = SolarPanelModel(ds, irradiation, panel)
+    solar_panel = SolarPanelModel(ds, irradiation, panel, power_table=power_table)
     return solar_panel
 
-def pv(cutout, panel, orientation, clearsky_model=None, **params):
+def _orientation_label(orientation):
+    if isinstance(orientation, string_types):
+        return orientation
+    if isinstance(orientation, dict):
+        return ",".join("{}={}".format(k, v) for k, v in sorted(orientation.items()))
+    return getattr(orientation, '__name__', None)
+
+def _labelled(values, convert, label):
+    # pd.Series of the converted `values`, labelled by their index or by
+    # `label` (falling back to their position)
+    if isinstance(values, pd.Series):
+        index = values.index
+    else:
+        index = [label(v) for v in values]
+        if None in index or len(set(index)) < len(index):
+            index = range(len(values))
+    return pd.Series([convert(v) for v in values], index=index, dtype=object)
+
+def pv(cutout, panel, orientation, clearsky_model=None, fused=False,
+       power_table=False, **params):
     '''
     Convert downward-shortwave, upward-shortwave radiation flux and
     ambient temperature into a pv generation time-series.
 
     Parameters
     ----------
-    panel : str or dict
+    panel : str or dict, or list or pd.Series of them
         Panel name known to the reatlas client or a panel config
         dictionary with the parameters for the electrical model in [3].
-    orientation : str, dict or callback
+    orientation : str, dict or callback, or list or pd.Series of them
         Panel orientation can be chosen from either
         'latitude_optimal', a constant orientation {'slope': 0.0,
         'azimuth': 0.0} or a callback function with the same signature
         as the callbacks generated by the
         `atlite.pv.orientation.make_*' functions.
+
+        Several panels or orientations result in the additional
+        dimensions `panel` and `orientation`, labelled by the index of the
+        pd.Series or by the panel and orientation names. The solar position
+        and the horizontal direct and diffuse irradiation are only
+        computed once for all of them.
     clearsky_model : str or None
         Either the 'simple' or the 'enhanced' Reindl clearsky
         model. The default choice of None will choose dependending on
         data availability, since the 'enhanced' model also
         incorporates ambient air temperature and relative humidity.
+    fused : bool
+        Whether to compute the conversion with a fused kernel, which needs
+        numba and passes over the data cell by cell without allocating
+        temporaries (default: False), see `atlite.pv.fused.FusedSolarPV`.
+        Without numba (install with `pip install atlite[fused]`) the regular
+        conversion is used instead and a warning is logged.
+    power_table : bool or float
+        Whether to interpolate the panel model from a table over irradiance
+        and temperature, which is cached per panel; a float sets the
+        tolerated interpolation error per unit of capacity, as sampled on a
+        finer grid (default: False, otherwise 1e-4), see
+        `atlite.pv.solar_panel_model.PowerTable`. It does not apply to the
+        `fused` kernel.
 
     Returns
     -------
@@ -453,14 +567,32 @@ def pv(cutout, panel, orientation, clearsky_model=None, **params):
         Eurosun (ISES Europe Solar Congress).
     '''
 
-    if isinstance(panel, string_types):
-        panel = get_solarpanelconfig(panel)
-    if not callable(orientation):
-        orientation = get_orientation(orientation)
+    def as_panel(panel):
+        return (get_solarpanelconfig(panel)
+                if isinstance(panel, string_types) else panel)
+    def as_orientation(orientation):
+        return (orientation if callable(orientation)
+                else get_orientation(orientation))
+
+    if isinstance(panel, (list, tuple, pd.Series)):
+        panel = _labelled(panel, as_panel, lambda p: (p if isinstance(p, string_types)
+                                                      else p.get('name')))
+    else:
+        panel = as_panel(panel)
+    if isinstance(orientation, (list, tuple, pd.Series)):
+        orientation = _labelled(orientation, as_orientation, _orientation_label)
+    else:
+        orientation = as_orientation(orientation)
+
+    if fused and not has_numba:
+        logger.warning("The fused PV conversion needs the numba python package. "
+                       "Falling back to the regular conversion.")
+        fused = False
 
     return cutout.convert_and_aggregate(convert_func=convert_pv,
                                         panel=panel, orientation=orientation,
                                         clearsky_model=clearsky_model,
+                                        fused=fused, power_table=power_table,
                                         **params)
 
 ## hydro
@@ -505,7 +637,8 @@ def runoff(cutout, smooth=None, lower_threshold_quantile=None,
 
     return result
 
-def hydro(cutout, plants, hydrobasins, flowspeed=1, weight_with_height=False, show_progress=True, **kwargs):
+def hydro(cutout, plants, hydrobasins, flowspeed=1, weight_with_height=False, show_progress=True,
+          nprocesses=1, **kwargs):
     """
     Compute inflow time-series for `plants` by aggregating over catchment basins from `hydrobasins`
 
@@ -523,6 +656,9 @@ def hydro(cutout, plants, hydrobasins, flowspeed=1, weight_with_height=False, sh
         better for coarser resolution).
     show_progress : bool
         Whether to display progressbars.
+    nprocesses : int
+        Number of processes to compute the indicatormatrix of the basins on
+        (defaults to 1, None for all processors).
 
     References
     ----------
@@ -536,7 +672,7 @@ def hydro(cutout, plants, hydrobasins, flowspeed=1, weight_with_height=False, sh
     """
     basins = hydrom.determine_basins(plants, hydrobasins, show_progress=show_progress)
 
-    matrix = cutout.indicatormatrix(basins.shapes)
+    matrix = cutout.indicatormatrix(basins.shapes, nprocesses=nprocesses)
     matrix_normalized = matrix / matrix.sum(axis=1) # compute the average surface runoff in each basin
     runoff = cutout.runoff(matrix=matrix_normalized, index=basins.shapes.index,
                            weight_with_height=weight_with_height,
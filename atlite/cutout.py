@@ -24,8 +24,15 @@ from __future__ import absolute_import
 
 import xarray as xr
 import numpy as np
+import pandas as pd
+import scipy as sp, scipy.sparse
 import os, sys
-from six import string_types
+from six import string_types, iteritems
+from contextlib import contextmanager
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 import logging
 logger = logging.getLogger(__name__)
@@ -36,8 +43,38 @@ from .convert import (convert_and_aggregate, heat_demand, hydro, temperature,
                       wind, pv, runoff, solar_thermal, soil_temperature)
 from .preparation import (cutout_do_task, cutout_prepare,
                           cutout_produce_specific_dataseries,
-                          cutout_get_meta, cutout_get_meta_view)
-from .gis import compute_indicatormatrix
+                          cutout_get_meta, cutout_get_meta_view,
+                          cutout_derive, cutout_coarsen,
+                          cutout_verify, cutout_add_solar_position,
+                          read_manifest)
+from .gis import (compute_indicatormatrix, compute_grid_indicatormatrix,
+                  is_regular_grid, has_shapely2, indicatormatrix_key,
+                  compute_pointmatrix)
+from .availability import compute_availabilitymatrix
+from .utils import evict_cache
+
+class _ManifestCoords(Mapping):
+    """
+    Coordinates of a cutout whose meta data is not decoded yet: x, y and
+    year-month are served from the manifest, all others from `cutout.meta`.
+    """
+    def __init__(self, cutout, coords):
+        self._cutout = cutout
+        self._coords = coords
+
+    def __getitem__(self, key):
+        if key in self._coords:
+            return self._coords[key]
+        return self._cutout.meta.coords[key]
+
+    def __contains__(self, key):
+        return key in self._coords or key in self._cutout.meta.coords
+
+    def __iter__(self):
+        return iter(self._cutout.meta.coords)
+
+    def __len__(self):
+        return len(self._cutout.meta.coords)
 
 class Cutout(object):
     def __init__(self, name=None, cutout_dir=config.cutout_dir, **cutoutparams):
@@ -45,6 +82,10 @@ class Cutout(object):
 
         self.cutout_dir = os.path.join(cutout_dir, name)
         self.prepared = False
+        self.manifest = None
+        self._meta = None
+        self._view = None
+        self._manifest_coords = None
 
         if 'bounds' in cutoutparams:
             x1, y1, x2, y2 = cutoutparams.pop('bounds')
@@ -52,15 +93,27 @@ class Cutout(object):
                                 ys=slice(y2, y1))
 
         if os.path.isdir(self.cutout_dir):
-            self.meta = meta = xr.open_dataset(self.datasetfn()).stack(**{'year-month': ('year', 'month')})
-            # check datasets very rudimentarily, series and coordinates should be checked as well
-            if all(os.path.isfile(self.datasetfn(ym)) for ym in meta.coords['year-month'].to_index()):
+            self.manifest = read_manifest(self.cutout_dir)
+
+            if self.manifest is not None:
+                # The manifest is only written by a completed preparation;
+                # meta.nc is decoded and the files are checked on demand
                 self.prepared = True
+                module = self.manifest.get('module')
             else:
-                assert False
+                self.meta = meta = xr.open_dataset(self.datasetfn()).stack(**{'year-month': ('year', 'month')})
+                missing = [os.path.basename(self.datasetfn(ym))
+                           for ym in meta.coords['year-month'].to_index()
+                           if not os.path.isfile(self.datasetfn(ym))]
+                if missing:
+                    raise IOError("Cutout '{}' in {} is incomplete, the files {} are missing. "
+                                  "Remove the directory to prepare it anew."
+                                  .format(name, self.cutout_dir, ", ".join(missing)))
+                self.prepared = True
+                module = meta.attrs.get('module')
 
-            if 'module' in meta.attrs:
-                cutoutparams['module'] = meta.attrs['module']
+            if module is not None:
+                cutoutparams['module'] = module
             else:
                 logger.warning('module not given in meta file of cutout, assuming it is NCEP')
                 cutoutparams['module'] = 'ncep'
@@ -68,9 +121,10 @@ class Cutout(object):
             if {"xs", "ys", "years", "months"}.intersection(cutoutparams):
                 # Assuming the user is interested in a subview into
                 # the data, update meta in place for the time
-                # dimension and save the xs, ys slices, separately
-                self.meta = meta = self.get_meta_view(**cutoutparams)
-                logger.info("Assuming a view into the prepared cutout: %s", self)
+                # dimension and save the xs, ys slices, separately.
+                # The view is applied when meta is first needed.
+                self._view = cutoutparams
+                logger.info("Assuming a view into the prepared cutout: %s", name)
 
         else:
             logger.info("Cutout %s not found in directory %s, building new one", name, cutout_dir)
@@ -100,6 +154,19 @@ class Cutout(object):
                                               if dataset is None
                                               else "{}{:0>2}.nc".format(*dataset)))
 
+    @property
+    def meta(self):
+        if self._meta is None and self.prepared:
+            self._meta = xr.open_dataset(self.datasetfn()).stack(**{'year-month': ('year', 'month')})
+        if self._view is not None:
+            view, self._view = self._view, None
+            self._meta = self.get_meta_view(**view)
+        return self._meta
+
+    @meta.setter
+    def meta(self, meta):
+        self._meta = meta
+
     @property
     def meta_data_config(self):
         return self.dataset_module.meta_data_config
@@ -114,8 +181,28 @@ class Cutout(object):
 
     @property
     def coords(self):
+        # The grid and months are served from the manifest until meta is
+        # decoded, unless a view has to be applied first
+        if self._meta is None and self._view is None and self.prepared:
+            if self._manifest_coords is None:
+                self._manifest_coords = self._coords_from_manifest()
+            if self._manifest_coords is not False:
+                return self._manifest_coords
         return self.meta.coords
 
+    def _coords_from_manifest(self):
+        # False if the manifest is missing or lacks the coordinate values
+        m = self.manifest
+        if m is None or not all('values' in m.get(c, {}) for c in ('x', 'y')):
+            return False
+        yearmonths = m['yearmonths']
+        ds = xr.Dataset(coords={'x': np.asarray(m['x']['values'], dtype=m['x']['dtype']),
+                                'y': np.asarray(m['y']['values'], dtype=m['y']['dtype']),
+                                'year': ('year-month', [y for y, _ in yearmonths]),
+                                'month': ('year-month', [mo for _, mo in yearmonths])})
+        ds = ds.set_index(**{'year-month': ['year', 'month']})
+        return _ManifestCoords(self, ds.coords)
+
     @property
     def shape(self):
         return len(self.coords["y"]), len(self.coords["x"])
@@ -126,6 +213,37 @@ class Cutout(object):
                 list(self.coords["y"].values[[-1, 0]]))
 
 
+    @property
+    def static_vars(self):
+        """
+        Variables of the meta data without time axis (f.ex. `height` or the
+        `roughness` of CORDEX), which are stored only once in `meta.nc`
+        instead of in every monthly file.
+        """
+        return {k: da for k, da in iteritems(self.meta.data_vars)
+                if set(da.dims).issubset({'x', 'y'})}
+
+    @contextmanager
+    def open_dataset(self, yearmonth):
+        """
+        Open the monthly file of `yearmonth` restricted to the view of the
+        cutout and complemented by its `static_vars`.
+
+        Reading the monthly files directly misses the static variables.
+
+        Example
+        -------
+        >>> with cutout.open_dataset((2011, 1)) as ds:
+        ...     roughness = ds['roughness'].load()
+        """
+        with xr.open_dataset(self.datasetfn(yearmonth)) as ds:
+            if 'view' in self.meta.attrs:
+                ds = ds.sel(**self.meta.attrs['view'])
+            for k, da in iteritems(self.static_vars):
+                if k not in ds:
+                    ds[k] = da
+            yield ds
+
     def grid_coordinates(self):
         xs, ys = np.meshgrid(self.coords["x"], self.coords["y"])
         return np.asarray((np.ravel(xs), np.ravel(ys))).T
@@ -146,8 +264,80 @@ class Cutout(object):
                         yearmonths[-1][0], yearmonths[-1][1],
                         "" if self.prepared else "UN"))
 
-    def indicatormatrix(self, shapes, shapes_proj='latlong'):
-        return compute_indicatormatrix(self.grid_cells(), shapes, self.projection, shapes_proj)
+    def indicatormatrix(self, shapes, shapes_proj='latlong', cache_dir=None, nprocesses=1):
+        """
+        Compute the indicatormatrix of `shapes` on the grid of the cutout.
+
+        Matrices are cached in `cache_dir` (defaults to config.cache_dir) by
+        the shape geometries, their projection and the grid. The least
+        recently used ones are evicted beyond config.indicatormatrix_cache_size
+        bytes. Pass `cache_dir=False` to skip the cache. Failures to read or
+        write the cache are logged and otherwise ignored. With `nprocesses`
+        different from 1 the matrix is computed in parallel by batches of
+        shapes (None for all processors).
+        """
+        x, y = self.coords["x"].values, self.coords["y"].values
+
+        if cache_dir is None:
+            cache_dir = config.cache_dir
+
+        if cache_dir:
+            key = indicatormatrix_key(x, y, shapes, self.projection, shapes_proj)
+            cache_fn = os.path.join(cache_dir, 'indicatormatrix-{}.npz'.format(key))
+            try:
+                matrix = sp.sparse.load_npz(cache_fn).tolil()
+                os.utime(cache_fn, None)
+                logger.debug("Read indicatormatrix from cache %s", cache_fn)
+                return matrix
+            except Exception:
+                # missing, unreadable or corrupt entry
+                pass
+
+        if has_shapely2 and is_regular_grid(x, y):
+            # Regular grids need no polygons for their cells
+            matrix = compute_grid_indicatormatrix(x, y, shapes, self.projection, shapes_proj,
+                                                  nprocesses=nprocesses)
+        else:
+            matrix = compute_indicatormatrix(self.grid_cells(), shapes, self.projection, shapes_proj,
+                                             nprocesses=nprocesses)
+
+        if cache_dir:
+            # The cache is best-effort, the matrix is returned even if it
+            # cannot be stored
+            tmp_fn = "{}.{}.tmp".format(cache_fn, os.getpid())
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                # Write atomically, other processes might read the same entry
+                with open(tmp_fn, 'wb') as f:
+                    sp.sparse.save_npz(f, matrix.tocsr())
+                os.rename(tmp_fn, cache_fn)
+                evict_cache(cache_dir, 'indicatormatrix-*.npz', config.indicatormatrix_cache_size)
+            except (IOError, OSError) as e:
+                logger.warning("Could not cache the indicatormatrix in %s: %s", cache_dir, e)
+                if os.path.isfile(tmp_fn):
+                    os.unlink(tmp_fn)
+
+        return matrix
+
+    def pointmatrix(self, points, points_proj='latlong', method='nearest'):
+        """
+        Compute the matrix sampling the grid of the cutout at `points`.
+
+        `points` is a pd.DataFrame with the columns x and y (or lon and lat)
+        or an array of shape (N, 2). `method` is 'nearest' or 'bilinear', see
+        `gis.compute_pointmatrix`.
+        """
+        if isinstance(points, pd.DataFrame):
+            px, py = ((points['x'], points['y']) if {'x', 'y'}.issubset(points.columns)
+                      else (points['lon'], points['lat']))
+        else:
+            px, py = np.asarray(points).T
+
+        return compute_pointmatrix(self.coords["x"].values, self.coords["y"].values,
+                                   px, py, self.projection, points_proj, method)
+
+    availabilitymatrix = compute_availabilitymatrix
 
     ## Preparation functions
 
@@ -157,8 +347,16 @@ class Cutout(object):
 
     prepare = cutout_prepare
 
+    derive = cutout_derive
+
+    coarsen = cutout_coarsen
+
     produce_specific_dataseries = cutout_produce_specific_dataseries
 
+    verify = cutout_verify
+
+    add_solar_position = cutout_add_solar_position
+
     ## Conversion and aggregation functions
 
     convert_and_aggregate = convert_and_aggregate
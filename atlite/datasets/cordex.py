@@ -48,8 +48,10 @@ def rename_and_clean_coords(ds):
                  & {'bnds', 'height', 'rotated_pole'})
     return ds
 
-def prepare_data_cordex(fn, year, months, oldname, newname, xs, ys):
-    with xr.open_dataset(fn) as ds:
+def prepare_data_cordex(fn, year, months, oldname, newname, xs, ys, time_chunk=24*8):
+    # The yearly file is read lazily in chunks of `time_chunk` time steps
+    # and each month is written directly from its part of the file
+    with xr.open_dataset(fn, chunks=dict(time=time_chunk)) as ds:
         ds = rename_and_clean_coords(ds)
         ds = ds.rename({oldname: newname})
         ds = ds.sel(x=xs, y=ys)
@@ -58,25 +60,32 @@ def prepare_data_cordex(fn, year, months, oldname, newname, xs, ys):
             # shift averaged data to beginning of bin
             ds = ds.assign_coords(time=(pd.to_datetime(ds.coords["time"].values)
                                         - pd.Timedelta(hours=1.5)))
-        elif newname in {'runoff'}:
-            # shift and fill 6hr average data to beginning of 3hr bins
-            t = pd.to_datetime(ds.coords["time"].values)
-            ds = ds.reindex(method='bfill', time=(t - pd.Timedelta(hours=3.)).union(t))
 
         for m in months:
-            yield (year, m), ds.sel(time="{}-{}".format(year, m))
-
-def prepare_static_data_cordex(fn, year, months, oldname, newname, xs, ys):
+            if newname in {'runoff'}:
+                # shift and fill 6hr average data to beginning of 3hr bins,
+                # the last bin of the month is filled from the next month
+                start = pd.Timestamp(year=year, month=m, day=1)
+                end = start + pd.offsets.MonthBegin() + pd.Timedelta(hours=3.)
+                ds_m = ds.sel(time=slice(start, end))
+                t = pd.to_datetime(ds_m.coords["time"].values)
+                ds_m = ds_m.reindex(method='bfill', time=(t - pd.Timedelta(hours=3.)).union(t))
+                yield (year, m), ds_m.sel(time="{}-{}".format(year, m))
+            else:
+                yield (year, m), ds.sel(time="{}-{}".format(year, m))
+
+def prepare_static_data_cordex(fn, oldname, newname, xs, ys):
+    # Static fields are written only once to the meta data of the cutout
+    # instead of into each monthly file, see `tasks_static_cordex`
     with xr.open_dataset(fn) as ds:
         ds = rename_and_clean_coords(ds)
         ds = ds.rename({oldname: newname})
         ds = ds.sel(x=xs, y=ys)
 
-        for m in months:
-            yield (year, m), ds
+        yield None, ds
 
-def prepare_weather_types_cordex(fn, year, months, oldname, newname, xs, ys):
-    with xr.open_dataset(fn) as ds:
+def prepare_weather_types_cordex(fn, year, months, oldname, newname, xs, ys, time_chunk=24*8):
+    with xr.open_dataset(fn, chunks=dict(time=time_chunk)) as ds:
         ds = ds.rename({oldname: newname})
         for m in months:
             yield (year, m), ds.sel(time="{}-{}".format(year, m))
@@ -94,23 +103,26 @@ def prepare_meta_cordex(xs, ys, year, month, template, height_config, module, mo
 
     height_config = height_config.copy()
     height_tasks_func = height_config.pop('tasks_func')
-    height_task, = height_tasks_func(xs, ys, [(year, month)], meta_attrs={}, **height_config)
+    height_config.pop('static_variables', None)
+    height_task, = height_tasks_func(xs, ys, [(year, month)], meta_attrs=dict(model=model),
+                                     **height_config)
     height_prepare_func = height_task.pop('prepare_func')
-    _, ds = height_prepare_func(**height_task)[0]
+    _, ds = next(height_prepare_func(**height_task))
 
     meta['height'] = ds['height']
 
     return meta
 
+def _widen_slice(cs):
+    # Include the cells at the edges of the grid when selecting by value
+    if isinstance(cs, slice):
+        return cs
+    first, second, last = cs.values[[0,1,-1]]
+    return slice(first - 0.1*(second - first), last + 0.1*(second - first))
+
 def tasks_yearly_cordex(xs, ys, yearmonths, prepare_func, template, oldname, newname, meta_attrs):
     model = meta_attrs['model']
-
-    if not isinstance(xs, slice):
-        first, second, last = xs.values[[0,1,-1]]
-        xs = slice(first - 0.1*(second - first), last + 0.1*(second - first))
-    if not isinstance(ys, slice):
-        first, second, last = ys.values[[0,1,-1]]
-        ys = slice(first - 0.1*(second - first), last + 0.1*(second - first))
+    xs, ys = _widen_slice(xs), _widen_slice(ys)
 
     return [dict(prepare_func=prepare_func,
                  xs=xs, ys=ys, oldname=oldname, newname=newname,
@@ -118,6 +130,15 @@ def tasks_yearly_cordex(xs, ys, yearmonths, prepare_func, template, oldname, new
                  year=year, months=list(map(itemgetter(1), yearmonths)))
             for year, yearmonths in groupby(yearmonths, itemgetter(0))]
 
+def tasks_static_cordex(xs, ys, yearmonths, prepare_func, template, oldname, newname, meta_attrs):
+    # A single task for the whole cutout, independent of the years
+    model = meta_attrs['model']
+    xs, ys = _widen_slice(xs), _widen_slice(ys)
+
+    return [dict(prepare_func=prepare_func,
+                 xs=xs, ys=ys, oldname=oldname, newname=newname,
+                 fn=next(glob.iglob(template.format(model=model))))]
+
 weather_data_config = {
     'influx': dict(tasks_func=tasks_yearly_cordex,
                    prepare_func=prepare_data_cordex,
@@ -139,17 +160,19 @@ weather_data_config = {
                    prepare_func=prepare_data_cordex,
                    oldname='sfcWind', newname='wnd10m',
                    template=os.path.join(cordex_dir, '{model}', 'wind', 'sfcWind_*_{year}*.nc')),
-    'roughness': dict(tasks_func=tasks_yearly_cordex,
+    'roughness': dict(tasks_func=tasks_static_cordex,
                       prepare_func=prepare_static_data_cordex,
                       oldname='rlst', newname='roughness',
+                      static_variables=['roughness'],
                       template=os.path.join(cordex_dir, '{model}', 'roughness', 'rlst_*.nc')),
     'runoff': dict(tasks_func=tasks_yearly_cordex,
                    prepare_func=prepare_data_cordex,
                    oldname='mrro', newname='runoff',
                    template=os.path.join(cordex_dir, '{model}', 'runoff', 'mrro_*_{year}*.nc')),
-    'height': dict(tasks_func=tasks_yearly_cordex,
+    'height': dict(tasks_func=tasks_static_cordex,
                    prepare_func=prepare_static_data_cordex,
                    oldname='orog', newname='height',
+                   static_variables=['height'],
                    template=os.path.join(cordex_dir, '{model}', 'altitude', 'orog_*.nc')),
     'CWT': dict(tasks_func=tasks_yearly_cordex,
                 prepare_func=prepare_weather_types_cordex,
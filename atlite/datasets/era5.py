@@ -250,7 +250,12 @@ def tasks_monthly_era5(xs, ys, yearmonths, prepare_func, meta_attrs):
 
 weather_data_config = {
     '_': dict(tasks_func=tasks_monthly_era5,
-              prepare_func=prepare_month_era5)
+              prepare_func=prepare_month_era5,
+              variables=['influx_direct', 'influx_diffuse', 'influx_toa',
+                         'albedo', 'wnd100m', 'runoff', 'temperature',
+                         'pressure', 'soil temperature', 'roughness',
+                         'height'],
+              static_variables=['height'])
 }
 
 meta_data_config = dict(prepare_func=prepare_meta_era5)
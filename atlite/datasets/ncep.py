@@ -28,176 +28,249 @@ import xarray as xr
 from six import iteritems
 import os
 import glob
-import tempfile
-import subprocess
-import shutil
+import logging
+logger = logging.getLogger(__name__)
 
 from ..config import ncep_dir
 
-engine = 'pynio'
+engine = 'cfgrib'
 projection = 'latlong'
 
-def convert_lons_lats_ncep(ds, xs, ys):
-    if not isinstance(xs, slice):
-        first, second, last = np.asarray(xs)[[0,1,-1]]
-        xs = slice(first - 0.1*(second - first), last + 0.1*(second - first))
-    if not isinstance(ys, slice):
-        first, second, last = np.asarray(ys)[[0,1,-1]]
-        ys = slice(first - 0.1*(second - first), last + 0.1*(second - first))
+# cfgrib persists an index of the GRIB messages next to each file, so that
+# only the first read of a file has to scan all its messages
+indexpath = '{path}.{short_hash}.idx'
 
-    ds = ds.sel(lat_0=ys)
+def _as_slice(zs):
+    if not isinstance(zs, slice):
+        first, second, last = np.asarray(zs)[[0,1,-1]]
+        zs = slice(first - 0.1*(second - first), last + 0.1*(second - first))
+    return zs
 
-    # Lons should go from -180. to +180.
-    if len(ds.coords['lon_0'].sel(lon_0=slice(xs.start + 360., xs.stop + 360.))):
-        ds = xr.concat([ds.sel(lon_0=slice(xs.start + 360., xs.stop + 360.)),
-                        ds.sel(lon_0=xs)],
-                       dim="lon_0")
-        ds = ds.assign_coords(lon_0=np.where(ds.coords['lon_0'].values <= 180,
-                                             ds.coords['lon_0'].values,
-                                             ds.coords['lon_0'].values - 360.))
-    else:
-        ds = ds.sel(lon_0=xs)
-
-    ds = ds.rename({'lon_0': 'x', 'lat_0': 'y'})
-    ds = ds.assign_coords(lon=ds.coords['x'], lat=ds.coords['y'])
-    return ds
+def _open_ncep(fn, filter_by_keys=None):
+    return xr.open_dataset(fn, engine=engine,
+                           backend_kwargs=dict(indexpath=indexpath,
+                                               filter_by_keys=filter_by_keys or {}))
 
-def convert_time_hourly_ncep(ds, drop_time_vars=True):
-    # Combine initial_time0 and forecast_time0
-    ds = (ds
-          .stack(time=("initial_time0_hours", "forecast_time0"))
-          .assign_coords(time=np.ravel(ds.coords['initial_time0_hours'] + ds.coords['forecast_time0'] - pd.Timedelta('1h'))))
-    if drop_time_vars:
-        ds = ds.drop(['initial_time0', 'initial_time0_encoded'])
-    return ds
+def _hourly_time(ds):
+    # Combine initial time and forecast step
+    time = np.atleast_1d(ds.coords['time'].values)
+    step = np.atleast_1d(ds.coords['step'].values)
+    return (time[:, np.newaxis] + step[np.newaxis, :] - np.timedelta64(1, 'h')).ravel()
+
+def _grid_indexers(lons, lats, xs, ys):
+    # Lons should go from -180. to +180.
+    lons = np.where(lons <= 180, lons, lons - 360.)
+    lon_i = np.flatnonzero((lons >= min(xs.start, xs.stop)) &
+                           (lons <= max(xs.start, xs.stop)))
+    lon_i = lon_i[np.argsort(lons[lon_i], kind='mergesort')]
+    lat_i = np.flatnonzero((lats >= min(ys.start, ys.stop)) &
+                           (lats <= max(ys.start, ys.stop)))
+    return lon_i, lat_i, lons[lon_i], lats[lat_i]
+
+def _forecast_times(ds):
+    # Initial times and forecast steps of `ds`, or None if it has none
+    if 'time' not in ds.coords or 'step' not in ds.coords:
+        return None
+    return (np.atleast_1d(ds.coords['time'].values),
+            np.atleast_1d(ds.coords['step'].values))
+
+def get_selection_ncep(fn, xs, ys, filter_by_keys=None):
+    """
+    Determine the positional longitude and latitude indexers of the cutout
+    in the GRIB file `fn` and its hourly time coordinate.
 
-def convert_unaverage_ncep(ds):
-    # the fields ending in _avg contain averages which have to be unaveraged by using
+    The selection is determined once per month from the month's reference
+    file and passed to the tasks of all variables, which use it if they are
+    on the same grid and have the same forecast times (see `read_ncep`).
+    """
+    xs = _as_slice(xs)
+    ys = _as_slice(ys)
+    with _open_ncep(fn, filter_by_keys) as ds:
+        lons = ds.indexes['longitude'].values
+        lats = ds.indexes['latitude'].values
+        lon_i, lat_i, x, y = _grid_indexers(lons, lats, xs, ys)
+        forecast_times = _forecast_times(ds)
+
+        return dict(lons=lons, lats=lats, xs=xs, ys=ys,
+                    lon_i=lon_i, lat_i=lat_i, x=x, y=y,
+                    forecast_times=forecast_times,
+                    time=_hourly_time(ds) if forecast_times is not None else None)
+
+def convert_unaverage_ncep(values, axis=1):
+    # the fields with the GRIB_stepType avg contain averages which have to be
+    # unaveraged by using
     # \begin{equation}
     # \tilde x_1 = x_1 \quad \tilde x_i = i \cdot x_i - (i - 1) \cdot x_{i-1} \quad \forall i > 1
     # \end{equation}
-
-    def unaverage(da, dim='forecast_time0'):
-        coords = da.coords[dim]
-        y = da * xr.DataArray(np.arange(1, len(coords)+1), dims=[dim], coords={dim: coords})
-        return y - y.shift(**{dim: 1}).fillna(0.)
-    for k, da in iteritems(ds):
-        if k.endswith('_avg'):
-            ds[k[:-len('_avg')]] = unaverage(da)
-            ds = ds.drop(k)
-
-    return ds
-
-def convert_unaccumulate_ncep(ds):
-    # the fields ending in _acc contain values that are accumulated over the
-    # forecast_time which have to be unaccumulated by using:
+    # which is computed in place on the forecast step `axis` of `values` by
+    # multiplying with the ramp i and unaccumulating the result
+
+    shape = [1] * values.ndim
+    shape[axis] = values.shape[axis]
+    values *= np.arange(1, values.shape[axis]+1, dtype=values.dtype).reshape(shape)
+    return convert_unaccumulate_ncep(values, axis=axis)
+
+def convert_unaccumulate_ncep(values, axis=1):
+    # the fields with the GRIB_stepType accum contain values that are
+    # accumulated over the forecast_time which have to be unaccumulated by
+    # using:
     # \begin{equation}
     # \tilde x_1 = x_1
     # \tilde x_i = x_i - x_{i-1} \forall 1 < i <= 6
     # \end{equation}
     # Source: http://rda.ucar.edu/datasets/ds094.1/#docs/FAQs_hrly_timeseries.html
+    # The difference is computed in place from the last step backwards.
 
-    def unaccumulate(da, dim='forecast_time0'):
-        return da - da.shift(**{dim: 1}).fillna(0.)
-    for k, da in iteritems(ds):
-        if k.endswith('_acc'):
-            ds[k[:-len('_acc')]] = unaccumulate(da)
-            ds = ds.drop(k)
-
-    return ds
+    v = np.moveaxis(values, axis, 0)
+    for i in range(v.shape[0] - 1, 0, -1):
+        v[i] -= v[i-1]
+    return values
 
 def convert_clip_lower(ds, variable, a_min, value):
     """
-    Set values of `variable` that are below `a_min` to `value`.
+    Set values of `variable` that are below `a_min` (or NaN) to `value`.
     Similar to `numpy.clip`.
     """
-    ds[variable] = ds[variable].where(ds[variable] > a_min).fillna(value)
+    values = ds[variable].values
+    with np.errstate(invalid='ignore'):
+        values[~(values > a_min)] = value
     return ds
 
-def prepare_wnd10m_ncep(fn, yearmonth, xs, ys, engine=engine):
-    with xr.open_dataset(fn, engine=engine) as ds:
-        ds = convert_lons_lats_ncep(ds, xs, ys)
-        ds = convert_time_hourly_ncep(ds)
-        ds['wnd10m'] = np.sqrt(ds['VGRD_P0_L103_GGA0']**2 + ds['UGRD_P0_L103_GGA0']**2)
-        ds = ds.drop(['VGRD_P0_L103_GGA0', 'UGRD_P0_L103_GGA0'])
-        yield yearmonth, ds
-
-def prepare_influx_ncep(fn, yearmonth, xs, ys, engine=engine):
-    with xr.open_dataset(fn, engine=engine) as ds:
-        ds = convert_lons_lats_ncep(ds, xs, ys)
-        ds = convert_unaverage_ncep(ds)
-        ds = convert_time_hourly_ncep(ds)
-
-        ds = ds.rename({'DSWRF_P8_L1_GGA0': 'influx'})
-        # clipping random fluctuations around zero
-        ds = convert_clip_lower(ds, 'influx', a_min=0.1, value=0.)
-        yield yearmonth, ds
-
-def prepare_outflux_ncep(fn, yearmonth, xs, ys, engine=engine):
-    with xr.open_dataset(fn, engine=engine) as ds:
-        ds = convert_lons_lats_ncep(ds, xs, ys)
-        ds = convert_unaverage_ncep(ds)
-        ds = convert_time_hourly_ncep(ds)
-
-        ds = ds.rename({'USWRF_P8_L1_GGA0': 'outflux'})
-        # clipping random fluctuations around zero
-        ds = convert_clip_lower(ds, 'outflux', a_min=3., value=0.)
-        yield yearmonth, ds
-
-def prepare_temperature_ncep(fn, yearmonth, xs, ys, engine=engine):
-    with xr.open_dataset(fn, engine=engine) as ds:
-        ds = convert_lons_lats_ncep(ds, xs, ys)
-        ds = convert_time_hourly_ncep(ds)
-
-        ds = ds.rename({'TMP_P0_L103_GGA0': 'temperature'})
-        yield yearmonth, ds
-
-def prepare_soil_temperature_ncep(fn, yearmonth, xs, ys, engine=engine):
-    with xr.open_dataset(fn, engine=engine) as ds:
-        ds = convert_lons_lats_ncep(ds, xs, ys)
-        ds = convert_time_hourly_ncep(ds)
-
-        ds = ds.rename({'TMP_P0_2L106_GGA0': 'soil temperature'})
-        yield yearmonth, ds
-
-def prepare_runoff_ncep(fn, yearmonth, xs, ys, engine=engine):
-    with xr.open_dataset(fn, engine=engine) as ds:
-        ds = convert_lons_lats_ncep(ds, xs, ys)
-        # runoff has missing values: set nans to 0
-        ds = ds.fillna(0.)
-        ds = convert_unaccumulate_ncep(ds)
-        ds = convert_time_hourly_ncep(ds)
-
-        ds = ds.rename({'WATR_P8_L1_GGA0': 'runoff'})
-        yield yearmonth, ds
-
-def prepare_height_ncep(fn, xs, ys, yearmonths, engine=engine):
-    with xr.open_dataset(fn, engine=engine) as ds:
-        ds = convert_lons_lats_ncep(ds, xs, ys)
-        ds = ds.rename({'HGT_P0_L105_GGA0': 'height'})
-        for ym in yearmonths:
-            yield ym, ds
-
-def prepare_roughness_ncep(fn, yearmonth, xs, ys, engine=engine):
-    with xr.open_dataset(fn, engine=engine) as ds:
-        ds = convert_lons_lats_ncep(ds, xs, ys)
-        ds = ds.rename({'SFCR_P8_L1_GGA0': 'roughness'})
-        ds = ds.assign_coords(year=yearmonth[0]).assign_coords(month=yearmonth[1])
-        yield yearmonth, ds
-
-def prepare_meta_ncep(xs, ys, year, month, template, height_config, module, engine=engine):
+def read_ncep(fn, selection, filter_by_keys=None, static=False, fill_value=None):
+    """
+    Read the cutout from all variables of the GRIB file `fn` matching
+    `filter_by_keys` and convert them to an hourly time series on the
+    (time, y, x) grid.
+
+    The positional indexers of `selection` (see `get_selection_ncep`) are
+    only used if the file is on the grid they were determined on, otherwise
+    the cutout is selected by the coordinate values of the file. Likewise,
+    its hourly time coordinate is only used if the initial times and
+    forecast steps of the file match the ones of the selection.
+
+    Averaged and accumulated forecast fields are converted to hourly
+    values. If `static` is set, the variables are read without time axis.
+    """
+    with _open_ncep(fn, filter_by_keys) as ds:
+        lons = ds.indexes['longitude'].values
+        lats = ds.indexes['latitude'].values
+        if (np.array_equal(lons, selection['lons']) and
+            np.array_equal(lats, selection['lats'])):
+            lon_i, lat_i, x, y = (selection['lon_i'], selection['lat_i'],
+                                  selection['x'], selection['y'])
+        else:
+            logger.debug("Grid of %s differs from the shared selection, "
+                         "selecting by coordinates", os.path.basename(fn))
+            lon_i, lat_i, x, y = _grid_indexers(lons, lats, selection['xs'], selection['ys'])
+
+        ds = ds.isel(latitude=lat_i, longitude=lon_i)
+        forecast_times = _forecast_times(ds)
+
+        coords = dict(x=x, y=y, lon=('x', x), lat=('y', y))
+
+        if static:
+            if fill_value is not None:
+                ds = ds.fillna(fill_value)
+            data_vars = {k: (('y', 'x'), da.transpose('latitude', 'longitude').values, da.attrs)
+                         for k, da in iteritems(ds.data_vars)}
+            return xr.Dataset(data_vars, coords)
+
+        for dim in ('step', 'time'):
+            if dim not in ds.dims:
+                ds = ds.expand_dims(dim)
+        ds = ds.transpose('time', 'step', 'latitude', 'longitude')
+
+        # Instant, averaged and accumulated fields may have different steps
+        reference = selection['forecast_times']
+        if (reference is not None and forecast_times is not None and
+            all(np.array_equal(a, b) for a, b in zip(forecast_times, reference))):
+            time = selection['time']
+        else:
+            time = _hourly_time(ds)
+
+        data_vars = {}
+        for k, da in iteritems(ds.data_vars):
+            # Each variable is decoded once into a contiguous (time, step, y,
+            # x) buffer, which is converted in place and then reshaped
+            # without copying into the hourly (time, y, x) order
+            values = np.ascontiguousarray(da.values)
+            if not values.flags.writeable:
+                values = values.copy()
+            if fill_value is not None:
+                np.copyto(values, fill_value, where=np.isnan(values))
+
+            step_type = da.attrs.get('GRIB_stepType')
+            if step_type == 'avg':
+                convert_unaverage_ncep(values)
+            elif step_type == 'accum':
+                convert_unaccumulate_ncep(values)
+
+            data_vars[k] = (('time', 'y', 'x'),
+                            values.reshape((-1,) + values.shape[2:]),
+                            da.attrs)
+
+        coords['time'] = time
+        return xr.Dataset(data_vars, coords)
+
+def _single_variable(ds, newname):
+    oldname, = ds.data_vars
+    return ds.rename({oldname: newname})
+
+def prepare_wnd10m_ncep(fn, yearmonth, selection, filter_by_keys=None):
+    ds = read_ncep(fn, selection, filter_by_keys)
+    u, v = ds.data_vars.values()
+    ds = xr.Dataset({'wnd10m': np.sqrt(u**2 + v**2)})
+    yield yearmonth, ds
+
+def prepare_influx_ncep(fn, yearmonth, selection, filter_by_keys=None):
+    ds = _single_variable(read_ncep(fn, selection, filter_by_keys), 'influx')
+    # clipping random fluctuations around zero
+    ds = convert_clip_lower(ds, 'influx', a_min=0.1, value=0.)
+    yield yearmonth, ds
+
+def prepare_outflux_ncep(fn, yearmonth, selection, filter_by_keys=None):
+    ds = _single_variable(read_ncep(fn, selection, filter_by_keys), 'outflux')
+    # clipping random fluctuations around zero
+    ds = convert_clip_lower(ds, 'outflux', a_min=3., value=0.)
+    yield yearmonth, ds
+
+def prepare_temperature_ncep(fn, yearmonth, selection, filter_by_keys=None):
+    ds = _single_variable(read_ncep(fn, selection, filter_by_keys), 'temperature')
+    yield yearmonth, ds
+
+def prepare_soil_temperature_ncep(fn, yearmonth, selection, filter_by_keys=None):
+    ds = _single_variable(read_ncep(fn, selection, filter_by_keys), 'soil temperature')
+    yield yearmonth, ds
+
+def prepare_runoff_ncep(fn, yearmonth, selection, filter_by_keys=None):
+    # runoff has missing values: set nans to 0
+    ds = _single_variable(read_ncep(fn, selection, filter_by_keys, fill_value=0.), 'runoff')
+    yield yearmonth, ds
+
+def prepare_height_ncep(fn, xs, ys, yearmonths, filter_by_keys=None):
+    selection = get_selection_ncep(fn, xs, ys, filter_by_keys)
+    ds = _single_variable(read_ncep(fn, selection, filter_by_keys, static=True), 'height')
+    for ym in yearmonths:
+        yield ym, ds
+
+def prepare_roughness_ncep(fn, yearmonth, selection, filter_by_keys=None):
+    ds = _single_variable(read_ncep(fn, selection, filter_by_keys, static=True), 'roughness')
+    ds = ds.assign_coords(year=yearmonth[0]).assign_coords(month=yearmonth[1])
+    yield yearmonth, ds
+
+def prepare_meta_ncep(xs, ys, year, month, template, height_config, module):
     fn = next(glob.iglob(template.format(year=year, month=month)))
-    with xr.open_dataset(fn, engine=engine) as ds:
-        ds = ds.coords.to_dataset()
-        ds = convert_lons_lats_ncep(ds, xs, ys)
-        ds = convert_time_hourly_ncep(ds, drop_time_vars=False)
-        meta = ds.load()
+    selection = get_selection_ncep(fn, xs, ys)
+    meta = xr.Dataset(coords=dict(time=selection['time'],
+                                  x=selection['x'], y=selection['y'],
+                                  lon=('x', selection['x']), lat=('y', selection['y'])))
 
-    xs = ds['x'].values
-    ys = ds['y'].values
+    xs = meta['x'].values
+    ys = meta['y'].values
 
     height_config = height_config.copy()
     height_tasks_func = height_config.pop('tasks_func')
+    height_config.pop('static_variables', None)
     height_task, = height_tasks_func(xs, ys, [(year, month)], meta_attrs={}, **height_config)
     height_prepare_func = height_task.pop('prepare_func')
     _, ds = next(height_prepare_func(**height_task))
@@ -206,13 +279,19 @@ def prepare_meta_ncep(xs, ys, year, month, template, height_config, module, engi
 
     return meta
 
-def tasks_monthly_ncep(xs, ys, yearmonths, prepare_func, template, meta_attrs):
-    return [dict(prepare_func=prepare_func,
-                 xs=xs, ys=ys,
-                 fn=next(glob.iglob(template.format(year=ym[0], month=ym[1]))),
-                 engine=engine,
-                 yearmonth=ym)
-            for ym in yearmonths]
+def tasks_monthly_ncep(xs, ys, yearmonths, prepare_func, template, meta_attrs, filter_by_keys=None):
+    # The lon/lat indexers and time coordinate are determined once per month
+    # from the month's file of the meta data and passed to the tasks, which
+    # share them for all variables on the same grid
+    tasks = []
+    for year, month in yearmonths:
+        grid_fn = next(glob.iglob(meta_data_config['template'].format(year=year, month=month)))
+        tasks.append(dict(prepare_func=prepare_func,
+                          fn=next(glob.iglob(template.format(year=year, month=month))),
+                          selection=get_selection_ncep(grid_fn, xs, ys),
+                          filter_by_keys=filter_by_keys,
+                          yearmonth=(year, month)))
+    return tasks
 
 def tasks_height_ncep(xs, ys, yearmonths, prepare_func, template, meta_attrs, **extra_args):
     return [dict(prepare_func=prepare_func,
@@ -220,6 +299,7 @@ def tasks_height_ncep(xs, ys, yearmonths, prepare_func, template, meta_attrs, **
                  fn=next(glob.iglob(template)),
                  **extra_args)]
 
+# The GRIB messages are identified by the keys of GRIB2 code table 4.2
 weather_data_config = {
     'influx': dict(tasks_func=tasks_monthly_ncep,
                    prepare_func=prepare_influx_ncep,
@@ -241,10 +321,16 @@ weather_data_config = {
                    template=os.path.join(ncep_dir, '{year}{month:0>2}/runoff.*.grb2')),
     'roughness': dict(tasks_func=tasks_monthly_ncep,
                       prepare_func=prepare_roughness_ncep,
-                      template=os.path.join(ncep_dir, '{year}{month:0>2}/flxf.gdas.*.grb2')),
+                      template=os.path.join(ncep_dir, '{year}{month:0>2}/flxf.gdas.*.grb2'),
+                      filter_by_keys=dict(discipline=2, parameterCategory=0,
+                                          parameterNumber=1),
+                      static_variables=['roughness']),
     'height': dict(tasks_func=tasks_height_ncep,
                    prepare_func=prepare_height_ncep,
-                   template=os.path.join(ncep_dir, 'height/cdas1.20130101.splgrbanl.grb2'))
+                   template=os.path.join(ncep_dir, 'height/cdas1.20130101.splgrbanl.grb2'),
+                   filter_by_keys=dict(discipline=0, parameterCategory=3,
+                                       parameterNumber=5, typeOfLevel='hybrid'),
+                   static_variables=['height'])
 }
 
 meta_data_config = dict(prepare_func=prepare_meta_ncep,
@@ -25,7 +25,7 @@ from __future__ import absolute_import
 import pandas as pd
 import numpy as np
 import xarray as xr
-from functools import partial
+import dask.array as da
 import pyproj
 from six import iteritems
 from itertools import groupby
@@ -37,12 +37,28 @@ logger = logging.getLogger(__name__)
 
 from collections import deque
 from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 @contextmanager
 def receive(it):
     yield next(it)
     for i in it: pass
 
+@contextmanager
+def receive_concurrently(it):
+    """
+    Like `receive`, but advances `it` in a background thread, so that f.ex. a
+    download proceeds while the body runs; yields an AsyncResult.
+    """
+    pool = ThreadPool(1)
+    try:
+        result = pool.apply_async(next, (it,))
+        yield result
+        for i in it: pass
+    finally:
+        pool.close()
+        pool.join()
+
 def as_slice(zs, pad=True):
     if not isinstance(zs, slice):
         first, second, last = np.asarray(zs)[[0,1,-1]]
@@ -50,8 +66,53 @@ def as_slice(zs, pad=True):
         zs = slice(first - dz, last + dz)
     return zs
 
+def interpolate_gaps(y):
+    """
+    Fill NaNs in `y` by linear interpolation along the last axis.
+
+    Leading and trailing NaNs are filled with the first and last valid
+    value, series without any valid value are left untouched, reproducing
+    `np.interp` exactly. Instead of looping over the series, the gaps of all
+    of them are located at once as runs of consecutive NaNs in the flattened
+    array, so that the work scales with the number of missing values.
+    """
+    shape = y.shape
+    n = shape[-1]
+
+    pos = np.flatnonzero(np.isnan(y))
+    if len(pos) == 0:
+        return y
+
+    y = np.array(y, copy=True).reshape(-1)
+
+    # split the missing positions into runs, which never cross a series
+    col = pos % n
+    first = np.r_[True, np.diff(pos) != 1] | (col == 0)
+    last = np.r_[first[1:], True]
+    run = np.cumsum(first) - 1
+
+    has_prev = col[first] != 0
+    has_next = col[last] != n - 1
+    prev = np.where(has_prev, pos[first] - 1, pos[last] + 1)
+    nxt = np.where(has_next, pos[last] + 1, prev)
+
+    # series without any valid value stay NaN
+    fill = (has_prev | has_next)[run]
+    pos, prev, nxt = pos[fill], prev[run][fill], nxt[run][fill]
+
+    y0 = y[prev].astype(np.float64)
+    y1 = y[nxt].astype(np.float64)
+
+    # same arithmetic as np.interp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = (y1 - y0) / (nxt - prev) * (pos - prev) + y0
+    np.copyto(values, y0, where=(prev == nxt))
+    y[pos] = values
+
+    return y.reshape(shape)
+
 from ..config import sarah_dir
-from ..gis import regrid, Resampling, maybe_swap_spatial_dims
+from ..gis import regrid_kwargs, reproject_array, Resampling, maybe_swap_spatial_dims
 from .era5 import prepare_for_sarah
 
 # Model and Projection Settings
@@ -89,7 +150,27 @@ def prepare_meta_sarah(xs, ys, year, month, template_sis, template_sid, module,
 
         return ds.load()
 
-def prepare_month_sarah(era5_func, xs, ys, year, month, template_sis, template_sid, resolution):
+def hourly_fluxes(sis, sid, reproject_kwargs=None):
+    """
+    Average a block of half-hourly `sis` and `sid` values to hourly means and
+    derive the direct and diffuse influx from them.
+
+    If `reproject_kwargs` are given (see `gis.regrid_kwargs`), both fluxes are
+    regridded at once by a single (multi-threaded) reproject call.
+
+    Returns an array of shape (2, time, y, x) with direct and diffuse influx.
+    """
+    assert len(sis) % 2 == 0 and len(sid) == len(sis), \
+        "hourly_fluxes needs pairs of half-hourly values"
+    sis = (sis[0::2] + sis[1::2])/2
+    sid = (sid[0::2] + sid[1::2])/2
+    fluxes = np.stack([sid, sis - sid])
+    if reproject_kwargs is not None:
+        fluxes = reproject_array(fluxes, **reproject_kwargs)
+    return fluxes
+
+def prepare_month_sarah(era5_func, xs, ys, year, month, template_sis, template_sid,
+                        resolution, num_threads=1, time_chunk=24):
     with xr.open_mfdataset(template_sis.format(year=year, month=month)) as ds_sis, \
          xr.open_mfdataset(template_sid.format(year=year, month=month)) as ds_sid:
         ds = xr.merge([ds_sis, ds_sid])
@@ -97,55 +178,12 @@ def prepare_month_sarah(era5_func, xs, ys, year, month, template_sis, template_s
         ds = _rename_and_clean_coords(ds, add_lon_lat=False)
         ds = ds.sel(x=as_slice(xs), y=as_slice(ys))
 
-        def interpolate(ds, dim='time'):
-            def _interpolate1d(y):
-                nan = np.isnan(y)
-                if nan.all(): return y
-                x = lambda z: z.nonzero()[0]
-                y[nan] = np.interp(x(nan), x(~nan), y[~nan])
-                return y
-
-            def _interpolate(a):
-                return a.map_blocks(partial(np.apply_along_axis, _interpolate1d, -1), dtype=a.dtype)
-
-            data_vars = ds.data_vars.values() if isinstance(ds, xr.Dataset) else (ds,)
-            dtypes = {da.dtype for da in data_vars}
-            assert len(dtypes) == 1, "interpolate only supports datasets with homogeneous dtype"
-
-            return xr.apply_ufunc(_interpolate, ds,
-                                input_core_dims=[[dim]],
-                                output_core_dims=[[dim]],
-                                output_dtypes=[dtypes.pop()],
-                                output_sizes={dim: len(ds.indexes[dim])},
-                                dask='allowed',
-                                keep_attrs=True)
-
-        ds = interpolate(ds)
-
-        def hourly_mean(ds):
-            ds1 = ds.isel(time=slice(None, None, 2))
-            ds2 = ds.isel(time=slice(1, None, 2))
-            ds2 = ds2.assign_coords(time=ds2.indexes['time'] - pd.Timedelta(30, 'm'))
-            ds = ((ds1 + ds2)/2)
-            ds.attrs = ds1.attrs
-            for v in ds.variables:
-                ds[v].attrs = ds1[v].attrs
-            return ds
-
-        ds = hourly_mean(ds)
-
-        ds['influx_diffuse'] = ((ds['SIS'] - ds['SID'])
-                                .assign_attrs(long_name='Surface Diffuse Shortwave Flux',
-                                              units='W m-2'))
-        ds = ds.rename({'SID': 'influx_direct'}).drop('SIS')
-
+        # The target grid is known in advance, so the ERA5 data for it can be
+        # retrieved while the SARAH data is processed
         if resolution is not None:
-            ds = regrid(ds, xs, ys, resampling=Resampling.average)
-
-        x = ds.indexes['x']
-        y = ds.indexes['y']
-        xs = slice(*x[[0,-1]])
-        ys = slice(*y[[0,-1]])
+            x, y = xs, ys
+        else:
+            x, y = ds.indexes['x'], ds.indexes['y']
 
         lx, rx = x[[0, -1]]
         uy, ly = y[[0, -1]]
@@ -153,7 +191,69 @@ def prepare_month_sarah(era5_func, xs, ys, year, month, template_sis, template_s
         dy = float(uy - ly)/float(len(y)-1)
 
         logger.debug("Getting ERA5 data")
-        with receive(era5_func(year, month, xs, ys, dx, dy, chunks=dict(time=24))) as ds_era:
+        era5 = era5_func(year, month, slice(lx, rx), slice(uy, ly), dx, dy,
+                         chunks=dict(time=24))
+        with receive_concurrently(era5) as ds_era:
+            def interpolate(ds, dim='time'):
+                def _interpolate(a):
+                    return a.map_blocks(interpolate_gaps, dtype=a.dtype)
+
+                data_vars = ds.data_vars.values() if isinstance(ds, xr.Dataset) else (ds,)
+                dtypes = {da.dtype for da in data_vars}
+                assert len(dtypes) == 1, "interpolate only supports datasets with homogeneous dtype"
+
+                return xr.apply_ufunc(_interpolate, ds,
+                                    input_core_dims=[[dim]],
+                                    output_core_dims=[[dim]],
+                                    output_dtypes=[dtypes.pop()],
+                                    output_sizes={dim: len(ds.indexes[dim])},
+                                    dask='allowed',
+                                    keep_attrs=True)
+
+            ds = interpolate(ds)
+
+            # Hourly averaging, the diffuse influx and regridding are fused
+            # into one step per block of `time_chunk` hours, which pairs the
+            # half-hourly values by position
+            time = ds.indexes['time']
+            assert (len(time) > 1 and time[0] == time[0].floor('h') and
+                    (np.diff(time.values) == np.timedelta64(30, 'm')).all()), \
+                "SARAH data must be half-hourly without missing time steps, starting on the hour"
+            nt = len(time) // 2
+            ds = ds.isel(time=slice(0, 2*nt))
+            chunks = {'time': 2*time_chunk,
+                      'y': len(ds.indexes['y']), 'x': len(ds.indexes['x'])}
+            sis = ds['SIS'].transpose('time', 'y', 'x').chunk(chunks).data
+            sid = ds['SID'].transpose('time', 'y', 'x').chunk(chunks).data
+
+            if resolution is not None:
+                reproject_kwargs = regrid_kwargs(ds.indexes['x'], ds.indexes['y'],
+                                                 xs, ys, resampling=Resampling.average,
+                                                 num_threads=num_threads)
+            else:
+                reproject_kwargs = None
+
+            fluxes = da.map_blocks(hourly_fluxes, sis, sid,
+                                   reproject_kwargs=reproject_kwargs,
+                                   new_axis=0, dtype=sis.dtype,
+                                   chunks=((2,), tuple(c//2 for c in sis.chunks[0]),
+                                           (len(y),), (len(x),)))
+
+            dims = ('time', 'y', 'x')
+            coords = {'time': ds.coords['time'].isel(time=slice(None, None, 2)),
+                      'y': ('y', y, ds.coords['y'].attrs),
+                      'x': ('x', x, ds.coords['x'].attrs)}
+            ds = xr.Dataset({'influx_direct': (dims, fluxes[0], ds['SID'].attrs),
+                             'influx_diffuse': (dims, fluxes[1],
+                                                dict(long_name='Surface Diffuse Shortwave Flux',
+                                                     units='W m-2'))},
+                            coords=coords, attrs=ds.attrs)
+
+            logger.debug("Processing SARAH data")
+            ds = ds.load()
+
+            ds_era = ds_era.get()
+
             logger.debug("Merging SARAH and ERA5 data")
             ds_era = ds_era.assign_coords(x=ds.indexes['x'], y=ds.indexes['y'])
             ds = xr.merge([ds, ds_era]).assign_attrs(ds.attrs)
@@ -161,14 +261,16 @@ def prepare_month_sarah(era5_func, xs, ys, year, month, template_sis, template_s
 
             yield ((year, month), ds)
 
-def tasks_monthly_sarah(xs, ys, yearmonths, prepare_func, era5_func, template_sis, template_sid, meta_attrs):
+def tasks_monthly_sarah(xs, ys, yearmonths, prepare_func, era5_func, template_sis, template_sid,
+                        meta_attrs, num_threads=1, time_chunk=24):
     resolution = meta_attrs.get('resolution', None)
 
     return [dict(prepare_func=prepare_func,
                  era5_func=era5_func,
                  template_sis=template_sis, template_sid=template_sid,
                  xs=xs, ys=ys, year=year, month=month,
-                 resolution=resolution)
+                 resolution=resolution,
+                 num_threads=num_threads, time_chunk=time_chunk)
             for year, month in yearmonths]
 
 weather_data_config = {
@@ -176,7 +278,13 @@ weather_data_config = {
               prepare_func=prepare_month_sarah,
               era5_func=prepare_for_sarah,
               template_sid=os.path.join(sarah_dir, 'sid', 'SIDin{year}{month:02}*.nc'),
-              template_sis=os.path.join(sarah_dir, 'sis', 'SISin{year}{month:02}*.nc'))
+              template_sis=os.path.join(sarah_dir, 'sis', 'SISin{year}{month:02}*.nc'),
+              # threads per task for regridding, on top of the processes
+              # of `cutout_prepare` (see its `num_threads` argument)
+              num_threads=1,
+              time_chunk=24,
+              variables=['influx_direct', 'influx_diffuse', 'temperature',
+                         'influx_toa', 'albedo'])
 }
 
 meta_data_config = dict(prepare_func=prepare_meta_sarah,
@@ -25,17 +25,28 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 import scipy as sp, scipy.sparse
+import hashlib
 from collections import OrderedDict
 from warnings import warn
 from six import string_types, iteritems
 from six.moves import map, range
 from itertools import product
 from functools import partial
+from multiprocessing import Pool, cpu_count
+import heapq
 import pyproj
 from shapely.prepared import prep
 from shapely.ops import transform
+try:
+    # shapely >= 2 provides vectorized operations on geometry arrays
+    import shapely
+    from shapely import STRtree
+    has_shapely2 = True
+except ImportError:
+    has_shapely2 = False
 import rasterio as rio
 import rasterio.warp
+import rasterio.windows
 from rasterio.warp import Resampling
 
 import logging
@@ -65,6 +76,44 @@ def as_projection(p):
     else:
         return pyproj.Proj(p)
 
+def _projection_key(p):
+    if isinstance(p, pyproj.Proj):
+        return "{}:{}".format(type(p).__name__, p.srs)
+    elif isinstance(p, dict):
+        return repr(sorted(iteritems(p)))
+    else:
+        return repr(p)
+
+_point_transforms = {}
+
+def _point_transform(p1, p2):
+    """
+    Function transforming arrays of x and y coordinates from `p1` to `p2`,
+    created once per pair of projections.
+    """
+    key = (_projection_key(p1), _projection_key(p2))
+    if key in _point_transforms:
+        return _point_transforms[key]
+
+    if isinstance(p1, RotProj):
+        if p2 != 'latlong':
+            raise NotImplementedError("`p1` can only be a RotProj if `p2` is latlong!")
+        func = lambda x, y: p1(x, y, inverse=True)
+    elif isinstance(p2, RotProj):
+        to_latlong = _point_transform(p1, 'latlong') if p1 != 'latlong' else None
+        def func(x, y):
+            if to_latlong is not None:
+                x, y = to_latlong(x, y)
+            return p2(x, y)
+    elif hasattr(pyproj, 'Transformer'):
+        func = pyproj.Transformer.from_proj(as_projection(p1), as_projection(p2),
+                                            always_xy=True).transform
+    else:
+        func = partial(pyproj.transform, as_projection(p1), as_projection(p2))
+
+    _point_transforms[key] = func
+    return func
+
 def reproject_shapes(shapes, p1, p2):
     """
     Project a collection of `shapes` from one projection `p1` to
@@ -73,39 +122,43 @@ def reproject_shapes(shapes, p1, p2):
     Projections can be given as strings or instances of pyproj.Proj.
     Special care is taken for the case where the final projection is
     of type rotated pole as handled by RotProj.
+
+    The transformation between two projections is set up only once. With
+    shapely >= 2 the vertices of all shapes are transformed in one call.
     """
 
     if p1 == p2:
         return shapes
 
-    if isinstance(p1, RotProj):
-        if p2 == 'latlong':
-            reproject_points = lambda x,y: p1(x, y, inverse=True)
-        else:
-            raise NotImplementedError("`p1` can only be a RotProj if `p2` is latlong!")
+    reproject_points = _point_transform(p1, p2)
 
-    if isinstance(p2, RotProj):
-        shapes = reproject(shapes, p1, 'latlong')
-        reproject_points = p2
+    if isinstance(shapes, dict):
+        keys, values = list(shapes.keys()), list(shapes.values())
     else:
-        reproject_points = partial(pyproj.transform, as_projection(p1), as_projection(p2))
+        values = list(shapes)
 
-    def _reproject_shape(shape):
-        return transform(reproject_points, shape)
+    if has_shapely2:
+        def _reproject_coords(coords):
+            x, y = reproject_points(coords[:, 0], coords[:, 1])
+            return np.column_stack((x, y))
+        values = list(shapely.transform(_as_geometry_array(values), _reproject_coords))
+    else:
+        values = [transform(reproject_points, shape) for shape in values]
 
     if isinstance(shapes, pd.Series):
-        return shapes.map(_reproject_shape)
+        return pd.Series(values, index=shapes.index, name=shapes.name)
     elif isinstance(shapes, dict):
-        return OrderedDict((k, _reproject_shape(v)) for k, v in iteritems(shapes))
+        return OrderedDict(zip(keys, values))
     else:
-        return list(map(_reproject_shape, shapes))
+        return values
 
 def reproject(shapes, p1, p2):
     warn("reproject has been renamed to reproject_shapes", DeprecationWarning)
     return reproject_shapes(shapes, p1, p2)
 reproject.__doc__ = reproject_shapes.__doc__
 
-def compute_indicatormatrix(orig, dest, orig_proj='latlong', dest_proj='latlong'):
+def compute_indicatormatrix(orig, dest, orig_proj='latlong', dest_proj='latlong',
+                            nprocesses=1):
     """
     Compute the indicatormatrix
 
@@ -122,6 +175,10 @@ def compute_indicatormatrix(orig, dest, orig_proj='latlong', dest_proj='latlong'
     ---------
     orig : Collection of shapely polygons
     dest : Collection of shapely polygons
+    nprocesses : int
+      Number of processes to compute the matrix on (default: 1). With more
+      than one (or None for all processors), dest is split into batches of
+      balanced cost, orig is sent once to each process.
 
     Returns
     -------
@@ -130,7 +187,24 @@ def compute_indicatormatrix(orig, dest, orig_proj='latlong', dest_proj='latlong'
     """
 
     dest = reproject_shapes(dest, dest_proj, orig_proj)
-    indicator = sp.sparse.lil_matrix((len(dest), len(orig)), dtype=np.float)
+
+    if nprocesses != 1:
+        cell_area = np.mean([o.area for o in orig])
+        return _map_shape_batches(_indicatormatrix_batch, dest, len(orig),
+                                  nprocesses, cell_area,
+                                  initializer=_init_indicatormatrix_worker,
+                                  initargs=(orig,))
+
+    return _compute_indicatormatrix(orig, dest)
+
+def _compute_indicatormatrix(orig, dest):
+    if has_shapely2:
+        return _compute_indicatormatrix_vectorized(orig, dest)
+    return _compute_indicatormatrix_reference(orig, dest)
+
+def _compute_indicatormatrix_reference(orig, dest):
+    # Intersects each shape of dest with its candidate cells one by one
+    indicator = sp.sparse.lil_matrix((len(dest), len(orig)), dtype=float)
 
     try:
         from rtree.index import Index
@@ -157,6 +231,339 @@ def compute_indicatormatrix(orig, dest, orig_proj='latlong', dest_proj='latlong'
 
     return indicator
 
+def _balanced_batches(shapes, nbatches, cell_area):
+    # The cost of a shape is estimated as its number of vertices times the
+    # number of cells it might intersect; the shapes are then distributed
+    # greedily, the most expensive ones first, to the cheapest batch
+    cost = []
+    for s in shapes:
+        minx, miny, maxx, maxy = s.bounds
+        nvertices = len(s.wkb) // 16
+        cost.append(nvertices * (1. + (maxx - minx) * (maxy - miny) / cell_area))
+
+    batches = [[] for _ in range(min(nbatches, len(cost)))]
+    heap = [(0., b) for b in range(len(batches))]
+    for i in np.argsort(cost)[::-1]:
+        load, b = heapq.heappop(heap)
+        batches[b].append(i)
+        heapq.heappush(heap, (load + cost[i], b))
+
+    return [np.sort(b) for b in batches if b]
+
+def _map_shape_batches(func, shapes, ncols, nprocesses, cell_area,
+                       initializer=None, initargs=()):
+    # Apply `func` returning partial indicatormatrices to balanced batches of
+    # `shapes` in a process pool and merge the results
+    shapes = list(shapes)
+    if nprocesses is None:
+        nprocesses = cpu_count()
+    batches = _balanced_batches(shapes, 4 * nprocesses, cell_area)
+
+    pool = Pool(processes=nprocesses, initializer=initializer, initargs=initargs)
+    try:
+        results = pool.map(func, [[shapes[i] for i in b] for b in batches])
+    finally:
+        pool.close()
+        pool.join()
+
+    results = [m.tocoo() for m in results]
+    rows = np.concatenate([b[m.row] for b, m in zip(batches, results)] + [[]]).astype(int)
+    cols = np.concatenate([m.col for m in results] + [[]]).astype(int)
+    data = np.concatenate([m.data for m in results] + [[]])
+    return sp.sparse.coo_matrix((data, (rows, cols)), shape=(len(shapes), ncols)).tolil()
+
+_worker_orig = None
+
+def _init_indicatormatrix_worker(orig):
+    global _worker_orig
+    _worker_orig = orig
+
+def _indicatormatrix_batch(dest):
+    return _compute_indicatormatrix(_worker_orig, dest).tocoo()
+
+def _grid_indicatormatrix_batch(x, y, proj, shapes):
+    return compute_grid_indicatormatrix(x, y, shapes, proj, proj).tocoo()
+
+def _as_geometry_array(shapes):
+    shapes = list(shapes)
+    arr = np.empty(len(shapes), dtype=object)
+    arr[:] = shapes
+    return arr
+
+def _compute_indicatormatrix_vectorized(orig, dest):
+    # All intersecting pairs are found by a single bulk query of an STRtree.
+    # Intersections are only computed array-wise for the pairs at the
+    # boundaries of dest, orig shapes lying properly inside count fully.
+    orig = _as_geometry_array(orig)
+    dest = _as_geometry_array(dest)
+    shapely.prepare(dest)
+
+    i, j = STRtree(orig).query(dest, predicate='intersects')
+    orig_area = shapely.area(orig)
+
+    area = orig_area[j]
+    boundary = ~shapely.contains_properly(dest[i], orig[j])
+    area[boundary] = shapely.area(shapely.intersection(dest[i[boundary]], orig[j[boundary]]))
+
+    nonzero = area > 0
+    i, j = i[nonzero], j[nonzero]
+    return sp.sparse.coo_matrix((area[nonzero] / orig_area[j], (i, j)),
+                                shape=(len(dest), len(orig))).tolil()
+
+def _regular_spacing(c):
+    c = np.asarray(c, dtype=float)
+    if len(c) < 2:
+        return None
+    step = np.diff(c)
+    if not np.allclose(step, step[0], rtol=1e-6, atol=0.):
+        return None
+    return (c[-1] - c[0]) / (len(c) - 1)
+
+def is_regular_grid(x, y):
+    """Whether the cell centres `x` and `y` are equally spaced."""
+    return _regular_spacing(x) is not None and _regular_spacing(y) is not None
+
+def _split_edges(x0, x1, lines0, step, nlines):
+    # Parameters t in (0, 1) at which the edges from x0 to x1 cross the
+    # lines0 + k*step for k = 0, ..., nlines - 1
+    lo = np.clip(np.ceil((np.minimum(x0, x1) - lines0) / step), 0, nlines)
+    hi = np.clip(np.floor((np.maximum(x0, x1) - lines0) / step) + 1, 0, nlines)
+    counts = np.maximum(hi - lo, 0).astype(int)
+    edge = np.repeat(np.arange(len(x0)), counts)
+    k = lo[edge] + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (lines0 + k*step - x0[edge]) / (x1[edge] - x0[edge])
+    # edges lying on a line need not be cut
+    crossing = np.isfinite(t)
+    return edge[crossing], t[crossing]
+
+def compute_grid_indicatormatrix(x, y, shapes, grid_proj='latlong', shapes_proj='latlong',
+                                 nprocesses=1):
+    """
+    Compute the indicatormatrix of `shapes` on the regular grid with the cell
+    centres `x` and `y`
+
+    The result is the same as the one of `compute_indicatormatrix` for the
+    cells of the grid (ordered as by `Cutout.grid_cells`), but it is
+    calculated analytically without constructing a polygon for each cell:
+    All polygon edges are cut at the grid lines and the area of each shape
+    in the cells of a grid column follows from integrating the pieces of its
+    boundary along the column (Green's theorem). Needs shapely >= 2.
+
+    Parameters
+    ----------
+    x : array_like
+      Equally spaced x-coordinates of the cell centres
+    y : array_like
+      Equally spaced y-coordinates of the cell centres
+    shapes : Collection of shapely polygons
+    grid_proj : str|pyproj.Proj
+      Projection of the grid (default: latlong)
+    shapes_proj : str|pyproj.Proj
+      Projection of the shapes (default: latlong)
+    nprocesses : int
+      Number of processes to compute the matrix on (default: 1), see
+      `compute_indicatormatrix`
+
+    Returns
+    -------
+    I : sp.sparse.lil_matrix
+      Indicatormatrix
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    dx, dy = _regular_spacing(x), _regular_spacing(y)
+    if dx is None or dy is None:
+        raise ValueError("The grid coordinates `x` and `y` must be equally spaced.")
+    nx, ny = len(x), len(y)
+    dx, dy = abs(dx), abs(dy)
+    left = x.min() - dx/2.
+    bottom = y.min() - dy/2.
+
+    shapes = _as_geometry_array(reproject_shapes(shapes, shapes_proj, grid_proj))
+
+    if nprocesses != 1:
+        return _map_shape_batches(partial(_grid_indicatormatrix_batch, x, y, grid_proj),
+                                  shapes, nx * ny, nprocesses, dx * dy)
+
+    # Exterior and interior rings of all polygons and their edges
+    polygons, shape_idx = shapely.get_parts(shapes, return_index=True)
+    rings, polygon_idx = shapely.get_rings(polygons, return_index=True)
+    coords, ring_idx = shapely.get_coordinates(rings, return_index=True)
+
+    exterior = np.r_[True, polygon_idx[1:] != polygon_idx[:-1]]
+    same_ring = ring_idx[1:] == ring_idx[:-1]
+    x0, y0 = coords[:-1][same_ring].T
+    x1, y1 = coords[1:][same_ring].T
+    edge_ring = ring_idx[:-1][same_ring]
+
+    # Exteriors are integrated counter-clockwise and interiors clockwise
+    signed_area = np.bincount(edge_ring, x0*y1 - x1*y0, minlength=len(rings))
+    orientation = np.where(exterior, 1., -1.) * np.sign(signed_area)
+
+    # Cut the edges into pieces lying in single grid cells
+    ex, tx = _split_edges(x0, x1, left, dx, nx + 1)
+    ey, ty = _split_edges(y0, y1, bottom, dy, ny + 1)
+    nedges = len(x0)
+    edge = np.concatenate([np.arange(nedges), np.arange(nedges), ex, ey])
+    t = np.concatenate([np.zeros(nedges), np.ones(nedges), tx, ty])
+    order = np.lexsort((t, edge))
+    edge, t = edge[order], t[order]
+    piece = edge[1:] == edge[:-1]
+    edge, ta, tb = edge[:-1][piece], t[:-1][piece], t[1:][piece]
+
+    xa = x0[edge] + ta*(x1[edge] - x0[edge])
+    xb = x0[edge] + tb*(x1[edge] - x0[edge])
+    ya = y0[edge] + ta*(y1[edge] - y0[edge])
+    yb = y0[edge] + tb*(y1[edge] - y0[edge])
+
+    col = np.floor(((xa + xb)/2. - left) / dx).astype(int)
+    row = np.floor(((ya + yb)/2. - bottom) / dy).astype(int)
+
+    # Pieces beside the grid do not contribute, the ones below or above it
+    # are gathered in the rows -1 and ny, which only the ones below it
+    # contribute to
+    keep = (col >= 0) & (col < nx)
+    edge, col, row = edge[keep], col[keep], row[keep]
+    xa, xb, ya, yb = xa[keep], xb[keep], ya[keep], yb[keep]
+    row = np.clip(row, -1, ny)
+
+    sign = orientation[edge_ring[edge]]
+    shape = shape_idx[polygon_idx[edge_ring[edge]]]
+    width = sign * (xb - xa)
+    # Area between the piece and the top of its cell, the piece adds the
+    # full cell height times its width to all cells above it
+    area = width * (bottom + (row + 1)*dy - (ya + yb)/2.)
+
+    # Accumulate on the row ranges of each column of each shape
+    group, group_idx = np.unique(shape * nx + col, return_inverse=True)
+    group_idx = group_idx.ravel()
+    rmin = np.full(len(group), ny, dtype=int)
+    rmax = np.full(len(group), -1, dtype=int)
+    np.minimum.at(rmin, group_idx, row)
+    np.maximum.at(rmax, group_idx, row)
+    length = rmax - rmin + 1
+    start = np.cumsum(length) - length
+
+    pos = start[group_idx] + row - rmin[group_idx]
+    area = np.bincount(pos, area, minlength=length.sum())
+    width = np.bincount(pos, width, minlength=length.sum())
+    below = np.cumsum(width) - width
+    below -= np.repeat(below[start], length)
+    ratio = (area + dy * below) / (dx * dy)
+
+    cell_group = np.repeat(np.arange(len(group)), length)
+    cell_row = rmin[cell_group] + np.arange(length.sum()) - start[cell_group]
+    cell_shape, cell_col = np.divmod(group[cell_group], nx)
+
+    # Discard the rows outside the grid and numerical noise in empty cells
+    valid = (cell_row >= 0) & (cell_row < ny) & (ratio > 1e-9)
+    ratio, cell_shape = ratio[valid], cell_shape[valid]
+    cell_col, cell_row = cell_col[valid], cell_row[valid]
+
+    ix = cell_col if x[-1] >= x[0] else nx - 1 - cell_col
+    iy = cell_row if y[-1] >= y[0] else ny - 1 - cell_row
+
+    return sp.sparse.coo_matrix((np.minimum(ratio, 1.), (cell_shape, iy * nx + ix)),
+                                shape=(len(shapes), nx * ny)).tolil()
+
+def _axis_weights(c, p, method):
+    # Indices into `c` and weights to sample it at the positions `p`, both of
+    # shape (len(p), 1) for nearest and (len(p), 2) for linear interpolation
+    c = np.asarray(c, dtype=float)
+    n = len(c)
+    descending = c[-1] < c[0]
+    if descending:
+        c = c[::-1]
+
+    if method == 'nearest':
+        i = np.clip(np.searchsorted(c, p), 1, n - 1)
+        i -= (p - c[i-1]) <= (c[i] - p)
+        idx, w = i[:, None], np.ones((len(p), 1))
+    elif method == 'bilinear':
+        i = np.clip(np.searchsorted(c, p, side='right') - 1, 0, n - 2)
+        t = np.clip((p - c[i]) / (c[i+1] - c[i]), 0., 1.)
+        idx, w = np.column_stack((i, i + 1)), np.column_stack((1. - t, t))
+    else:
+        raise ValueError("`method` must be one of 'nearest' and 'bilinear'")
+
+    return (n - 1 - idx if descending else idx), w
+
+def compute_pointmatrix(x, y, px, py, grid_proj='latlong', points_proj='latlong',
+                        method='nearest'):
+    """
+    Compute the matrix sampling the grid with the cell centres `x` and `y`
+    at the points `px` and `py`
+
+    Row i holds the weights of the grid cells (ordered as by
+    `Cutout.grid_cells`) for point i, which sum to one. Points outside of the
+    grid get empty rows. The weights are computed array-wise from the
+    coordinates, without any polygons.
+
+    Parameters
+    ----------
+    x : array_like
+      x-coordinates of the cell centres, ordered monotonically
+    y : array_like
+      y-coordinates of the cell centres, ordered monotonically
+    px : array_like
+      x-coordinates of the points
+    py : array_like
+      y-coordinates of the points
+    grid_proj : str|pyproj.Proj
+      Projection of the grid (default: latlong)
+    points_proj : str|pyproj.Proj
+      Projection of the points (default: latlong)
+    method : 'nearest'|'bilinear'
+      Take the cell containing the point or interpolate bilinearly between
+      the four surrounding cell centres (default: 'nearest')
+
+    Returns
+    -------
+    M : sp.sparse.csr_matrix
+      Sampling matrix of shape (number of points, number of cells)
+    """
+
+    px = np.asarray(px, dtype=float)
+    py = np.asarray(py, dtype=float)
+    if points_proj != grid_proj:
+        px, py = _point_transform(points_proj, grid_proj)(px, py)
+        px, py = np.asarray(px, dtype=float), np.asarray(py, dtype=float)
+
+    nx, ny = len(x), len(y)
+    minx, miny, maxx, maxy = _grid_bounds(np.asarray(x, dtype=float),
+                                          np.asarray(y, dtype=float))
+    inside = (px >= minx) & (px <= maxx) & (py >= miny) & (py <= maxy)
+    if not inside.all():
+        logger.warning("%d of %d points lie outside of the grid and are ignored.",
+                       (~inside).sum(), len(inside))
+
+    ix, wx = _axis_weights(x, px[inside], method)
+    iy, wy = _axis_weights(y, py[inside], method)
+
+    rows = np.flatnonzero(inside)[:, None, None]
+    cols = iy[:, :, None] * nx + ix[:, None, :]
+    weights = wy[:, :, None] * wx[:, None, :]
+    rows, cols, weights = np.broadcast_arrays(rows, cols, weights)
+
+    return sp.sparse.csr_matrix((weights.ravel(), (rows.ravel(), cols.ravel())),
+                                shape=(len(px), nx * ny))
+
+def indicatormatrix_key(x, y, shapes, grid_proj='latlong', shapes_proj='latlong'):
+    """
+    Hash identifying the indicatormatrix of `shapes` on the grid with the
+    cell centres `x` and `y`, f.ex. to cache it.
+    """
+    key = hashlib.sha1()
+    key.update(np.asarray(x, dtype=np.float64).tobytes())
+    key.update(np.asarray(y, dtype=np.float64).tobytes())
+    key.update(_projection_key(grid_proj).encode())
+    key.update(_projection_key(shapes_proj).encode())
+    for shape in shapes:
+        key.update(shape.wkb)
+    return key.hexdigest()
+
 def maybe_swap_spatial_dims(ds, namex='x', namey='y'):
     swaps = {}
     lx, rx = ds.indexes[namex][[0, -1]]
@@ -176,13 +583,214 @@ def _as_transform(x, y):
     dx = float(rx - lx)/float(len(x)-1)
     dy = float(uy - ly)/float(len(y)-1)
 
-    return rio.transform.from_origin(lx, uy, dx, dy)
+    # x and y are cell centres, the origin is the upper left cell corner
+    return rio.transform.from_origin(lx - dx/2., uy + dy/2., dx, dy)
+
+def _average_weights(c, dimc):
+    # Share of each cell around `dimc` covered by the cells around `c` (both
+    # regular and in the same order) as a sparse (len(dimc), len(c)) matrix
+    c, dimc = np.asarray(c, dtype=float), np.asarray(dimc, dtype=float)
+    flip = c[-1] < c[0]
+    if flip:
+        c, dimc = c[::-1], dimc[::-1]
+
+    step, dstep = _regular_spacing(c), _regular_spacing(dimc)
+    e = c[0] - step/2. + step * np.arange(len(c) + 1)
+    de = dimc[0] - dstep/2. + dstep * np.arange(len(dimc) + 1)
+
+    first = np.clip(np.searchsorted(e, de[:-1], side='right') - 1, 0, len(c) - 1)
+    last = np.clip(np.searchsorted(e, de[1:], side='left'), first + 1, len(c))
+    n = last - first
+    rows = np.repeat(np.arange(len(dimc)), n)
+    cols = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n - first, n)
+    share = (np.minimum(e[cols + 1], de[rows + 1]) - np.maximum(e[cols], de[rows])) / dstep
+
+    if flip:
+        rows, cols = len(dimc) - 1 - rows, len(c) - 1 - cols
+    return sp.sparse.csr_matrix((share, (rows, cols)), shape=(len(dimc), len(c)))
+
+def _nearest_indices(c, dimc):
+    # Index of the cell around `c` which contains each of `dimc`
+    step = _regular_spacing(c)
+    return np.floor((np.asarray(dimc, dtype=float) - (c[0] - step/2.)) / step).astype(int)
+
+class RegridKernel(object):
+    """
+    Separable resampling kernel between two regular grids in the same crs,
+    applied with sparse matrix products (average) or indexing (nearest)
+    instead of GDAL's warper.
+
+    The results agree with rio.warp.reproject up to floating point rounding;
+    as with GDAL, an averaged cell is NaN if it overlaps any NaN source cell.
+    Destination cells centred exactly on a boundary between two source cells
+    take the value of the latter one, while GDAL's choice at such ties
+    depends on the rounding of its approximate transformer.
+    """
+
+    def __init__(self, x, y, dimx, dimy, resampling):
+        self.resampling = resampling
+        if resampling == Resampling.average:
+            self.wx = _average_weights(x, dimx)
+            self.wy = _average_weights(y, dimy)
+            # Dense products with small weight matrices are much faster
+            if self.wx.shape[0] * self.wx.shape[1] <= self.dense_size:
+                self.wx = self.wx.toarray()
+            if self.wy.shape[0] * self.wy.shape[1] <= self.dense_size:
+                self.wy = self.wy.toarray()
+            self._dense_weights = {}
+        else:
+            self.ix = _nearest_indices(x, dimx)
+            self.iy = _nearest_indices(y, dimy)
+
+    # Maximal number of elements of a dense weight matrix
+    dense_size = 2**22
+
+    @staticmethod
+    def applicable(x, y, dimx, dimy, src_crs, dst_crs, resampling):
+        if src_crs != dst_crs or resampling not in (Resampling.average, Resampling.nearest):
+            return False
+        if any(_regular_spacing(c) is None for c in (x, y, dimx, dimy)):
+            return False
+        # Only for destination grids within the source grid (f.ex. when
+        # coarsening), since GDAL leaves the cells outside of it untouched
+        minx, miny, maxx, maxy = _grid_bounds(x, y)
+        dminx, dminy, dmaxx, dmaxy = _grid_bounds(dimx, dimy)
+        tol = 1e-6 * max(abs(x[1] - x[0]), abs(y[1] - y[0]))
+        return (minx - tol <= dminx and dmaxx <= maxx + tol and
+                miny - tol <= dminy and dmaxy <= maxy + tol)
+
+    def _weights(self, dtype):
+        # Dense weights in the precision of the data, which spares
+        # converting the data to float64
+        if dtype not in self._dense_weights:
+            self._dense_weights[dtype] = tuple(w.astype(dtype) if isinstance(w, np.ndarray) else w
+                                               for w in (self.wx, self.wy))
+        return self._dense_weights[dtype]
+
+    def _average(self, src):
+        # (n, y, x) -> (n, yout, xout)
+        n, ny, nx = src.shape
+        wx, wy = self._weights(src.dtype)
+        if isinstance(wx, np.ndarray):
+            a = np.matmul(src, wx.T)
+        else:
+            # (n, y, x) -> (xout, n*y) -> (n, y, xout)
+            a = self.wx.dot(src.reshape(n * ny, nx).T).T.reshape(n, ny, -1)
+        if isinstance(wy, np.ndarray):
+            return np.matmul(wy, a)
+        # (n, y, xout) -> (y, n*xout) -> (yout, n, xout) -> (n, yout, xout)
+        a = wy.dot(a.transpose(1, 0, 2).reshape(ny, -1))
+        return a.reshape(a.shape[0], n, -1).transpose(1, 0, 2)
+
+    def __call__(self, src, out):
+        # src, out : (n, y, x)
+        if self.resampling == Resampling.nearest:
+            np.take(src[:, self.iy], self.ix, axis=-1, out=out)
+            return out
+
+        nan = np.isnan(src)
+        bands = np.flatnonzero(nan.any(axis=(1, 2)))
+        if len(bands) == 0:
+            out[...] = self._average(src)
+            return out
+
+        # NaNs would spread over the whole band in the matrix products, the
+        # bands with NaNs are averaged with zeros and masked afterwards
+        valid = np.flatnonzero(~nan.any(axis=(1, 2)))
+        if len(valid):
+            out[valid] = self._average(src[valid])
+        nan = nan[bands]
+        filled = self._average(np.where(nan, 0, src[bands]))
+        filled[self._average(nan.astype(src.dtype)) > 1e-6] = np.nan
+        out[bands] = filled
+        return out
+
+_regrid_kernels = OrderedDict()
+_regrid_kernels_size = 16
+
+def regrid_kwargs(x, y, dimx, dimy, **kwargs):
+    """
+    Arguments to `reproject_array` for regridding data on the grid `x`, `y`
+    onto `dimx`, `dimy`.
+
+    `x`, `y`, `dimx` and `dimy` are cell centres from west to east and from
+    north to south; `kwargs` are passed on to rio.warp.reproject and may
+    override src_crs and dst_crs (default: latlong).
+
+    The transforms and, for `average` or `nearest` resampling between
+    regular grids in the same crs, a `RegridKernel` are cached, so that they
+    are reused by the regridding of subsequent months and variables.
+    """
+    kwargs.setdefault("src_crs", 'longlat')
+    kwargs.setdefault("dst_crs", 'longlat')
+
+    key = hashlib.sha1()
+    for c in (x, y, dimx, dimy):
+        key.update(np.asarray(c, dtype=float).tobytes())
+    key.update(repr((kwargs['src_crs'], kwargs['dst_crs'],
+                     kwargs.get('resampling', Resampling.nearest))).encode())
+    key = key.hexdigest()
+
+    cached = _regrid_kernels.pop(key, None)
+    if cached is None:
+        resampling = kwargs.get('resampling', Resampling.nearest)
+        cached = dict(dst_shape=(len(dimy), len(dimx)),
+                      src_transform=_as_transform(x, y),
+                      dst_transform=_as_transform(dimx, dimy))
+        if RegridKernel.applicable(x, y, dimx, dimy, kwargs['src_crs'],
+                                   kwargs['dst_crs'], resampling):
+            cached['kernel'] = RegridKernel(x, y, dimx, dimy, resampling)
+        while len(_regrid_kernels) >= _regrid_kernels_size:
+            _regrid_kernels.popitem(last=False)
+    _regrid_kernels[key] = cached
+
+    kwargs.update(cached)
+    return kwargs
+
+def reproject_array(src, dst_shape, kernel=None, out=None, chunksize=None, **kwargs):
+    """
+    Reproject the array `src` of shape (..., y, x) onto `dst_shape`.
+
+    The leading dimensions are treated as bands and processed in chunks of
+    `chunksize` bands (default: all at once), which are written into the
+    preallocated array `out` (allocated if not given). Each chunk is
+    resampled by `kernel` if given (see `regrid_kwargs`) or by a single
+    call to rio.warp.reproject (pass f.ex. num_threads and warp_mem_limit).
+    """
+    src = np.asarray(src)
+    if out is None:
+        out = np.empty(src.shape[:-2] + tuple(dst_shape), dtype=src.dtype)
+    if kernel is not None and not (np.issubdtype(src.dtype, np.floating) or
+                                   kernel.resampling == Resampling.nearest):
+        kernel = None
+
+    src_bands = src.reshape((-1,) + src.shape[-2:])
+    dst_bands = out.reshape((-1,) + out.shape[-2:])
+    nbands = len(src_bands)
+    chunksize = chunksize or max(nbands, 1)
+    for i in range(0, nbands, chunksize):
+        s, d = src_bands[i:i+chunksize], dst_bands[i:i+chunksize]
+        if kernel is not None:
+            kernel(s, d)
+        else:
+            rio.warp.reproject(s, d, **kwargs)
+    return out
 
-def regrid(ds, dimx, dimy, **kwargs):
+def regrid(ds, dimx, dimy, num_threads=1, warp_mem_limit=0, chunksize=None, **kwargs):
     """
     Interpolate Dataset or DataArray `ds` to a new grid, using rasterio's
     reproject facility.
 
+    Regridding with `average` or `nearest` resampling between regular grids
+    in the same crs, f.ex. when coarsening cutouts, uses an equivalent
+    separable kernel instead of GDAL (see `RegridKernel`). The transforms
+    and kernels are cached across calls.
+
+    The coordinates of `ds`, `dimx` and `dimy` are cell centres. Earlier
+    versions placed the raster origin on the first cell centre instead of
+    its corner, which shifted all results (f.ex. of the SARAH preparation)
+    by half a source cell; cutouts regridded by them differ accordingly.
+
     See also: https://mapbox.github.io/rasterio/topics/resampling.html
 
     Parameters
@@ -195,6 +803,13 @@ def regrid(ds, dimx, dimy, **kwargs):
     dimy : pd.Index
       New y-coordinates in destination crs.
       dimy.name MUST refer to y-coord of ds.
+    num_threads : int
+      Number of threads used by GDAL for warping (default: 1)
+    warp_mem_limit : int
+      Working memory of GDAL's warper in MB (default: 0, GDAL's default)
+    chunksize : int
+      Number of slices (f.ex. time steps) resampled at once into the output
+      array (default: all)
     **kwargs :
       Arguments passed to rio.wrap.reproject; of note:
       - resampling is one of gis.Resampling.{average,cubic,bilinear,nearest}
@@ -205,28 +820,18 @@ def regrid(ds, dimx, dimy, **kwargs):
 
     ds = maybe_swap_spatial_dims(ds, namex, namey)
 
-    src_transform = _as_transform(ds.indexes[namex],
-                                  ds.indexes[namey])
-    dst_transform = _as_transform(dimx, dimy)
-    dst_shape = len(dimy), len(dimx)
-
-    kwargs.update(dst_shape=dst_shape,
-                  src_transform=src_transform,
-                  dst_transform=dst_transform)
-    kwargs.setdefault("src_crs", 'longlat')
-    kwargs.setdefault("dst_crs", 'longlat')
-
-    def _reproject(src, dst_shape, **kwargs):
-        dst = np.empty(src.shape[:-2] + dst_shape, dtype=src.dtype)
-        rio.warp.reproject(np.asarray(src), dst, **kwargs)
-        return dst
+    kwargs = regrid_kwargs(ds.indexes[namex], ds.indexes[namey],
+                           dimx, dimy, num_threads=num_threads,
+                           warp_mem_limit=warp_mem_limit, chunksize=chunksize,
+                           **kwargs)
+    dst_shape = kwargs['dst_shape']
 
     data_vars = ds.data_vars.values() if isinstance(ds, xr.Dataset) else (ds,)
     dtypes = {da.dtype for da in data_vars}
     assert len(dtypes) == 1, "regrid can only reproject datasets with homogeneous dtype"
 
     return (
-        xr.apply_ufunc(_reproject, ds,
+        xr.apply_ufunc(reproject_array, ds,
                        input_core_dims=[[namey, namex]],
                        output_core_dims=[['yout', 'xout']],
                        output_dtypes=[dtypes.pop()],
@@ -238,3 +843,75 @@ def regrid(ds, dimx, dimy, **kwargs):
                             namex: (namex, dimx, ds.coords[namex].attrs)})
         .assign_attrs(**ds.attrs)
     )
+
+def _grid_bounds(x, y):
+    dx = float(x[-1] - x[0])/float(len(x)-1)
+    dy = float(y[-1] - y[0])/float(len(y)-1)
+    minx, maxx = sorted((x[0] - dx/2., x[-1] + dx/2.))
+    miny, maxy = sorted((y[0] - dy/2., y[-1] + dy/2.))
+    return minx, miny, maxx, maxy
+
+def regrid_raster(fn, dimx, dimy, dst_crs='EPSG:4326', band=1,
+                  resampling=Resampling.average, dtype=np.float32, **kwargs):
+    """
+    Resample band `band` of the raster file `fn` onto the grid given by
+    `dimx` and `dimy`.
+
+    Only the window of the raster covering the grid bounds (plus a margin
+    of one pixel) is read, so that small grids do not need to read large
+    (f.ex. global) rasters.
+
+    Parameters
+    ----------
+    fn : str
+      Filename of a raster readable by rasterio (f.ex. GeoTIFF or netCDF)
+    dimx : pd.Index
+      x-coordinates of the cell centres in `dst_crs`
+    dimy : pd.Index
+      y-coordinates of the cell centres in `dst_crs`, from north to south
+    dst_crs : str|dict
+      crs of the grid (default: latlong)
+    band : int
+      Raster band to read (default: 1)
+    resampling : gis.Resampling
+      Resampling method (default: average)
+    dtype : np.dtype
+      dtype of the returned values (default: float32)
+    **kwargs :
+      Further arguments passed to rio.warp.reproject
+
+    Returns
+    -------
+    da : xr.DataArray
+      Resampled raster values on the (dimy, dimx) grid
+    """
+
+    dimx = pd.Index(dimx, name=getattr(dimx, 'name', None) or 'x')
+    dimy = pd.Index(dimy, name=getattr(dimy, 'name', None) or 'y')
+
+    with rio.open(fn) as src:
+        bounds = _grid_bounds(dimx, dimy)
+        if src.crs:
+            bounds = rio.warp.transform_bounds(dst_crs, src.crs, *bounds)
+
+        window = rio.windows.from_bounds(*bounds, transform=src.transform)
+        col_off = int(np.floor(window.col_off)) - 1
+        row_off = int(np.floor(window.row_off)) - 1
+        window = (rio.windows.Window(col_off, row_off,
+                                     int(np.ceil(window.col_off + window.width)) + 1 - col_off,
+                                     int(np.ceil(window.row_off + window.height)) + 1 - row_off)
+                  .intersection(rio.windows.Window(0, 0, src.width, src.height)))
+
+        source = src.read(band, window=window, out_dtype=dtype)
+        src_transform = src.window_transform(window)
+        src_crs = src.crs if src.crs else dst_crs
+        src_nodata = src.nodata
+
+    destination = np.empty((len(dimy), len(dimx)), dtype=dtype)
+    rio.warp.reproject(source, destination,
+                       src_transform=src_transform, src_crs=src_crs,
+                       src_nodata=src_nodata,
+                       dst_transform=_as_transform(dimx, dimy), dst_crs=dst_crs,
+                       resampling=resampling, **kwargs)
+
+    return xr.DataArray(destination, [(dimy.name, dimy), (dimx.name, dimx)])
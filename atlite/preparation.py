@@ -27,13 +27,19 @@ import pandas as pd
 import numpy as np
 import os, shutil
 import logging
-import tempfile
-import shutil
-import subprocess
+import hashlib
+import json
+import time
+import tracemalloc
 from glob import glob
-from six import itervalues
+from collections import namedtuple
+from six import iteritems
 from six.moves import map
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from .gis import regrid, regrid_raster, as_projection, Resampling
+from .pv.solar_position import SolarPositionVariables, solar_position_variables
 
 logger = logging.getLogger(__name__)
 
@@ -68,7 +74,54 @@ def cutout_do_task(task, write_to_file=True):
                             prepare_func.__name__, e.args[0])
             raise e
 
-def cutout_prepare(cutout, overwrite=False, nprocesses=None, gebco_height=False):
+def _collect_tasks(cutout, xs, ys, yearmonths, num_threads=None):
+    tasks = []
+    for name, series in iteritems(cutout.weather_data_config):
+        series = series.copy()
+        series['meta_attrs'] = cutout.meta.attrs
+        if num_threads is not None and 'num_threads' in series:
+            series['num_threads'] = num_threads
+        tasks_func = series.pop('tasks_func')
+        series.pop('variables', None)
+        series.pop('static_variables', None)
+        tasks += [(name, t) for t in tasks_func(xs=xs, ys=ys, yearmonths=yearmonths, **series)]
+    return tasks
+
+def cutout_prepare(cutout, overwrite=False, nprocesses=None, gebco_height=False,
+                   solar_position=False, dry_run=False, calibrate=False,
+                   num_threads=None):
+    """
+    Prepare the monthly files of the cutout from the weather data source.
+
+    Parameters
+    ----------
+    overwrite : bool
+        Whether to recalculate an already prepared cutout (default: False).
+    nprocesses : int
+        Number of processes to run the preparation tasks on (defaults to all
+        processors).
+    num_threads : int
+        Number of threads each task of a dataset supporting it (f.ex. SARAH)
+        uses for regridding, in addition to the `nprocesses` processes
+        (defaults to the dataset configuration).
+    gebco_height : bool
+        Whether to replace the height with the one from GEBCO (default: False).
+    solar_position : bool
+        Whether to store the solar altitude and azimuth in the monthly files,
+        which are then used by `pv` and `solar_thermal` instead of computing
+        them on every run (default: False), see `cutout_add_solar_position`.
+    dry_run : bool
+        If True, nothing is prepared and an estimate of the resources the
+        preparation would need is returned instead, see
+        `cutout_estimate_preparation`.
+    calibrate : bool
+        Refine the estimate of a `dry_run` with a calibration run on a small
+        part of the cutout (default: False).
+    """
+    if dry_run:
+        return cutout_estimate_preparation(cutout, calibrate=calibrate,
+                                           nprocesses=nprocesses)
+
     if cutout.prepared and not overwrite:
         raise ArgumentError("The cutout is already prepared. If you want to recalculate it, "
                             "anyway, then you must supply an `overwrite=True` argument.")
@@ -93,17 +146,15 @@ def cutout_prepare(cutout, overwrite=False, nprocesses=None, gebco_height=False)
     cutout.meta.unstack('year-month').to_netcdf(cutout.datasetfn())
 
     # Compute data and fill files
-    tasks = []
-    for series in itervalues(cutout.weather_data_config):
-        series = series.copy()
-        series['meta_attrs'] = cutout.meta.attrs
-        tasks_func = series.pop('tasks_func')
-        tasks += tasks_func(xs=xs, ys=ys, yearmonths=yearmonths, **series)
+    tasks = [t for _, t in _collect_tasks(cutout, xs, ys, yearmonths,
+                                          num_threads=num_threads)]
     for i, t in enumerate(tasks):
         def datasetfn_with_id(ym):
             base, ext = os.path.splitext(cutout.datasetfn(ym))
             return base + "-{}".format(i) + ext
         t['datasetfns'] = {ym: datasetfn_with_id(ym) for ym in yearmonths.tolist()}
+        # static data is yielded for the yearmonth None and goes into meta.nc
+        t['datasetfns'][None] = os.path.join(cutout_dir, "static-{}.nc".format(i))
 
     logger.info("%d tasks have been collected. Starting running them on %s.",
                 len(tasks),
@@ -123,6 +174,18 @@ def cutout_prepare(cutout, overwrite=False, nprocesses=None, gebco_height=False)
         raise e
     pool.close()
 
+    static_fns = glob(os.path.join(cutout_dir, "static-*.nc"))
+    if static_fns:
+        logger.info("Merging static variables into the meta data")
+        for fn in sorted(static_fns):
+            with xr.open_dataset(fn) as ds:
+                for v in ds.data_vars:
+                    if gebco_height and v == 'height':
+                        continue
+                    cutout.meta[v] = ds[v].load()
+        cutout.meta.unstack('year-month').to_netcdf(cutout.datasetfn())
+        for tfn in static_fns: os.unlink(tfn)
+
     logger.info("Merging variables into monthly compound files")
 
     for fn in map(cutout.datasetfn, yearmonths.tolist()):
@@ -141,22 +204,338 @@ def cutout_prepare(cutout, overwrite=False, nprocesses=None, gebco_height=False)
             for tfn in fns: os.unlink(tfn)
         logger.debug("Completed file %s", os.path.basename(fn))
 
+    if solar_position:
+        _add_solar_position(cutout, yearmonths, nprocesses=nprocesses)
+
+    write_manifest(cutout_dir, cutout.meta, nthreads=nprocesses)
+    cutout.manifest = read_manifest(cutout_dir)
+
     logger.info("Cutout '%s' has been successfully prepared", cutout.name)
     cutout.prepared = True
 
+manifest_fn = 'manifest.json'
+
+def _file_entry(fn, blocksize=2**20):
+    sha1 = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha1.update(block)
+    return dict(size=os.path.getsize(fn), sha1=sha1.hexdigest())
+
+def _cutout_files(meta):
+    return ["meta.nc"] + ["{}{:0>2}.nc".format(*ym)
+                          for ym in meta.coords['year-month'].to_index().tolist()]
+
+def write_manifest(cutout_dir, meta, nthreads=None):
+    """
+    Write the manifest of the prepared cutout in `cutout_dir`.
+
+    The manifest lists the module, variables, grid and months of the cutout
+    together with the size and sha1 checksum of each of its files. It allows
+    to open the cutout and serve its grid and months without decoding
+    `meta.nc` (see `read_manifest`), and its presence marks the preparation
+    as complete.
+    """
+    fns = _cutout_files(meta)
+    pool = ThreadPool(nthreads)
+    try:
+        entries = pool.map(_file_entry, [os.path.join(cutout_dir, fn) for fn in fns])
+    finally:
+        pool.close()
+
+    with xr.open_dataset(os.path.join(cutout_dir, fns[1])) as ds:
+        variables = sorted(ds.data_vars)
+
+    def grid(c):
+        c = meta.indexes[c]
+        return dict(start=float(c[0]), stop=float(c[-1]), size=len(c),
+                    dtype=str(c.dtype), values=[float(v) for v in c])
+
+    manifest = dict(module=meta.attrs.get('module'),
+                    variables=variables,
+                    x=grid('x'), y=grid('y'),
+                    yearmonths=[[int(y), int(m)] for y, m in
+                                meta.coords['year-month'].to_index().tolist()],
+                    files=dict(zip(fns, entries)))
+
+    with open(os.path.join(cutout_dir, manifest_fn), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def read_manifest(cutout_dir):
+    """Return the manifest of the cutout in `cutout_dir` or None if there is none."""
+    fn = os.path.join(cutout_dir, manifest_fn)
+    if not os.path.isfile(fn):
+        return None
+    with open(fn) as f:
+        return json.load(f)
+
+def cutout_verify(cutout, checksums=True, nthreads=None):
+    """
+    Check that all files of the cutout exist and match their manifest.
+
+    Parameters
+    ----------
+    checksums : bool
+        Whether to compare the sha1 checksums of the files as well, which
+        means reading them entirely (default: True). Otherwise only the
+        presence and sizes of the files are checked.
+    nthreads : int
+        Number of threads to checksum the files on (defaults to the number
+        of processors).
+
+    Raises
+    ------
+    IOError
+        If a file is missing or differs from the manifest. Cutouts without a
+        manifest can only be checked for missing files.
+    """
+    manifest = cutout.manifest
+    if manifest is not None:
+        files = manifest['files']
+    else:
+        logger.warning("Cutout '%s' has no manifest, only checking for missing files.",
+                       cutout.name)
+        files = {fn: None for fn in _cutout_files(cutout.meta)}
+
+    def check(fn):
+        path = os.path.join(cutout.cutout_dir, fn)
+        expected = files[fn]
+        if not os.path.isfile(path):
+            return 'missing'
+        if expected is None:
+            return None
+        if os.path.getsize(path) != expected['size']:
+            return 'wrong size'
+        if checksums and _file_entry(path)['sha1'] != expected['sha1']:
+            return 'wrong checksum'
+        return None
+
+    fns = sorted(files)
+    pool = ThreadPool(nthreads)
+    try:
+        problems = pool.map(check, fns)
+    finally:
+        pool.close()
+
+    problems = ["{} ({})".format(fn, p) for fn, p in zip(fns, problems) if p is not None]
+    if problems:
+        raise IOError("Cutout '{}' in {} is corrupt: {}"
+                      .format(cutout.name, cutout.cutout_dir, ", ".join(problems)))
+
+    logger.info("Verified %d files of cutout '%s'", len(fns), cutout.name)
+
+def cutout_do_solar_position_task(task):
+    fn = task['fn']
+    with xr.open_dataset(fn) as ds:
+        if all(name in ds for name, _ in solar_position_variables.values()):
+            return
+        if 'lon' not in ds.coords:
+            ds = ds.assign_coords(lon=task['lon'], lat=task['lat'])
+        solar_position = SolarPositionVariables(ds, packed=task['packed'])
+    solar_position = solar_position.reset_coords(drop=True).drop(list(solar_position.dims))
+    solar_position.to_netcdf(fn, mode='a')
+    logger.debug("Added the solar position to %s", os.path.basename(fn))
+
+def _add_solar_position(cutout, yearmonths, packed=False, nprocesses=None):
+    lon, lat = (cutout.meta.coords[c] if c in cutout.meta.coords else None
+                for c in ('lon', 'lat'))
+    tasks = [dict(fn=cutout.datasetfn(ym), packed=packed, lon=lon, lat=lat)
+             for ym in yearmonths.tolist()]
+    pool = Pool(processes=nprocesses)
+    try:
+        pool.map(cutout_do_solar_position_task, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def cutout_add_solar_position(cutout, packed=False, nprocesses=None):
+    """
+    Store the solar altitude and azimuth in the monthly files of a prepared
+    cutout, which are then used by `pv` and `solar_thermal` instead of
+    computing them on every run.
+
+    Months which contain them already are skipped. The manifest of the
+    cutout is updated afterwards.
+
+    Parameters
+    ----------
+    packed : bool
+        Whether to store them as int16 with a resolution of 1e-4 rad or
+        better instead of float32 (default: False), see
+        `SolarPositionVariables`.
+    nprocesses : int
+        Number of processes to compute the monthly files with (defaults to
+        all processors).
+    """
+    assert cutout.prepared, "The cutout has to be prepared first."
+    if 'view' in cutout.meta.attrs:
+        raise NotImplementedError("Adding the solar position to a view is not supported, "
+                                  "use `derive` to materialise the view first.")
+
+    yearmonths = cutout.coords['year-month'].to_index()
+    logger.info("Adding the solar position to %d monthly files of cutout '%s'",
+                len(yearmonths), cutout.name)
+    _add_solar_position(cutout, yearmonths, packed=packed, nprocesses=nprocesses)
+
+    write_manifest(cutout.cutout_dir, cutout.meta, nthreads=nprocesses)
+    cutout.manifest = read_manifest(cutout.cutout_dir)
+
 def cutout_produce_specific_dataseries(cutout, yearmonth, series_name):
     xs = cutout.coords['x']
     ys = cutout.coords['y']
     series = cutout.weather_data_config[series_name].copy()
     series['meta_attrs'] = cutout.meta.attrs
     tasks_func = series.pop('tasks_func')
+    series.pop('variables', None)
+    series.pop('static_variables', None)
     tasks = tasks_func(xs=xs, ys=ys, yearmonths=[yearmonth], **series)
 
     assert len(tasks) == 1
-    data = cutout_do_task(tasks[0], write_to_file=False)
-    assert len(data) == 1 and data[0][0] == yearmonth
+    data = list(cutout_do_task(tasks[0], write_to_file=False))
+    assert len(data) == 1 and data[0][0] in (yearmonth, None)
     return data[0][1]
 
+PreparationEstimate = namedtuple('PreparationEstimate', ['tasks', 'nbytes'])
+
+# Without calibration, output is assumed to be float32 (per time step, except
+# for the `static_variables` of a series) and a task is assumed to hold this
+# many copies of the monthly output of its series in memory
+_default_itemsize = 4
+_default_memory_factor = 3.
+
+def _task_yearmonths(task, yearmonths):
+    # The tasks_funcs of the dataset modules refer to the months they are
+    # responsible for by one of the following keys
+    if 'yearmonth' in task:
+        return [tuple(task['yearmonth'])]
+    elif 'yearmonths' in task:
+        return [tuple(ym) for ym in task['yearmonths']]
+    elif 'year' in task and 'months' in task:
+        return [(task['year'], m) for m in task['months']]
+    elif 'year' in task and 'month' in task:
+        return [(task['year'], task['month'])]
+    else:
+        return yearmonths.tolist()
+
+def _calibrate_series(cutout, xs, ys, yearmonths):
+    calibration = {}
+    for name, task in _collect_tasks(cutout, xs, ys, yearmonths):
+        if name in calibration:
+            continue
+
+        logger.info("Calibrating the preparation of series '%s'", name)
+        tracemalloc.start()
+        start = time.time()
+        try:
+            per_value = {}
+            nbytes = 0
+            for _, ds in cutout_do_task(task, write_to_file=False):
+                ds = ds.load()
+                for v, da in ds.data_vars.items():
+                    cells = da.sizes.get('x', 1) * da.sizes.get('y', 1)
+                    # bytes per cell and time step (per cell for static fields)
+                    per_value[v] = (float(da.nbytes) / cells /
+                                    (da.sizes['time'] if 'time' in da.dims else 1),
+                                    'time' in da.dims)
+                    nbytes += da.nbytes
+                break
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        duration = time.time() - start
+
+        calibration[name] = dict(per_value=per_value,
+                                 memory_factor=float(peak) / max(nbytes, 1),
+                                 duration_per_byte=duration / max(nbytes, 1))
+    return calibration
+
+def cutout_estimate_preparation(cutout, calibrate=False, nprocesses=None,
+                                calibration_size=(8, 8)):
+    """
+    Estimate the resources needed for preparing `cutout` without touching
+    any data.
+
+    The tasks are collected from the `tasks_func` of each series in the
+    dataset module. Without calibration the output is assumed to consist of
+    float32 values of the variables named in the series config, and the
+    peak memory of a task is assumed to be a fixed multiple of the monthly
+    output of its series.
+
+    With `calibrate`, the first task of each series is run for the first
+    month on a window of `calibration_size` cells, measuring the size of the
+    actual output variables, the peak memory allocated through python and
+    numpy relative to the output and the run time per output byte, which
+    are then scaled to the full cutout. The run time includes fixed
+    overheads (f.ex. download queues) and is thus a rough upper bound.
+
+    Returns
+    -------
+    estimate : PreparationEstimate
+        Named tuple with `tasks`, a pd.DataFrame with the series, the number
+        of months, the estimated peak memory (bytes) and duration (s) of
+        each task, and `nbytes`, a pd.DataFrame with the expected output
+        bytes per variable (columns) and month (index).
+    """
+    yearmonths = cutout.coords['year-month'].to_index()
+    xs = cutout.meta.indexes['x']
+    ys = cutout.meta.indexes['y']
+    ncells = len(xs) * len(ys)
+
+    times = cutout.meta.indexes['time']
+    ntimes = (pd.Series(1, index=times)
+              .groupby([times.year, times.month]).sum()
+              .reindex(yearmonths, fill_value=0))
+
+    if calibrate:
+        calibration = _calibrate_series(cutout,
+                                        xs[:calibration_size[0]],
+                                        ys[:calibration_size[1]],
+                                        yearmonths[:1])
+    else:
+        calibration = {}
+
+    nbytes = {}
+    series_nbytes = {}
+    for name, series in iteritems(cutout.weather_data_config):
+        if name in calibration:
+            per_value = calibration[name]['per_value']
+        else:
+            variables = series.get('variables', [name])
+            static = series.get('static_variables', ())
+            per_value = {v: (_default_itemsize, v not in static) for v in variables}
+
+        series_nbytes[name] = pd.Series(0., index=yearmonths)
+        for v, (itemsize, has_time) in iteritems(per_value):
+            nbytes[v] = itemsize * ncells * (ntimes if has_time else 1.)
+            series_nbytes[name] += nbytes[v]
+    nbytes = pd.DataFrame(nbytes, index=yearmonths)
+
+    tasks = []
+    for name, task in _collect_tasks(cutout, xs, ys, yearmonths):
+        months = _task_yearmonths(task, yearmonths)
+        monthly = series_nbytes[name].reindex(months).fillna(0.)
+        if name in calibration:
+            memory = calibration[name]['memory_factor'] * monthly.max()
+            duration = calibration[name]['duration_per_byte'] * monthly.sum()
+        else:
+            memory = _default_memory_factor * monthly.max()
+            duration = np.nan
+        tasks.append(dict(series=name, prepare_func=task['prepare_func'].__name__,
+                          months=len(months), memory=memory, duration=duration))
+    tasks = pd.DataFrame(tasks, columns=['series', 'prepare_func', 'months',
+                                         'memory', 'duration'])
+
+    nparallel = nprocesses if nprocesses is not None else os.cpu_count()
+    logger.info("Preparing cutout '%s' would run %d tasks, write %.2f GB and need up to "
+                "%.2f GB of memory per task (%.2f GB with %d parallel tasks)%s",
+                cutout.name, len(tasks), nbytes.values.sum() / 1e9,
+                tasks['memory'].max() / 1e9,
+                tasks['memory'].nlargest(nparallel).sum() / 1e9, nparallel,
+                ", taking about {:.1f} minutes".format(tasks['duration'].sum() / nparallel / 60.)
+                if calibrate else "")
+
+    return PreparationEstimate(tasks, nbytes)
+
 def cutout_get_meta(cutout, xs, ys, years, months=None, **dataset_params):
     if months is None:
         months = slice(1, 12)
@@ -207,37 +586,312 @@ def cutout_get_meta_view(cutout, xs=None, ys=None, years=slice(None), months=sli
 
     return meta
 
+def _derived_cutout_dir(cutout, name, cutout_dir, overwrite):
+    if cutout_dir is None:
+        cutout_dir = os.path.dirname(cutout.cutout_dir)
+    target_dir = os.path.join(cutout_dir, name)
+
+    if os.path.abspath(target_dir) == os.path.abspath(cutout.cutout_dir):
+        raise ValueError("The new cutout must not replace the cutout it is derived from.")
+    if os.path.isdir(target_dir):
+        if not overwrite:
+            raise ValueError("The cutout '{}' exists already. If you want to replace it, "
+                             "then you must supply an `overwrite=True` argument.".format(name))
+        logger.debug("Deleting cutout_dir '%s'", target_dir)
+        shutil.rmtree(target_dir)
+
+    return cutout_dir, target_dir
+
+def _write_derived_cutout(cutout, name, target_dir, meta, do_task, tasks, nprocesses):
+    logger.info("Deriving cutout '%s' from '%s' with %d monthly files on %s.",
+                name, cutout.name, len(tasks),
+                ("%d processes" % nprocesses)
+                if nprocesses is not None
+                else "all processors")
+
+    os.mkdir(target_dir)
+    meta.unstack('year-month').to_netcdf(os.path.join(target_dir, "meta.nc"))
+
+    pool = Pool(processes=nprocesses)
+    try:
+        pool.map(do_task, tasks)
+    except Exception as e:
+        pool.terminate()
+        logger.info("Derivation of cutout '%s' has been interrupted by an exception. "
+                    "Purging the incomplete cutout_dir.", name)
+        shutil.rmtree(target_dir)
+        raise e
+    pool.close()
+
+    write_manifest(target_dir, meta, nthreads=nprocesses)
+
+    logger.info("Cutout '%s' has been successfully derived from '%s'", name, cutout.name)
+
+def cutout_do_derive_task(task):
+    # Stream the selection in time chunks to keep memory bounded
+    with dask.config.set(scheduler='single-threaded'), \
+         xr.open_dataset(task['src'], chunks=dict(time=task['time_chunk'])) as ds:
+        try:
+            ds = ds.sel(x=task['xs'], y=task['ys'])
+            # The packing, chunking and compression of the source file do not
+            # necessarily fit the subset, netCDF picks them anew
+            for v in ds.variables.values():
+                v.encoding = {}
+            ds.to_netcdf(task['dst'])
+        except Exception as e:
+            logger.exception("Exception occured while deriving `%s` from `%s`: %s",
+                             os.path.basename(task['dst']), task['src'], e.args[0])
+            raise e
+    logger.debug("Completed file %s", os.path.basename(task['dst']))
+
+def cutout_derive(cutout, name, xs=None, ys=None, years=slice(None),
+                  months=slice(None), cutout_dir=None, overwrite=False,
+                  nprocesses=None, time_chunk=24*7):
+    """
+    Derive a new cutout from the monthly files of an already prepared one.
+
+    Instead of preparing the new cutout from the raw weather data source,
+    the spatial and temporal subset is copied from `cutout` month by month
+    in parallel processes.
+
+    Parameters
+    ----------
+    name : str
+        Name of the new cutout.
+    xs, ys : slice
+        Spatial extent of the new cutout (ys from north to south), defaults
+        to the extent of `cutout`.
+    years, months : slice
+        Temporal extent of the new cutout, defaults to the one of `cutout`.
+    cutout_dir : str
+        Directory to place the new cutout in (defaults to the directory of
+        `cutout`).
+    overwrite : bool
+        Whether to replace an existing cutout `name` (default: False).
+    nprocesses : int
+        Number of processes to copy the monthly files with (defaults to all
+        processors).
+    time_chunk : int
+        Number of time steps read and written at once.
+
+    Returns
+    -------
+    cutout : Cutout
+        The derived and prepared cutout.
+    """
+    from .cutout import Cutout
+
+    assert cutout.prepared, "The cutout has to be prepared first."
+
+    cutout_dir, target_dir = _derived_cutout_dir(cutout, name, cutout_dir, overwrite)
+
+    indexers = {}
+    if xs is not None:
+        indexers['x'] = xs
+    if ys is not None:
+        if ys.start is not None and ys.stop is not None and ys.stop > ys.start:
+            logger.warn("ys slices are expected from north to south, i.e. slice(70, 40) for europe.")
+            ys = slice(ys.stop, ys.start)
+        indexers['y'] = ys
 
-def _prepare_gebco_height(xs, ys, gebco_fn=None):
+    meta = (cutout.meta
+            .unstack('year-month')
+            .sel(year=years, month=months, **indexers)
+            .stack(**{'year-month': ('year', 'month')}))
+    meta = meta.sel(time=slice(*("{:04}-{:02}".format(*ym)
+                                 for ym in meta['year-month'][[0,-1]].to_index())))
+    meta.attrs = {k: v for k, v in meta.attrs.items() if k != 'view'}
+
+    tasks = [dict(src=cutout.datasetfn(ym),
+                  dst=os.path.join(target_dir, "{}{:0>2}.nc".format(*ym)),
+                  xs=meta.indexes['x'].values, ys=meta.indexes['y'].values,
+                  time_chunk=time_chunk)
+             for ym in meta.coords['year-month'].to_index().tolist()]
+
+    _write_derived_cutout(cutout, name, target_dir, meta,
+                          cutout_do_derive_task, tasks, nprocesses)
+
+    return Cutout(name, cutout_dir=cutout_dir)
+
+# Variables holding fluxes or accumulations over a time step are averaged
+# when coarsening in time, all others describe a state and are sampled.
+# Categorical variables are sampled in time and space.
+flux_variables = {'influx', 'influx_toa', 'influx_direct', 'influx_diffuse',
+                  'outflux', 'runoff'}
+categorical_variables = {'CWT'}
+
+def _coarsen_coords(coords, step):
+    coords = np.asarray(coords)
+    src_step = coords[1] - coords[0]
+    if step is None or np.isclose(abs(step), abs(src_step)):
+        return coords
+    if abs(step) < abs(src_step):
+        raise ValueError("Coarsening to a resolution of {} is impossible on a grid "
+                         "with a resolution of {}".format(abs(step), abs(src_step)))
+
+    step = np.copysign(step, src_step)
+    n = int(np.floor((coords[-1] - coords[0] + src_step) / step + 1e-6))
+    return coords[0] - src_step/2. + step/2. + step * np.arange(n)
+
+def _coarsen_dataset(ds, xs, ys, freq=None):
+    # The solar position cannot be averaged, it can be added again with
+    # `cutout_add_solar_position`
+    solar_vars = {name for name, _ in solar_position_variables.values()}
+    ds = ds.drop(list((set(ds.coords) & {'lon', 'lat'}) | (set(ds.data_vars) & solar_vars)))
+    regrid_spatial = not (ds.indexes['x'].equals(xs) and ds.indexes['y'].equals(ys))
+
+    data_vars = {}
+    for v, da in ds.data_vars.items():
+        attrs = da.attrs
+        if freq is not None and 'time' in da.dims:
+            resampler = da.resample(time=freq)
+            da = resampler.mean() if v in flux_variables else resampler.first()
+        if regrid_spatial and {'x', 'y'}.issubset(da.dims):
+            da = regrid(da, xs, ys,
+                        resampling=(Resampling.nearest
+                                    if v in categorical_variables
+                                    else Resampling.average))
+        data_vars[v] = da.assign_attrs(**attrs)
+
+    return xr.Dataset(data_vars, attrs=ds.attrs)
+
+def _add_lon_lat(ds, projection):
+    if projection == 'latlong':
+        return ds.assign_coords(lon=ds.coords['x'], lat=ds.coords['y'])
+
+    x, y = np.meshgrid(ds.indexes['x'], ds.indexes['y'])
+    lon, lat = as_projection(projection)(x, y, inverse=True)
+    return ds.assign_coords(lon=(('y', 'x'), lon), lat=(('y', 'x'), lat))
+
+def cutout_do_coarsen_task(task):
+    with dask.config.set(scheduler='single-threaded'), \
+         xr.open_dataset(task['src'], chunks=dict(time=task['time_chunk'])) as ds:
+        try:
+            ds = _coarsen_dataset(ds, task['xs'], task['ys'], task['freq'])
+            ds.assign_coords(lon=task['lon'], lat=task['lat']).to_netcdf(task['dst'])
+        except Exception as e:
+            logger.exception("Exception occured while coarsening `%s` into `%s`: %s",
+                             task['src'], os.path.basename(task['dst']), e.args[0])
+            raise e
+    logger.debug("Completed file %s", os.path.basename(task['dst']))
+
+def cutout_coarsen(cutout, name, dx=None, dy=None, freq=None, cutout_dir=None,
+                   overwrite=False, nprocesses=None, time_chunk=24*7):
+    """
+    Derive a cutout with a lower spatial and/or temporal resolution.
+
+    The weather data is regridded with an area-weighted average
+    (`gis.regrid` with `Resampling.average`) onto a grid spanning the same
+    extent. Fluxes (f.ex. `influx` or `runoff`) are averaged over the new
+    time steps, while state variables (f.ex. `temperature` or `wnd100m`)
+    are sampled at the beginning of each new time step. The months are
+    processed in parallel processes.
+
+    Parameters
+    ----------
+    name : str
+        Name of the new cutout.
+    dx, dy : float
+        New spatial resolution in the units of the cutout projection (f.ex.
+        0.5 for 0.5 deg), by default the spatial resolution is kept.
+    freq : str
+        New temporal resolution as a pandas frequency string (f.ex. '3h'), by
+        default the temporal resolution is kept.
+    cutout_dir : str
+        Directory to place the new cutout in (defaults to the directory of
+        `cutout`).
+    overwrite : bool
+        Whether to replace an existing cutout `name` (default: False).
+    nprocesses : int
+        Number of processes to coarsen the monthly files with (defaults to all
+        processors).
+    time_chunk : int
+        Number of time steps read and processed at once (should be a multiple
+        of the number of time steps aggregated by `freq`).
+
+    Returns
+    -------
+    cutout : Cutout
+        The coarsened and prepared cutout.
+    """
+    from .cutout import Cutout
+
+    assert cutout.prepared, "The cutout has to be prepared first."
+    if 'view' in cutout.meta.attrs:
+        raise NotImplementedError("Coarsening a view is not supported, use "
+                                  "`derive` to materialise the view first.")
+
+    cutout_dir, target_dir = _derived_cutout_dir(cutout, name, cutout_dir, overwrite)
+
+    meta = cutout.meta.unstack('year-month')
+    xs = pd.Index(_coarsen_coords(meta.indexes['x'], dx), name='x')
+    ys = pd.Index(_coarsen_coords(meta.indexes['y'], dy), name='y')
+
+    if freq is not None:
+        time = meta.indexes['time'].to_series().resample(freq).first().index
+        meta = (meta.drop([v for v in meta.variables
+                           if 'time' in meta[v].dims and v != 'time'])
+                    .drop('time')
+                    .assign_coords(time=time))
+    meta = _coarsen_dataset(meta, xs, ys)
+    meta = _add_lon_lat(meta, cutout.projection)
+    meta = meta.stack(**{'year-month': ('year', 'month')})
+
+    tasks = [dict(src=cutout.datasetfn(ym),
+                  dst=os.path.join(target_dir, "{}{:0>2}.nc".format(*ym)),
+                  xs=xs, ys=ys, freq=freq, time_chunk=time_chunk,
+                  lon=meta.coords['lon'], lat=meta.coords['lat'])
+             for ym in meta.coords['year-month'].to_index().tolist()]
+
+    _write_derived_cutout(cutout, name, target_dir, meta,
+                          cutout_do_coarsen_task, tasks, nprocesses)
+
+    return Cutout(name, cutout_dir=cutout_dir)
+
+
+def _prepare_gebco_height(xs, ys, gebco_fn=None, cache_dir=None):
     # gebco bathymetry heights for underwater
+    from . import config
+
     if gebco_fn is None:
-        from .config import gebco_path
-        gebco_fn = gebco_path
-
-    tmpdir = tempfile.mkdtemp()
-    cornersc = np.array(((xs[0], ys[0]), (xs[-1], ys[-1])))
-    minc = np.minimum(*cornersc)
-    maxc = np.maximum(*cornersc)
-    span = (maxc - minc)/(np.asarray((len(xs), len(ys)))-1)
-    minx, miny = minc - span/2.
-    maxx, maxy = maxc + span/2.
-
-    tmpfn = os.path.join(tmpdir, 'resampled.nc')
-    try:
-        ret = subprocess.call(['gdalwarp', '-of', 'NETCDF',
-                               '-ts', str(len(xs)), str(len(ys)),
-                               '-te', str(minx), str(miny), str(maxx), str(maxy),
-                               '-r', 'average',
-                               gebco_fn, tmpfn])
-        assert ret == 0, "gdalwarp was not able to resample gebco"
-    except OSError:
-        logger.warning("gdalwarp was not found for resampling gebco. "
-                       "Next-neighbour interpolation will be used instead!")
-        tmpfn = gebco_path
-
-    with xr.open_dataset(tmpfn) as ds_gebco:
-        height = (ds_gebco.rename({'lon': 'x', 'lat': 'y', 'Band1': 'height'})
-                          .reindex(x=xs, y=ys, method='nearest')
-                          .load()['height'])
-    shutil.rmtree(tmpdir)
+        gebco_fn = config.gebco_path
+    if cache_dir is None:
+        cache_dir = config.cache_dir
+
+    xs = pd.Index(xs, name='x')
+    ys = pd.Index(ys, name='y')
+
+    # heights are cached per grid and gebco version
+    key = hashlib.sha1()
+    key.update(os.path.abspath(gebco_fn).encode())
+    key.update(str(os.path.getmtime(gebco_fn)).encode())
+    key.update(np.asarray(xs, dtype=np.float64).tobytes())
+    key.update(np.asarray(ys, dtype=np.float64).tobytes())
+    cache_fn = (os.path.join(cache_dir, 'gebco-{}.nc'.format(key.hexdigest()))
+                if cache_dir else None)
+
+    if cache_fn is not None and os.path.isfile(cache_fn):
+        logger.debug("Reading gebco heights from cache %s", cache_fn)
+        try:
+            with xr.open_dataarray(cache_fn) as height:
+                return height.load()
+        except Exception as e:
+            logger.warning("Could not read the gebco heights from cache %s: %s", cache_fn, e)
+
+    height = (regrid_raster(gebco_fn, xs, ys, resampling=Resampling.average)
+              .rename('height'))
+
+    if cache_fn is not None:
+        # The cache is best-effort, write atomically to a temporary file
+        tmp_fn = "{}.{}.tmp".format(cache_fn, os.getpid())
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            height.to_netcdf(tmp_fn)
+            os.rename(tmp_fn, cache_fn)
+        except Exception as e:
+            logger.warning("Could not cache the gebco heights in %s: %s", cache_dir, e)
+            if os.path.isfile(tmp_fn):
+                os.unlink(tmp_fn)
+
     return height
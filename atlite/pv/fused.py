@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Fused PV conversion kernel
+
+Computes the same chain as `SurfaceOrientation`, `TiltedIrradiation` and
+`SolarPanelModel` cell by cell in a single pass, without allocating any
+(time, y, x) temporaries besides the output.
+"""
+
+from __future__ import absolute_import
+
+import math
+import numpy as np
+import xarray as xr
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numba
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+from .solar_position import SolarPosition
+
+# numpy's NaN propagating maximum and minimum (as used by clip) and the NaN
+# ignoring fmax and fmin
+
+def _maximum(a, b):
+    if a != a or b != b:
+        return np.nan
+    return a if a >= b else b
+
+def _minimum(a, b):
+    if a != a or b != b:
+        return np.nan
+    return a if a <= b else b
+
+def _fmax(a, b):
+    if a != a:
+        return b
+    if b != b:
+        return a
+    return a if a >= b else b
+
+def _fmin(a, b):
+    if a != a:
+        return b
+    if b != b:
+        return a
+    return a if a <= b else b
+
+def _clip(a, lo, hi):
+    return _minimum(_maximum(a, lo), hi)
+
+def _diffuse_fraction(k, sinaltitude, T, rh, enhanced):
+    # Reindl 1990 clearsky model, see `DiffuseHorizontalIrrad`
+    c1 = 1.0 if (k > 0.0) and (k <= 0.3) else 0.0
+    c2 = 1.0 if (k > 0.3) and (k < 0.78) else 0.0
+    c3 = 1.0 if k >= 0.78 else 0.0
+    if enhanced:
+        return (c1 * _fmin(1.0, 1.000-0.232*k+0.0239*sinaltitude-0.000682*T+0.0195*rh)
+                + c2 * _fmin(0.97, _fmax(0.1, 1.329-1.716*k+0.267*sinaltitude-0.00357*T+0.106*rh))
+                + c3 * _fmax(0.1, 0.426*k-0.256*sinaltitude+0.00349*T+0.0734*rh))
+    return (c1 * _fmin(1.0, 1.020-0.254*k+0.0123*sinaltitude)
+            + c2 * _fmin(0.97, _fmax(0.1, 1.400-1.749*k+0.177*sinaltitude))
+            + c3 * _fmax(0.1, 0.486*k-0.182*sinaltitude))
+
+def _albedo(a, influx, from_outflux):
+    if from_outflux:
+        albedo = a / influx
+        return 1.0 if albedo > 1.0 else albedo
+    return a
+
+def _pv_kernel(altitude, azimuth, toa, influx_a, influx_b, albedo, temperature,
+               humidity, slope, surface_azimuth, split, from_outflux, hay_davies,
+               bofinger, pc, altitude_threshold, out):
+    # split: 0 = influx with simple Reindl model, 1 = influx with enhanced
+    # Reindl model, 2 = influx_direct (influx_a) and influx_diffuse (influx_b)
+    nt, ny, nx = out.shape
+    negative_diffuse = False
+    cap_altitude = math.radians(altitude_threshold)
+    sin_threshold = math.sin(math.radians(1.))
+    for j in range(ny):
+        for i in range(nx):
+            sin_slope, cos_slope = math.sin(slope[j, i]), math.cos(slope[j, i])
+            sin_half_slope3 = math.sin(slope[j, i]/2.0)**3
+            for t in range(nt):
+                alt, az, G0 = altitude[t, j, i], azimuth[t, j, i], toa[t, j, i]
+                sinaltitude = math.sin(alt)
+                T = float(temperature[t, j, i])
+
+                # SurfaceOrientation
+                cosincidence = (sin_slope * math.cos(alt) * math.cos(surface_azimuth[j, i] - az)
+                                + cos_slope * sinaltitude)
+                if cosincidence < 0.:
+                    cosincidence = 0.
+
+                # TiltedIrradiation
+                if split == 2:
+                    direct = _clip(float(influx_a[t, j, i]), 0., G0)
+                    diffuse = _clip(float(influx_b[t, j, i]), 0., G0 - direct)
+                else:
+                    influx = _clip(float(influx_a[t, j, i]), 0., G0)
+                    rh = float(humidity[t, j, i]) if split == 1 else 0.
+                    diffuse = influx * _diffuse_fraction(influx / G0, sinaltitude, T, rh, split == 1)
+                    direct = influx - diffuse
+
+                influx = direct + diffuse
+                a = _albedo(float(albedo[t, j, i]), influx, from_outflux)
+                if not hay_davies:
+                    direct_t = cosincidence / sinaltitude * direct
+                    diffuse_t = ((1. + cos_slope) / 2. * diffuse +
+                                 a * influx * ((1. - cos_slope) / 2.))
+                    total = ((0. if direct_t != direct_t else direct_t) +
+                             (0. if diffuse_t != diffuse_t else diffuse_t))
+                else:
+                    f = math.sqrt(direct / influx) if direct / influx >= 0. else np.nan
+                    if f != f:
+                        f = 0.
+                    A = direct / G0
+                    R_b = cosincidence / sinaltitude
+                    diffuse_t = ((1.0 - A) * ((1 + cos_slope) / 2.0) *
+                                 (1.0 + f * sin_half_slope3)
+                                 + A * R_b) * diffuse
+                    if diffuse_t < 0. and sinaltitude > sin_threshold:
+                        negative_diffuse = True
+                    if diffuse_t != diffuse_t or diffuse_t < 0.:
+                        diffuse_t = 0.
+                    total = R_b * direct + diffuse_t + influx * a * (1.0 - cos_slope) / 2.0
+
+                if alt < cap_altitude or influx <= 0.01:
+                    total = 0.
+
+                # SolarPanelModel
+                if bofinger:
+                    # pc: A, B, C, D, NOCT, Tamb, Intc, Tstd, ta, threshold, inverter_efficiency
+                    fraction = (pc[4] - pc[5]) / pc[6]
+                    log_total = (math.log(total) if total > 0. else
+                                 (-np.inf if total == 0. else np.nan))
+                    eta_ref = (pc[0] + pc[1]*total + pc[2]*log_total)
+                    eta = (eta_ref * (1. + pc[3] * (fraction * total + (T - pc[7]))) /
+                           (1. + pc[3] * fraction / pc[8] * eta_ref * total))
+                    capacity = (pc[0] + pc[1] * 1000. + pc[2] * math.log(1000.))*1e3
+                    power = total * eta * (pc[10] / capacity)
+                    if total < pc[9]:
+                        power = 0.
+                else:
+                    # pc: c_temp_amb, c_temp_irrad, r_tmod, r_irradiance, k_1, ..., k_6,
+                    #     inverter_efficiency
+                    T_ = (pc[0] * T + pc[1] * total) - pc[2]
+                    G_ = total / pc[3]
+                    logG = (math.log(G_) if G_ > 0. else
+                            (-np.inf if G_ == 0. else np.nan))
+                    eff = (1 + pc[4] * logG + pc[5] * logG**2 +
+                           T_ * (pc[6] + pc[7] * logG + pc[8] * logG**2) +
+                           pc[9] * T_**2)
+                    if eff != eff or eff < 0:
+                        eff = 0.
+                    power = G_ * eff * pc[10]
+
+                out[t, j, i] = power
+    return negative_diffuse
+
+if has_numba:
+    # Compiled on first use in each process, numba's on-disk cache would be
+    # written next to the installed package
+    _jit = numba.njit(nogil=True, error_model='numpy')
+    _maximum, _minimum, _fmax, _fmin, _clip, _diffuse_fraction, _albedo = map(
+        _jit, (_maximum, _minimum, _fmax, _fmin, _clip, _diffuse_fraction, _albedo))
+    _pv_kernel = _jit(_pv_kernel)
+
+_huld_params = ('c_temp_amb', 'c_temp_irrad', 'r_tmod', 'r_irradiance',
+                'k_1', 'k_2', 'k_3', 'k_4', 'k_5', 'k_6')
+_bofinger_params = ('A', 'B', 'C', 'D', 'NOCT', 'Tamb', 'Intc', 'Tstd', 'ta', 'threshold')
+
+def _as_grid(da, template):
+    # scalar, (y,)- or (y, x)-shaped orientation parameter as (y, x) array
+    return np.ascontiguousarray(xr.DataArray(da).broadcast_like(template)
+                                .transpose('y', 'x').values, dtype=float)
+
+def FusedSolarPV(ds, pc, orientation, trigon_model='simple', clearsky_model='simple',
+                 altitude_threshold=1.):
+    """
+    AC power per capacity of the panel `pc` with `orientation`, equivalent to
+    `SolarPanelModel(ds, TiltedIrradiation(ds, solar_position,
+    SurfaceOrientation(ds, solar_position, orientation), ...), pc)`.
+
+    Needs numba, which compiles a kernel computing all steps cell by cell
+    in one pass over the inputs; only the output (time, y, x) array is
+    allocated. Inputs are evaluated in float64, so that results match the
+    xarray path up to floating point rounding.
+    """
+    if not has_numba:
+        raise RuntimeError("The fused PV conversion needs the numba python package "
+                           "(https://numba.pydata.org).")
+
+    solar_position = SolarPosition(ds)
+    lon = np.deg2rad(ds['lon'])
+    lat = np.deg2rad(ds['lat'])
+    orientation = orientation(lon, lat, solar_position)
+
+    template = solar_position['altitude'].isel(time=0, drop=True)
+    slope = _as_grid(orientation['slope'], template)
+    surface_azimuth = _as_grid(orientation['azimuth'], template)
+
+    def values(v):
+        return ds[v].transpose('time', 'y', 'x').values
+    dummy = np.zeros((1, 1, 1))
+
+    if 'influx' in ds:
+        if clearsky_model is None:
+            clearsky_model = ('enhanced'
+                              if 'temperature' in ds and 'humidity' in ds
+                              else 'simple')
+        if clearsky_model not in ('simple', 'enhanced'):
+            raise ValueError("`clearsky model` must be chosen from 'simple' and 'enhanced'")
+        split = 1 if clearsky_model == 'enhanced' else 0
+        influx_a, influx_b = values('influx'), dummy
+    elif 'influx_direct' in ds and 'influx_diffuse' in ds:
+        split = 2
+        influx_a, influx_b = values('influx_direct'), values('influx_diffuse')
+    else:
+        raise AssertionError("Need either influx or influx_direct and influx_diffuse in the dataset. Check your cutout and dataset module.")
+
+    if 'albedo' in ds:
+        from_outflux, albedo = False, values('albedo')
+    elif 'outflux' in ds:
+        from_outflux, albedo = True, values('outflux')
+    else:
+        raise AssertionError("Need either albedo or outflux as a variable in the dataset. Check your cutout and dataset module.")
+
+    model = pc.get('model', 'huld')
+    params = _bofinger_params if model == 'bofinger' else _huld_params
+    params = np.array([pc[p] for p in params] + [pc.get('inverter_efficiency', 1.)],
+                      dtype=float)
+
+    altitude = solar_position['altitude']
+    out = np.empty(altitude.shape, dtype=float)
+    negative_diffuse = _pv_kernel(
+        altitude.transpose('time', 'y', 'x').values,
+        solar_position['azimuth'].transpose('time', 'y', 'x').values,
+        solar_position['atmospheric insolation'].transpose('time', 'y', 'x').values,
+        influx_a, influx_b, albedo, values('temperature'),
+        values('humidity') if split == 1 else dummy,
+        slope, surface_azimuth, split, from_outflux, trigon_model != 'simple',
+        model == 'bofinger', params, float(altitude_threshold), out)
+
+    if negative_diffuse:
+        logger.warn('diffuse_t exhibits negative values above altitude threshold.')
+
+    return xr.DataArray(out, coords=altitude.transpose('time', 'y', 'x').coords,
+                        dims=('time', 'y', 'x'), name='AC power')
@@ -121,7 +121,9 @@ def TiltedGroundIrrad(ds, solar_position, surface_orientation, influx):
     ground_t = influx * _albedo(ds, influx) * (1.0 - np.cos(surface_slope)) / 2.0
     return ground_t.rename('ground tilted')
 
-def TiltedIrradiation(ds, solar_position, surface_orientation, trigon_model, clearsky_model, altitude_threshold=1.):
+def HorizontalIrradiation(ds, solar_position, clearsky_model):
+    # Direct and diffuse horizontal irradiation, which do not depend on the
+    # orientation of the surface
 
     influx_toa = solar_position['atmospheric insolation']
     def clip(influx, influx_max):
@@ -137,6 +139,17 @@ def TiltedIrradiation(ds, solar_position, surface_orientation, trigon_model, cle
     else:
         raise AssertionError("Need either influx or influx_direct and influx_diffuse in the dataset. Check your cutout and dataset module.")
 
+    return direct, diffuse
+
+def TiltedIrradiation(ds, solar_position, surface_orientation, trigon_model, clearsky_model,
+                      altitude_threshold=1., horizontal=None):
+    # `horizontal` may pass the result of `HorizontalIrradiation` to share it
+    # between several surface orientations
+
+    if horizontal is None:
+        horizontal = HorizontalIrradiation(ds, solar_position, clearsky_model)
+    direct, diffuse = horizontal
+
     if trigon_model == 'simple':
         k = surface_orientation['cosincidence'] / np.sin(solar_position['altitude'])
         cos_surface_slope = np.cos(surface_orientation['slope'])
@@ -6,6 +6,10 @@ from operator import itemgetter
 import numpy as np
 import pandas as pd
 import xarray as xr
+from six import string_types
+
+import logging
+logger = logging.getLogger(__name__)
 
 # Huld model was copied from gsee -- global solar energy estimator
 # by Stefan Pfenninger
@@ -66,12 +70,156 @@ def _power_bofinger(irradiance, t_amb, pc):
 
     return power.rename('AC power')
 
-def SolarPanelModel(ds, irradiance, pc):
+def _power(irradiance, t_amb, pc):
     model = pc.get('model', 'huld')
 
     if model == 'huld':
-        return _power_huld(irradiance, ds['temperature'], pc)
+        return _power_huld(irradiance, t_amb, pc)
     elif model == 'bofinger':
-        return _power_bofinger(irradiance, ds['temperature'], pc)
+        return _power_bofinger(irradiance, t_amb, pc)
     else:
-        AssertionError("Unknown panel model: {}".format(model))
+        raise AssertionError("Unknown panel model: {}".format(model))
+
+class PowerTable(object):
+    """
+    Table of the AC power per capacity of a panel over irradiance (W/m2) and
+    ambient temperature (K), which is evaluated by bilinear interpolation.
+
+    The table is regular in temperature and in the square root of the
+    irradiance, to resolve the logarithmic terms of the models at low
+    irradiance. It is refined until the interpolation error is below
+    `max_error` (per unit of capacity) on a sample grid four times finer in
+    both directions. The tolerance is thus sampled, not guaranteed between
+    the sample points. Values outside of the table ranges and NaNs are
+    evaluated with the panel model itself.
+    """
+
+    def __init__(self, pc, max_error=1e-4, irradiance_range=(0., 1500.),
+                 temperature_range=(210., 340.), max_size=2**22):
+        self.max_error = max_error
+
+        # The bofinger model is zero below the threshold, so that the table
+        # starts there to avoid interpolating across the jump
+        g0, g1 = irradiance_range
+        if pc.get('model', 'huld') == 'bofinger':
+            g0 = max(g0, pc['threshold'])
+        t0, t1 = temperature_range
+        self.g0, self.t0 = g0, t0
+        u1 = np.sqrt(g1 - g0)
+
+        nu, nt = 16, 4
+        while True:
+            self.du, self.dt = u1 / nu, (t1 - t0) / nt
+            u, t = np.linspace(0., u1, nu + 1), np.linspace(t0, t1, nt + 1)
+            self.table = self._model(u, t, pc)
+
+            # errors on four times finer grids, separately for both directions
+            fine_u, fine_t = np.linspace(0., u1, 4*nu + 1), np.linspace(t0, t1, 4*nt + 1)
+            error_u = self._error(fine_u, t, pc)
+            error_t = self._error(u, fine_t, pc)
+            self.error = max(error_u, error_t, self._error(fine_u, fine_t, pc))
+            if not np.isfinite(self.error):
+                raise ValueError("The panel model of `{}` is not finite on the range "
+                                 "of the power table.".format(pc.get('name')))
+            if self.error <= max_error or self.table.size >= max_size:
+                break
+            if error_u >= error_t:
+                nu *= 2
+            else:
+                nt *= 2
+
+        if self.error > max_error:
+            logger.warning("The power table of panel `%s` only reaches an error of %.2g.",
+                           pc.get('name'), self.error)
+
+    def _model(self, u, t, pc):
+        return (_power(xr.DataArray(self.g0 + u**2, dims='u'),
+                       xr.DataArray(t, dims='t'), pc)
+                .transpose('u', 't').values)
+
+    def _error(self, u, t, pc):
+        uu, tt = np.meshgrid(u, t, indexing='ij')
+        return np.max(np.abs(self._interpolate(uu / self.du, (tt - self.t0) / self.dt)
+                                - self._model(u, t, pc)))
+
+    def _interpolate(self, u, t):
+        # Bilinear interpolation at the fractional table indices `u` and `t`,
+        # which must lie within the table
+        nu, nt = self.table.shape
+        i = np.minimum(u.astype(np.intp), nu - 2)
+        j = np.minimum(t.astype(np.intp), nt - 2)
+        u -= i
+        t -= j
+
+        k = i * nt + j
+        table = self.table.ravel()
+        lower = table.take(k)
+        lower += (table.take(k + 1) - lower) * t
+        k += nt
+        upper = table.take(k)
+        upper += (table.take(k + 1) - upper) * t
+        upper -= lower
+        upper *= u
+        upper += lower
+        return upper
+
+    def __call__(self, irradiance, t_amb, pc):
+        irradiance, t_amb = xr.broadcast(irradiance, t_amb)
+        g = np.asarray(irradiance.values, dtype=float)
+        t = np.asarray(t_amb.transpose(*irradiance.dims).values, dtype=float)
+
+        nu, nt = self.table.shape
+        with np.errstate(invalid='ignore'):
+            u = np.sqrt(g - self.g0)
+            u /= self.du
+            t = (t - self.t0) / self.dt
+            inside = (u <= nu - 1) & (t >= 0) & (t <= nt - 1)
+            below = g < self.g0
+
+        invalid = ~inside
+        has_invalid = invalid.any()
+        if has_invalid:
+            u[invalid] = 0.
+            t[invalid] = 0.
+
+        power = self._interpolate(u, t)
+
+        if has_invalid:
+            power[invalid] = 0.
+            outside = invalid & ~below
+            if outside.any():
+                power[outside] = _power(xr.DataArray(g[outside]),
+                                        xr.DataArray(t_amb.transpose(*irradiance.dims)
+                                                     .values[outside]), pc).values
+
+        return xr.DataArray(power, coords=irradiance.coords, dims=irradiance.dims,
+                            name='AC power')
+
+_power_tables = {}
+
+def get_power_table(pc, max_error=1e-4):
+    """
+    Return the `PowerTable` of the panel config `pc` (f.ex. from
+    `resource.get_solarpanelconfig`), which is cached per panel config.
+    """
+    key = (tuple(sorted((k, v) for k, v in pc.items()
+                        if isinstance(v, (int, float, string_types)))),
+           max_error)
+    table = _power_tables.get(key)
+    if table is None:
+        table = _power_tables[key] = PowerTable(pc, max_error=max_error)
+    return table
+
+def SolarPanelModel(ds, irradiance, pc, power_table=False):
+    """
+    AC power per capacity of the panel `pc` for the tilted `irradiance`.
+
+    With `power_table`, the panel model is interpolated from a cached
+    `PowerTable` instead; it may be given as the tolerated error per unit of
+    capacity, which is checked on a sample grid (default: 1e-4).
+    """
+    if power_table:
+        max_error = 1e-4 if power_table is True else power_table
+        return get_power_table(pc, max_error)(irradiance, ds['temperature'], pc)
+
+    return _power(irradiance, ds['temperature'], pc)
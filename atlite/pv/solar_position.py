@@ -2,11 +2,158 @@
 import numpy as np
 import pandas as pd
 import xarray as xr
+import hashlib
+from collections import OrderedDict
 
-def SolarPosition(ds):
+from .. import config
+
+_solar_position_terms = OrderedDict()
+
+# Names and int16 packing (scale factor and offset in rad) of the solar
+# position variables stored in the monthly files of a cutout (see
+# `SolarPositionVariables`)
+solar_position_variables = {'altitude': ('solar_altitude', (5e-5, 0.)),
+                            'azimuth': ('solar_azimuth', (1e-4, np.pi))}
+
+def _time_terms(time):
+    # Terms of [1] only depending on time, as 1-d arrays
+    n = np.asarray(time.to_julian_date()) - 2451545.0
+
+    L = 280.460 + 0.9856474 * n # mean longitude (deg)
+    g = np.deg2rad(357.528 + 0.9856003 * n) # mean anomaly (rad)
+    l = np.deg2rad(L + 1.915 * np.sin(g) + 0.020 * np.sin(2*g)) # ecliptic long. (rad)
+    ep = np.deg2rad(23.439 - 4e-7 * n) # obliquity of the ecliptic (rad)
+
+    ra = np.arctan2(np.cos(ep) * np.sin(l), np.cos(l)) # right ascencion (rad)
+    dec = np.arcsin(np.sin(ep) * np.sin(l))            # declination (rad)
+    # local mean sidereal time at longitude 0 (deg)
+    lmst0 = (6.697375 + (time.hour + time.minute / 60.0) + 0.0657098242 * n) * 15.
+
+    return dict(g=g, ra=ra, dec=dec, lmst0=np.asarray(lmst0))
+
+def _spatial(ds, name):
+    # `name` as (1, y, x)-broadcastable array: 1-d lon and lat coordinates
+    # of a latlong grid stay separable
+    da = ds[name]
+    if da.dims == ('x',):
+        return da.values[np.newaxis, np.newaxis, :]
+    elif da.dims == ('y',):
+        return da.values[np.newaxis, :, np.newaxis]
+    return da.transpose('y', 'x').values[np.newaxis]
+
+def _spatial_terms(ds):
+    # Terms only depending on the location, as (1, y, x)-broadcastable arrays
+    lat = np.deg2rad(_spatial(ds, 'lat'))
+    return dict(lon=np.array(_spatial(ds, 'lon'), dtype=float),
+                sin_lat=np.sin(lat), cos_lat=np.cos(lat))
+
+def _time_key(ds):
+    return hashlib.sha1(ds.indexes['time'].asi8.tobytes()).hexdigest()
+
+def _spatial_key(ds):
+    key = hashlib.sha1()
+    for name in ('lon', 'lat'):
+        key.update(repr(ds[name].dims).encode())
+        key.update(np.ascontiguousarray(ds[name].values, dtype=float).tobytes())
+    return key.hexdigest()
+
+def _cached_terms(key, func):
+    # Only the separable terms are cached, the (time, y, x) arrays would
+    # exhaust the cache with a single month of a large cutout
+    terms = _solar_position_terms.pop(key, None)
+    if terms is None:
+        terms = func()
+        for a in terms.values():
+            a.flags.writeable = False
+    _solar_position_terms[key] = terms
+
+    nbytes = lambda terms: sum(a.nbytes for a in terms.values())
+    size = sum(nbytes(t) for t in _solar_position_terms.values())
+    while size > config.solar_position_cache_size and len(_solar_position_terms) > 1:
+        size -= nbytes(_solar_position_terms.popitem(last=False)[1])
+    return terms
+
+def _compute_solar_position(ds, cache=False):
+    if cache:
+        t = _cached_terms(('time', _time_key(ds)),
+                          lambda: _time_terms(ds.indexes['time']))
+        s = _cached_terms(('space', _spatial_key(ds)), lambda: _spatial_terms(ds))
+    else:
+        t = _time_terms(ds.indexes['time'])
+        s = _spatial_terms(ds)
+    dec = t['dec'][:, np.newaxis, np.newaxis]
+
+    # hour angle (rad), only depends on time and longitude
+    h = (np.deg2rad(t['lmst0'][:, np.newaxis, np.newaxis] + s['lon'])
+         - t['ra'][:, np.newaxis, np.newaxis] + np.pi) % (2*np.pi) - np.pi
+    cos_h = np.cos(h)
+
+    # alt and az from [2]
+    sin_lat, cos_lat = s['sin_lat'], s['cos_lat']
+    sin_dec, cos_dec = np.sin(dec), np.cos(dec)
+
+    # Clip before arcsin to prevent values < -1. from rounding errors; can cause NaNs later
+    sin_alt = (sin_lat*sin_dec + (cos_lat*cos_dec)*cos_h).clip(min=-1., max=1.)
+    alt = np.arcsin(sin_alt)
+    cos_alt = np.sqrt(1. - sin_alt**2)
+
+    az = np.arccos(((sin_dec*cos_lat - (cos_dec*sin_lat)*cos_h)/cos_alt).clip(min=-1., max=1.))
+    az = np.where(h <= 0, az, 2*np.pi - az)
+
+    # [3]
+    toa = (1366.1 * (1+0.033*np.cos(t['g'][:, np.newaxis, np.newaxis])) * sin_alt)
+
+    dims = ('time', 'y', 'x')
+    coords = {k: v for k, v in ds.coords.items()
+              if set(v.dims).issubset(dims)}
+    return xr.Dataset({'altitude': (dims, alt),
+                       'azimuth': (dims, az),
+                       'atmospheric insolation': (dims, toa)},
+                      coords=coords)
+
+def _atmospheric_insolation(ds, altitude):
+    # [3]
+    g = _time_terms(ds.indexes['time'])['g']
+    return 1366.1 * (1+0.033*xr.DataArray(np.cos(g), [ds.indexes['time']])) * np.sin(altitude)
+
+def SolarPositionVariables(ds, packed=False):
+    """
+    Solar altitude and azimuth (rad) on the grid and time steps of `ds` as
+    the variables `solar_altitude` and `solar_azimuth` for storing them in
+    the monthly files of a cutout, which are then used by `SolarPosition`.
+
+    They are stored as float32 or, with `packed`, as int16 with a resolution
+    of 5e-5 rad (altitude) and 1e-4 rad (azimuth), which is well below the
+    accuracy of the algorithm, but may still shift the cells passing the
+    altitude threshold of `TiltedIrradiation` around sun-rise and set.
+    """
+    solar_position = _compute_solar_position(ds)
+    data_vars = {}
+    for v, (name, (scale_factor, add_offset)) in solar_position_variables.items():
+        da = solar_position[v].astype(np.float32)
+        da.attrs.update(units='rad', long_name='solar ' + v)
+        if packed:
+            da.encoding.update(dtype='int16', scale_factor=np.float32(scale_factor),
+                               add_offset=np.float32(add_offset),
+                               _FillValue=np.int16(-32768))
+        data_vars[name] = da
+    return xr.Dataset(data_vars)
+
+def SolarPosition(ds, cache=True):
     """
     Compute solar azimuth and altitude
 
+    The terms only depending on time (declination, right ascension, ...)
+    are computed once per time step, only the hour angle depends on the
+    longitude and only altitude and azimuth depend on the latitude as well.
+    With `cache`, these time and location terms are kept in memory up to
+    `config.solar_position_cache_size` bytes, so that f.ex. `pv` and
+    `solar_thermal` on the same cutout reuse them; the (time, y, x) arrays
+    are derived from them on every call.
+
+    If `ds` contains the variables `solar_altitude` and `solar_azimuth`
+    (see `SolarPositionVariables`), they are used instead.
+
     Solar altitude errors are up to 1.5 deg during sun-rise and set, but at
     0.05-0.1 deg during daytime.
 
@@ -34,39 +181,19 @@ def SolarPosition(ds):
 
     """
 
-    # up to h and dec from [1]
+    if all(name in ds for name, _ in solar_position_variables.values()):
+        # Stored in the cutout by `SolarPositionVariables`
+        solar_position = xr.Dataset({v: ds[name].astype(float)
+                                     for v, (name, _) in solar_position_variables.items()})
+        solar_position['atmospheric insolation'] = (
+            ds['influx_toa'] if 'influx_toa' in ds
+            else _atmospheric_insolation(ds, solar_position['altitude']))
+        return solar_position
 
-    t = ds.indexes['time']
-    n = xr.DataArray(t.to_julian_date(), [ds.indexes['time']]) - 2451545.0
-
-    L = 280.460 + 0.9856474 * n # mean longitude (deg)
-    g = np.deg2rad(357.528 + 0.9856003 * n) # mean anomaly (rad)
-    l = np.deg2rad(L + 1.915 * np.sin(g) + 0.020 * np.sin(2*g)) # ecliptic long. (rad)
-    ep = np.deg2rad(23.439 - 4e-7 * n) # obliquity of the ecliptic (rad)
-
-    ra = np.arctan2(np.cos(ep) * np.sin(l), np.cos(l)) # right ascencion (rad)
-    lmst = (6.697375 + (ds['time.hour'] + ds['time.minute'] / 60.0) +
-            0.0657098242 * n) * 15. + ds['lon'] # local mean sidereal time (deg)
-    h = (np.deg2rad(lmst) - ra + np.pi) % (2*np.pi) - np.pi # hour angle (rad)
-
-    dec = np.arcsin(np.sin(ep) * np.sin(l))            # declination (rad)
-
-    # alt and az from [2]
-    lat = np.deg2rad(ds['lat'])
-    # Clip before arcsin to prevent values < -1. from rounding errors; can cause NaNs later
-    alt = np.arcsin((np.sin(lat)*np.sin(dec) + np.cos(lat)*np.cos(dec)*np.cos(h)).clip(min=-1., max=1.)).rename('altitude')
-
-    az = np.arccos(((np.sin(dec)*np.cos(lat) - np.cos(dec)*np.sin(lat)*np.cos(h))/np.cos(alt)).clip(min=-1., max=1.))
-    az = az.where(h <= 0, 2*np.pi - az).rename('azimuth')
+    solar_position = _compute_solar_position(ds, cache=cache)
 
     if 'influx_toa' in ds:
-        atmospheric_insolation = ds['influx_toa'].rename('atmospheric insolation')
-    else:
-        # [3]
-        atmospheric_insolation = (1366.1 * (1+0.033*np.cos(g)) * np.sin(alt)).rename('atmospheric insolation')
+        solar_position = solar_position.assign(**{'atmospheric insolation':
+                                                  ds['influx_toa'].rename('atmospheric insolation')})
 
-    solar_position = xr.Dataset({da.name: da
-                                 for da in [alt,
-                                            az,
-                                            atmospheric_insolation]})
     return solar_position
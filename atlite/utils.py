@@ -22,6 +22,8 @@ Renewable Energy Atlas Lite (Atlite)
 Light-weight version of Aarhus RE Atlas for converting weather data to power systems data
 """
 
+import os
+from glob import glob
 import progressbar as pgb
 
 def make_optional_progressbar(show, prefix, max_value):
@@ -40,3 +42,24 @@ def make_optional_progressbar(show, prefix, max_value):
         maybe_progressbar = lambda x: x
 
     return maybe_progressbar
+
+def evict_cache(cache_dir, pattern, max_size):
+    """
+    Delete the least recently used files matching `pattern` in `cache_dir`
+    until the remaining ones take up at most `max_size` bytes.
+
+    Files are considered used when they are modified, so a cache hit should
+    touch its file with `os.utime`.
+    """
+    fns = glob(os.path.join(cache_dir, pattern))
+    stats = sorted((os.path.getmtime(fn), os.path.getsize(fn), fn) for fn in fns)
+    size = sum(s for _, s, _ in stats)
+    for _, s, fn in stats:
+        if size <= max_size:
+            break
+        try:
+            os.unlink(fn)
+        except OSError:
+            # removed concurrently
+            pass
+        size -= s
@@ -21,6 +21,42 @@ Light-weight version of Aarhus RE Atlas for converting weather data to power sys
 """
 import xarray as xr
 import numpy as np
+import hashlib
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+_extrapolation_factors = OrderedDict()
+_extrapolation_factors_size = 32
+
+def extrapolation_factor(roughness, from_height, to_height):
+    """
+    Factor `log(to_height/roughness) / log(from_height/roughness)` of the
+    logarithmic wind profile, which is cached per roughness field (f.ex.
+    static or monthly) and pair of heights.
+
+    Non-positive roughness lengths are replaced by 0.0002 m, corresponding
+    to open water [2], without modifying `roughness`.
+    """
+    key = hashlib.sha1(np.ascontiguousarray(roughness.values).tobytes())
+    key.update(repr((roughness.dims, roughness.shape, roughness.dtype.str,
+                     from_height, to_height,
+                     type(from_height).__name__, type(to_height).__name__)).encode())
+    key = key.hexdigest()
+
+    factor = _extrapolation_factors.pop(key, None)
+    if factor is None:
+        # Sanitise roughness for logarithm
+        with np.errstate(invalid='ignore'):
+            roughness = roughness.where(~(roughness <= 0.0), 0.0002)
+        factor = (np.log(to_height / roughness) / np.log(from_height / roughness)).values
+        factor.flags.writeable = False
+        while len(_extrapolation_factors) >= _extrapolation_factors_size:
+            _extrapolation_factors.popitem(last=False)
+    _extrapolation_factors[key] = factor
+
+    return roughness.copy(data=factor)
 
 def extrapolate_wind_speed(ds, to_height, from_height=None):
     """Extrapolate the wind speed from a given height above ground to another.
@@ -75,13 +111,9 @@ def extrapolate_wind_speed(ds, to_height, from_height=None):
 
     from_name = "wnd{h:0d}m".format(h=int(from_height))
 
-    # Sanitise roughness for logarithm
-    # 0.0002 corresponds to open water [2]
-    ds['roughness'].values[ds['roughness'].values <= 0.0] = 0.0002
-
-    # Wind speed extrapolation
-    wnd_spd = ds[from_name] * ( np.log(to_height /ds['roughness'])
-                              / np.log(from_height/ds['roughness']))
+    # Wind speed extrapolation; the factor is only broadcast over time by
+    # the multiplication if the roughness is static or monthly
+    wnd_spd = ds[from_name] * extrapolation_factor(ds['roughness'], from_height, to_height)
 
     wnd_spd.attrs.update({"long name":
                             "extrapolated {ht} m wind speed using logarithmic "
@@ -90,3 +122,97 @@ def extrapolate_wind_speed(ds, to_height, from_height=None):
                           "units" : "m s**-1"})
 
     return wnd_spd.rename(to_name)
+
+class PowerCurve(object):
+    """
+    Power curve `POW` at the wind speeds `V` (per unit of `P`), resampled
+    onto a uniform speed grid, so that it is evaluated by index arithmetic
+    instead of the binary search of np.interp.
+
+    The grid step is chosen such that all speeds of `V` lie on the grid,
+    which makes the evaluation equal to `np.interp(wnd, V, POW/P)` up to
+    rounding; jumps of the curve (repeated speeds, f.ex. at cut-out) are
+    kept by storing the left and right limits at each grid speed. If there
+    is no such grid step with at most `max_size` speeds, the power curve is
+    evaluated by np.interp instead (`exact` is False).
+    """
+
+    def __init__(self, V, POW, P=None, max_size=2**16):
+        V = np.asarray(V, dtype=float)
+        POW = np.asarray(POW, dtype=float) / (np.max(POW) if P is None else P)
+
+        diffs = np.diff(V)
+        step = diffs[diffs > 0].min()
+        for k in range(1, 101):
+            dv = step / k
+            n = (V - V[0]) / dv
+            if np.allclose(n, np.round(n), rtol=0., atol=1e-6):
+                # One more grid speed on both sides to return the end values
+                # of the curve beyond them, as np.interp does
+                n = int(np.round((V[-1] - V[0]) / dv)) + 3
+                self.exact = n <= max_size
+                break
+        else:
+            self.exact = False
+
+        if not self.exact:
+            logger.debug("The wind speeds of the power curve do not fit onto a uniform grid "
+                         "of at most %d speeds, falling back to np.interp.", max_size)
+            self.V, self.POW = V, POW
+            return
+
+        self.dv = dv
+        self.v0 = V[0] - dv
+        speeds = self.v0 + dv * np.arange(n)
+
+        # np.interp takes the right-most value at repeated speeds, reversing
+        # the curve gives the left limits instead
+        right = np.interp(speeds, V, POW)
+        left = -np.interp(-speeds, -V[::-1], -POW[::-1])
+        self.right = right[:-1]
+        self.slope = left[1:] - right[:-1]
+
+    def __call__(self, wnd, out=None):
+        """
+        Power per unit for the wind speeds `wnd`, which may be written to a
+        float64 array `out` (possibly `wnd` itself).
+        """
+        wnd = np.asarray(wnd)
+        if out is None:
+            out = np.empty(wnd.shape)
+
+        if not self.exact:
+            out[...] = np.interp(wnd, self.V, self.POW)
+            return out
+
+        np.subtract(wnd, self.v0, out=out)
+        out /= self.dv
+        np.clip(out, 0., len(self.right) - 1, out=out)
+        with np.errstate(invalid='ignore'):
+            # NaNs are cast to an arbitrary index, but stay NaN
+            i = out.astype(np.intp)
+        out -= i
+        out *= self.slope.take(i, mode='clip')
+        out += self.right.take(i, mode='clip')
+        return out
+
+_power_curves = OrderedDict()
+_power_curves_size = 32
+
+def get_power_curve(turbine):
+    """
+    Return the `PowerCurve` of the turbine config `turbine` (with the keys
+    'V', 'POW' and 'P'), of which the last `_power_curves_size` are cached,
+    f.ex. for several `smooth` variants of a turbine.
+    """
+    V, POW, P = (np.asarray(turbine[k], dtype=float) for k in ('V', 'POW', 'P'))
+    key = (V.tobytes(), POW.tobytes(), float(P))
+
+    power_curve = _power_curves.pop(key, None)
+    if power_curve is None:
+        power_curve = PowerCurve(V, POW, P)
+        while len(_power_curves) >= _power_curves_size:
+            _power_curves.popitem(last=False)
+    _power_curves[key] = power_curve
+
+    return power_curve
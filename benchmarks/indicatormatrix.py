@@ -0,0 +1,52 @@
+"""
+Benchmark the construction of indicator matrices
+
+Compares the reference implementation (rtree candidates, one intersection
+per pair), the vectorized one (shapely 2 bulk STRtree query) and the
+analytical one for regular grids on random Voronoi regions.
+
+Usage: python benchmarks/indicatormatrix.py [nx ny nregions]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import numpy as np
+import shapely
+from shapely.geometry import box, MultiPoint
+
+from atlite import gis
+
+def regions_on_grid(nx, ny, nregions, step=0.25, seed=0):
+    rng = np.random.RandomState(seed)
+    extent = box(0., 0., nx*step, ny*step)
+    points = MultiPoint(rng.rand(nregions, 2) * [nx*step, ny*step])
+    regions = [r.intersection(extent) for r in shapely.voronoi_polygons(points).geoms]
+    # Regions with many vertices like administrative boundaries
+    return [shapely.segmentize(r, step/10.) for r in regions]
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+if __name__ == '__main__':
+    nx, ny, nregions = map(int, sys.argv[1:4]) if len(sys.argv) > 3 else (200, 160, 1500)
+    step = 0.25
+    x = step/2. + step*np.arange(nx)
+    y = step/2. + step*np.arange(ny)[::-1]
+    cells = [box(xi - step/2., yi - step/2., xi + step/2., yi + step/2.) for yi in y for xi in x]
+    regions = regions_on_grid(nx, ny, nregions, step)
+
+    vectorized, t_vectorized = timed(gis._compute_indicatormatrix_vectorized, cells, regions)
+    grid, t_grid = timed(gis.compute_grid_indicatormatrix, x, y, regions)
+    reference, t_reference = timed(gis._compute_indicatormatrix_reference, cells, regions)
+
+    print("{} cells, {} regions, {} non-zeros".format(len(cells), nregions, reference.nnz))
+    print("reference  {:8.2f}s".format(t_reference))
+    print("vectorized {:8.2f}s  ({:.1f}x, max deviation {:.1e})"
+          .format(t_vectorized, t_reference / t_vectorized,
+                  abs(vectorized - reference).max()))
+    print("grid       {:8.2f}s  ({:.1f}x, max deviation {:.1e})"
+          .format(t_grid, t_reference / t_grid, abs(grid - reference).max()))
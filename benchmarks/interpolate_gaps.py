@@ -0,0 +1,49 @@
+"""
+Benchmark the gap filling of SARAH time series
+
+Compares `datasets.sarah.interpolate_gaps` with the per-series
+interpolation by np.apply_along_axis it replaces, on a block of
+half-hourly data with a given share of missing values.
+
+Usage: python benchmarks/interpolate_gaps.py [ny nx missing_share]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import numpy as np
+
+from atlite.datasets.sarah import interpolate_gaps
+
+def interpolate_gaps_reference(y):
+    def _interpolate1d(y):
+        nan = np.isnan(y)
+        if nan.all(): return y
+        x = lambda z: z.nonzero()[0]
+        y[nan] = np.interp(x(nan), x(~nan), y[~nan])
+        return y
+    return np.apply_along_axis(_interpolate1d, -1, np.array(y, copy=True))
+
+if __name__ == '__main__':
+    ny, nx = map(int, sys.argv[1:3]) if len(sys.argv) > 2 else (200, 200)
+    share = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    # (y, x, time) as passed by prepare_month_sarah, one month half-hourly
+    rng = np.random.RandomState(0)
+    y = rng.rand(ny, nx, 2*744).astype(np.float32)
+    y[rng.rand(*y.shape) < share] = np.nan
+
+    start = time.time()
+    expected = interpolate_gaps_reference(y)
+    t_reference = time.time() - start
+
+    start = time.time()
+    result = interpolate_gaps(y)
+    t_vectorized = time.time() - start
+
+    print("{} series with {:.0%} missing values".format(ny*nx, share))
+    print("reference  {:8.2f}s".format(t_reference))
+    print("vectorized {:8.2f}s  ({:.1f}x, identical: {})"
+          .format(t_vectorized, t_reference / t_vectorized,
+                  np.array_equal(result, expected, equal_nan=True)))
@@ -0,0 +1,63 @@
+"""
+Benchmark regridding with `gis.RegridKernel` against rio.warp.reproject
+
+Coarsens a month of hourly data on a 0.05 deg grid (as of SARAH) to
+coarser grids with average and nearest resampling and reports the run
+times and the number of cells deviating from GDAL.
+
+Usage: python benchmarks/regrid.py [ntimes]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from atlite import gis
+from atlite.gis import Resampling
+
+def on_cell_boundary(dimc, c):
+    step = (c[-1] - c[0]) / (len(c) - 1)
+    pos = (np.asarray(dimc) - (c[0] - step/2.)) / step
+    return np.isclose(pos, np.round(pos), rtol=0., atol=1e-6)
+
+if __name__ == '__main__':
+    ntimes = int(sys.argv[1]) if len(sys.argv) > 1 else 744
+    crs = 'EPSG:4326'
+
+    x = np.arange(5.025, 15., 0.05)
+    y = np.arange(54.975, 45., -0.05)
+    src = np.random.RandomState(0).rand(ntimes, len(y), len(x)).astype(np.float32)
+    src[0, 10:20, 10:20] = np.nan
+
+    for step in (0.1, 0.25, 0.3):
+        dimx = pd.Index(np.arange(5. + step/2., 15. - step/4., step), name='x')
+        dimy = pd.Index(np.arange(55. - step/2., 45. + step/4., -step), name='y')
+        for resampling in (Resampling.average, Resampling.nearest):
+            kwargs = gis.regrid_kwargs(x, y, dimx, dimy, src_crs=crs, dst_crs=crs,
+                                       resampling=resampling)
+            kernel = kwargs.pop('kernel')
+
+            start = time.time()
+            expected = gis.reproject_array(src, **kwargs)
+            t_gdal = time.time() - start
+
+            start = time.time()
+            result = gis.reproject_array(src, kernel=kernel, **kwargs)
+            t_kernel = time.time() - start
+
+            # Destination cells centred on source cell boundaries are ties
+            # for nearest resampling, which GDAL and the kernel may break
+            # differently
+            differing = ~np.isclose(result, expected, equal_nan=True)
+            if resampling == Resampling.nearest:
+                differing &= ~(on_cell_boundary(dimy, y)[:, np.newaxis] |
+                               on_cell_boundary(dimx, x)[np.newaxis, :])
+
+            print("{:>4} deg {:8}: gdal {:6.2f}s kernel {:6.2f}s ({:.1f}x), "
+                  "differing NaNs {}, differing cells {} (except ties)"
+                  .format(step, resampling.name, t_gdal, t_kernel, t_gdal / t_kernel,
+                          (np.isnan(result) != np.isnan(expected)).sum(),
+                          differing.sum()))
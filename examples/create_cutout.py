@@ -19,6 +19,10 @@ cutout = atlite.Cutout(name="europe-2011-01",
                        years=slice(2011, 2011),
                        months=slice(1,1))
 
+#estimate the disk space and memory the preparation needs, use
+#calibrate=True to refine the estimate on a small part of the cutout
+estimate = cutout.prepare(dry_run=True)
+
 #this is where all the work happens - it took 105 minutes on FIAS'
 #beast resi, with 16 cores; the resulting cutout takes 57 GB
 cutout.prepare()
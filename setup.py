@@ -28,6 +28,16 @@ setup(
                       'rasterio',
                       'shapely',
                       'progressbar2'],
+    extras_require={
+        # Reading NCEP GRIB files
+        'ncep': ['cfgrib'],
+        # Fused PV conversion kernel, pv(..., fused=True) falls back to the
+        # regular conversion without it
+        'fused': ['numba'],
+        # Vectorized indicator matrices (analytical ones on regular grids) and
+        # shape reprojection, otherwise shapes are processed one by one
+        'shapely2': ['shapely>=2'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Environment :: Console',
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+import xarray as xr
+import rasterio as rio
+import rasterio.warp
+from shapely.geometry import box
+
+from atlite import gis
+from atlite.availability import compute_availabilitymatrix, _as_crs
+from atlite.datasets.cordex import projection as rotated
+
+class GridCutout(object):
+    def __init__(self, x, y, projection):
+        self.coords = xr.Dataset(coords=dict(x=x, y=y)).coords
+        self.projection = projection
+
+@pytest.fixture
+def cutout():
+    return GridCutout(np.arange(-5., 5., 0.5), np.arange(5., -5., -0.5), rotated)
+
+@pytest.fixture
+def raster(tmpdir):
+    fn = str(tmpdir.join('exclusion.tif'))
+    values = (np.random.RandomState(0).rand(200, 300) < 0.3).astype(np.uint8)
+    with rio.open(fn, 'w', driver='GTiff', width=300, height=200, count=1,
+                  dtype=np.uint8, crs='EPSG:4326',
+                  transform=rio.transform.from_origin(0., 60., 0.1, 0.1)) as dst:
+        dst.write(values, 1)
+    return fn
+
+def test_rotated_pole_crs_matches_rotproj():
+    lon, lat = np.array([10., -5., 30.]), np.array([50., 40., 60.])
+    x, y = rasterio.warp.transform('EPSG:4326', _as_crs(rotated), lon, lat)
+    np.testing.assert_allclose((x, y), rotated(lon, lat), atol=1e-8)
+
+def test_rotated_pole_availability(cutout, raster):
+    shapes = gis.reproject_shapes([box(-4., -4., 1., 1.), box(0., -2., 4.5, 3.)],
+                                  rotated, 'latlong')
+    exclusions = [box(5., 45., 15., 50.)]
+
+    A = compute_availabilitymatrix(cutout, shapes, rasters=[raster],
+                                   geometries=[exclusions], resolution=5)
+    inline = compute_availabilitymatrix(cutout, shapes, rasters=[raster],
+                                        geometries=[exclusions], resolution=5,
+                                        nprocesses=1)
+    single = compute_availabilitymatrix(cutout, shapes[:1], rasters=[raster],
+                                        geometries=[exclusions], resolution=5,
+                                        nprocesses=2)
+
+    assert A.shape == (2, 400)
+    assert (A != inline).nnz == 0
+    assert (A[:1] != single).nnz == 0
+    assert 0. < A.max() <= 1.
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from atlite.preparation import cutout_do_derive_task
+
+def test_derive_task_drops_source_encoding(tmpdir):
+    src, dst = str(tmpdir.join('src.nc')), str(tmpdir.join('dst.nc'))
+    time = pd.date_range('2011-01-01', periods=48, freq='h')
+    x, y = np.arange(0., 10.), np.arange(10., 0., -1.)
+    values = np.random.RandomState(0).rand(len(time), len(y), len(x)).astype(np.float32)
+    ds = xr.Dataset({'temperature': (('time', 'y', 'x'), 250. + 50. * values)},
+                    coords=dict(time=time, y=y, x=x))
+    ds['temperature'].encoding.update(dtype='int16', scale_factor=0.01, add_offset=250.,
+                                      zlib=True, chunksizes=(24, 10, 10), _FillValue=-32768)
+    ds.to_netcdf(src)
+
+    cutout_do_derive_task(dict(src=src, dst=dst, xs=x[2:5], ys=y[3:6], time_chunk=24))
+
+    with xr.open_dataset(dst) as derived, xr.open_dataset(src) as source:
+        assert derived['temperature'].shape == (48, 3, 3)
+        encoding = derived['temperature'].encoding
+        assert np.issubdtype(encoding['dtype'], np.floating)
+        assert 'scale_factor' not in encoding
+        assert not encoding.get('zlib') and encoding.get('chunksizes') is None
+        xr.testing.assert_identical(derived['temperature'].load(),
+                                    source['temperature'].sel(x=x[2:5], y=y[3:6]).load())
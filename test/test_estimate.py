@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from atlite.preparation import cutout_estimate_preparation
+
+def tasks_monthly(xs, ys, yearmonths, prepare_func, meta_attrs):
+    return [dict(prepare_func=prepare_func, yearmonth=ym) for ym in yearmonths]
+
+def tasks_static(xs, ys, yearmonths, prepare_func, meta_attrs):
+    return [dict(prepare_func=prepare_func)]
+
+def prepare(**task):
+    raise AssertionError("the estimate must not prepare any data")
+
+class MetaCutout(object):
+    name = 'estimate'
+    weather_data_config = {
+        '_': dict(tasks_func=tasks_monthly, prepare_func=prepare,
+                  variables=['temperature', 'height'], static_variables=['height']),
+        'roughness': dict(tasks_func=tasks_static, prepare_func=prepare,
+                          static_variables=['roughness']),
+    }
+
+    def __init__(self):
+        time = pd.date_range('2011-01-01', '2011-02-28 23:00', freq='h')
+        meta = xr.Dataset(coords=dict(time=time, x=np.arange(4.), y=np.arange(3.),
+                                      year=[2011], month=[1, 2]))
+        self.meta = meta.stack(**{'year-month': ('year', 'month')})
+        self.coords = self.meta.coords
+
+def test_default_estimate_counts_static_variables_once():
+    estimate = cutout_estimate_preparation(MetaCutout())
+    nbytes = estimate.nbytes
+    ncells = 12
+
+    np.testing.assert_array_equal(nbytes['temperature'], [4 * ncells * 744, 4 * ncells * 672])
+    np.testing.assert_array_equal(nbytes['height'], 4 * ncells)
+    np.testing.assert_array_equal(nbytes['roughness'], 4 * ncells)
+    assert list(estimate.tasks['months']) == [1, 1, 2]
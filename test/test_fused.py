@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+pytest.importorskip('numba')
+
+from atlite.convert import convert_pv
+from atlite.pv.orientation import get_orientation
+from atlite.pv.solar_position import SolarPosition
+
+from test_solar_panel_model import csi, bofinger
+
+def dataset(influx, reflected):
+    # Two days (with nights) on a small latlong grid with plausible weather
+    rng = np.random.RandomState(0)
+    time = pd.date_range('2011-06-20', periods=48, freq='h')
+    x, y = np.arange(-10., 30., 4.), np.arange(70., 30., -5.)
+    ds = xr.Dataset(coords=dict(time=time, x=x, y=y, lon=('x', x), lat=('y', y)))
+    shape = (len(time), len(y), len(x))
+    dims = ('time', 'y', 'x')
+
+    sin_alt = np.sin(SolarPosition(ds, cache=False)['altitude'].values)
+    clearness = 0.2 + 0.7 * rng.rand(*shape)
+    total = np.maximum(1000. * clearness * sin_alt, 0.)
+    ds['temperature'] = (dims, 260. + 50. * rng.rand(*shape))
+    ds['humidity'] = (dims, 0.2 + 0.8 * rng.rand(*shape))
+
+    if influx == 'influx':
+        ds['influx'] = (dims, total)
+    else:
+        direct = total * rng.rand(*shape)
+        ds['influx_direct'] = (dims, direct)
+        ds['influx_diffuse'] = (dims, total - direct)
+
+    albedo = 0.1 + 0.5 * rng.rand(*shape)
+    if reflected == 'albedo':
+        ds['albedo'] = (dims, albedo)
+    else:
+        ds['outflux'] = (dims, albedo * total)
+
+    # missing values in single cells and a whole missing time step
+    for v in ds.data_vars:
+        ds[v].values[30, 2, 3] = np.nan
+    ds[influx if influx == 'influx' else 'influx_direct'].values[12] = np.nan
+    return ds
+
+@pytest.mark.parametrize('panel', [csi, bofinger], ids=['huld', 'bofinger'])
+@pytest.mark.parametrize('trigon_model', ['simple', 'other'])
+@pytest.mark.parametrize('influx, clearsky_model', [('influx', 'simple'),
+                                                     ('influx', 'enhanced'),
+                                                     ('influx_direct', None)])
+@pytest.mark.parametrize('reflected', ['albedo', 'outflux'])
+@pytest.mark.parametrize('orientation', [{'slope': 30., 'azimuth': 180.},
+                                         'latitude_optimal'])
+def test_fused_matches_xarray(panel, trigon_model, influx, clearsky_model, reflected,
+                              orientation):
+    ds = dataset(influx, reflected)
+    orientation = get_orientation(orientation if isinstance(orientation, str)
+                                  else dict(orientation))
+
+    kwargs = dict(panel=panel, orientation=orientation, trigon_model=trigon_model,
+                  clearsky_model=clearsky_model)
+    with np.errstate(all='ignore'):
+        expected = convert_pv(ds, **kwargs)
+        result = convert_pv(ds, fused=True, **kwargs)
+
+    assert set(result.dims) == set(expected.dims)
+    # night-time cells are exactly zero on both paths
+    night = SolarPosition(ds)['altitude'].values < 0.
+    expected = expected.transpose(*result.dims)
+    assert (result.values[night] == 0.).all() and (expected.values[night] == 0.).all()
+    np.testing.assert_allclose(result.values, expected.values,
+                               rtol=1e-10, atol=1e-12)
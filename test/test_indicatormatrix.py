@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from shapely.geometry import box, Polygon, MultiPolygon
+
+from atlite import gis
+
+requires_shapely2 = pytest.mark.skipif(not gis.has_shapely2, reason="needs shapely >= 2")
+
+def grid_cells(x, y, dx, dy):
+    return [box(xi - dx/2., yi - dy/2., xi + dx/2., yi + dy/2.) for yi in y for xi in x]
+
+@pytest.fixture
+def shapes():
+    ring = Polygon([(0.1, 0.1), (2.9, 0.3), (2.6, 2.7), (0.4, 2.2)],
+                   holes=[[(1., 1.), (1.8, 1.1), (1.5, 1.9)]])
+    multi = MultiPolygon([Polygon([(3.2, 0.2), (4.8, 0.6), (4.1, 1.9)]),
+                          Polygon([(3.3, 2.1), (4.9, 2.2), (4.9, 2.9), (3.3, 2.9)],
+                                  holes=[[(3.6, 2.3), (4.6, 2.3), (4.6, 2.7), (3.6, 2.7)]])])
+    inside = box(1.3, 2.6, 1.4, 2.7)
+    beside = box(10., 10., 11., 11.)
+    return [ring, multi, inside, beside, box(-1., -1., 6., 4.)]
+
+@requires_shapely2
+def test_vectorized_matches_reference(shapes):
+    x = np.arange(0.125, 5., 0.25)
+    y = np.arange(2.875, 0., -0.25)
+    cells = grid_cells(x, y, 0.25, 0.25)
+
+    vectorized = gis._compute_indicatormatrix_vectorized(cells, shapes)
+    reference = gis._compute_indicatormatrix_reference(cells, shapes)
+
+    assert vectorized.shape == reference.shape == (len(shapes), len(cells))
+    np.testing.assert_allclose(vectorized.toarray(), reference.toarray(), rtol=0., atol=1e-12)
+    # The shapes beside and around the grid
+    assert vectorized[3].nnz == 0
+    np.testing.assert_allclose(vectorized[4].toarray(), 1.)
+
+@requires_shapely2
+def test_grid_matches_reference(shapes):
+    x = np.arange(0.125, 5., 0.25)
+    y = np.arange(2.875, 0., -0.25)
+    cells = grid_cells(x, y, 0.25, 0.25)
+
+    grid = gis.compute_grid_indicatormatrix(x, y, shapes)
+    reference = gis._compute_indicatormatrix_reference(cells, shapes)
+
+    np.testing.assert_allclose(grid.toarray(), reference.toarray(), rtol=0., atol=1e-9)
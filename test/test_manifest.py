@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from atlite.cutout import Cutout
+from atlite.preparation import write_manifest
+
+@pytest.fixture
+def cutout_dir(tmpdir):
+    path = tmpdir.mkdir('c')
+    time = pd.date_range('2011-11-01', '2011-12-31 23:00', freq='h')
+    x, y = np.arange(0., 2.5, 0.5, dtype=np.float32), np.arange(3., 1., -0.25)
+    meta = xr.Dataset({'height': (('y', 'x'), np.ones((len(y), len(x))))},
+                      coords=dict(time=time, x=x, y=y, year=[2011], month=[11, 12]),
+                      attrs=dict(module='cordex'))
+    meta.to_netcdf(str(path.join('meta.nc')))
+    for month in (11, 12):
+        t = time[time.month == month]
+        xr.Dataset({'temperature': (('time', 'y', 'x'), np.zeros((len(t), len(y), len(x))))},
+                   coords=dict(time=t, x=x, y=y)).to_netcdf(str(path.join('2011{}.nc'.format(month))))
+    meta = meta.stack(**{'year-month': ('year', 'month')})
+    write_manifest(str(path), meta)
+    return str(tmpdir)
+
+def test_grid_served_from_manifest(cutout_dir, monkeypatch):
+    cutout = Cutout('c', cutout_dir=cutout_dir)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("meta.nc must not be decoded")
+    monkeypatch.setattr(xr, 'open_dataset', fail)
+
+    assert cutout.shape == (8, 5)
+    assert cutout.extent == [0., 2., 1.25, 3.]
+    assert cutout.coords['x'].dtype == np.float32
+    assert cutout.coords['year-month'].to_index().tolist() == [(2011, 11), (2011, 12)]
+    assert 'x=0.00-2.00 y=3.00-1.25 time=2011/11-2011/12 prepared' in repr(cutout)
+    assert cutout._meta is None
+
+    monkeypatch.undo()
+    # other coordinates come from the meta data
+    assert len(cutout.coords['time']) == 61 * 24
+    np.testing.assert_array_equal(cutout.coords['x'].values, cutout.meta.indexes['x'])
+    np.testing.assert_array_equal(cutout.coords['y'].values, cutout.meta.indexes['y'])
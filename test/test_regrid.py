@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from collections import OrderedDict
+import rasterio as rio
+import rasterio.warp
+
+from atlite import gis
+from atlite.gis import Resampling
+
+crs = 'EPSG:4326'
+
+@pytest.fixture
+def data():
+    x = np.arange(5.025, 10., 0.05)
+    y = np.arange(54.975, 50., -0.05)
+    values = np.random.RandomState(0).rand(4, len(y), len(x)).astype(np.float32)
+    # a gap in one time step and a single missing cell in another
+    values[0, 10:20, 30:45] = np.nan
+    values[2, 55, 7] = np.nan
+    return xr.DataArray(values, dims=('time', 'y', 'x'),
+                        coords=dict(time=np.arange(4), y=y, x=x))
+
+grids = [(np.arange(5.05, 9.96, 0.1), np.arange(54.95, 50.04, -0.1)),
+         (np.arange(5.075, 9.9, 0.15), np.arange(54.925, 50.1, -0.15)),
+         (np.arange(5.2, 9.8, 0.27), np.arange(54.8, 50.2, -0.23))]
+
+def rasterio_reference(data, dimx, dimy, resampling):
+    dst = np.empty((len(data), len(dimy), len(dimx)), dtype=data.dtype)
+    for src_band, dst_band in zip(data.values, dst):
+        rio.warp.reproject(src_band, dst_band, src_crs=crs, dst_crs=crs,
+                           src_transform=gis._as_transform(data.indexes['x'], data.indexes['y']),
+                           dst_transform=gis._as_transform(dimx, dimy),
+                           resampling=resampling)
+    return dst
+
+def on_cell_boundary(dimc, c):
+    step = (c[-1] - c[0]) / (len(c) - 1)
+    pos = (np.asarray(dimc) - (c[0] - step/2.)) / step
+    return np.isclose(pos, np.round(pos), rtol=0., atol=1e-6)
+
+@pytest.mark.parametrize('resampling', [Resampling.average, Resampling.nearest])
+@pytest.mark.parametrize('grid', grids)
+def test_kernel_matches_rasterio(data, grid, resampling):
+    dimx, dimy = pd.Index(grid[0], name='x'), pd.Index(grid[1], name='y')
+
+    kwargs = gis.regrid_kwargs(data.indexes['x'], data.indexes['y'], dimx, dimy,
+                               src_crs=crs, dst_crs=crs, resampling=resampling)
+    assert 'kernel' in kwargs
+
+    result = gis.regrid(data, dimx, dimy, src_crs=crs, dst_crs=crs, resampling=resampling)
+    expected = rasterio_reference(data, dimx, dimy, resampling)
+
+    assert result.dims == ('time', 'y', 'x')
+    assert result.shape == expected.shape
+
+    same = np.isclose(result.values, expected, rtol=1e-6, atol=1e-6, equal_nan=True)
+    if resampling == Resampling.nearest:
+        # At exact ties between two source cells GDAL's choice depends on
+        # the rounding of its approximate transformer, either one is nearest
+        tie = (on_cell_boundary(dimy, data.indexes['y'])[:, np.newaxis] |
+               on_cell_boundary(dimx, data.indexes['x'])[np.newaxis, :])
+        same |= tie
+    assert same.all()
+
+def test_sparse_kernel_matches_dense(data, monkeypatch):
+    dimx, dimy = (pd.Index(c, name=n) for c, n in zip(grids[2], 'xy'))
+    dense = gis.regrid(data, dimx, dimy, src_crs=crs, dst_crs=crs,
+                       resampling=Resampling.average)
+
+    monkeypatch.setattr(gis, '_regrid_kernels', OrderedDict())
+    monkeypatch.setattr(gis.RegridKernel, 'dense_size', 0)
+    sparse = gis.regrid(data, dimx, dimy, src_crs=crs, dst_crs=crs,
+                        resampling=Resampling.average)
+
+    assert np.allclose(sparse.values, dense.values, rtol=1e-6, atol=1e-6, equal_nan=True)
+
+def test_chunked_kernel_matches_unchunked(data):
+    dimx, dimy = (pd.Index(c, name=n) for c, n in zip(grids[0], 'xy'))
+    kwargs = gis.regrid_kwargs(data.indexes['x'], data.indexes['y'], dimx, dimy,
+                               src_crs=crs, dst_crs=crs, resampling=Resampling.average)
+
+    whole = gis.reproject_array(data.values, **kwargs)
+    out = np.empty_like(whole)
+    chunked = gis.reproject_array(data.values, out=out, chunksize=3, **kwargs)
+
+    assert chunked is out
+    np.testing.assert_array_equal(whole, chunked)
+
+def test_kernel_not_applicable_beyond_source_grid(data):
+    dimx = pd.Index(np.arange(4., 11., 0.2), name='x')
+    dimy = pd.Index(np.arange(54.9, 50., -0.2), name='y')
+    kwargs = gis.regrid_kwargs(data.indexes['x'], data.indexes['y'], dimx, dimy,
+                               src_crs=crs, dst_crs=crs, resampling=Resampling.average)
+    assert 'kernel' not in kwargs
+
+def test_transform_places_cell_centres_on_coordinates(data):
+    x, y = data.indexes['x'], data.indexes['y']
+    transform = gis._as_transform(x, y)
+    np.testing.assert_allclose(transform * (0.5, 0.5), (x[0], y[0]))
+    np.testing.assert_allclose(transform * (len(x) - 0.5, len(y) - 0.5), (x[-1], y[-1]))
+
+@pytest.mark.parametrize('resampling', [Resampling.average, Resampling.bilinear])
+def test_regrid_does_not_shift_linear_field(data, resampling):
+    # Regression test: the raster origin used to be the first cell centre
+    # instead of its corner, shifting regridded fields by half a source cell
+    x, y = data.indexes['x'], data.indexes['y']
+    field = xr.DataArray(np.add.outer(10. * y.values, x.values), dims=('y', 'x'),
+                         coords=dict(y=y, x=x))
+    dimx, dimy = (pd.Index(c, name=n) for c, n in zip(grids[0], 'xy'))
+
+    result = gis.regrid(field, dimx, dimy, src_crs=crs, dst_crs=crs, resampling=resampling)
+    expected = np.add.outer(10. * dimy.values, dimx.values)
+    # bilinear resampling extrapolates constantly at the border
+    inner = (slice(1, -1), slice(1, -1))
+    np.testing.assert_allclose(result.values[inner], expected[inner], atol=1e-6)
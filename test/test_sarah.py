@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from atlite.datasets.sarah import interpolate_gaps, hourly_fluxes
+
+def interpolate_gaps_reference(y):
+    # Per-series implementation interpolate_gaps replaces
+    def _interpolate1d(y):
+        nan = np.isnan(y)
+        if nan.all(): return y
+        x = lambda z: z.nonzero()[0]
+        y[nan] = np.interp(x(nan), x(~nan), y[~nan])
+        return y
+    return np.apply_along_axis(_interpolate1d, -1, np.array(y, copy=True))
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_interpolate_gaps_matches_reference(dtype):
+    y = np.random.RandomState(0).rand(7, 5, 48).astype(dtype)
+    y[np.random.RandomState(1).rand(*y.shape) < 0.3] = np.nan
+    # leading and trailing gaps, a series with a single value and an empty one
+    y[0, 0, :5] = np.nan
+    y[0, 1, -4:] = np.nan
+    y[1, 0, :] = np.nan
+    y[1, 0, 17] = 1.
+    y[1, 1, :] = np.nan
+
+    filled = interpolate_gaps(y)
+
+    assert filled.dtype == y.dtype
+    np.testing.assert_array_equal(filled, interpolate_gaps_reference(y))
+    assert np.isnan(filled[1, 1]).all()
+    assert not np.isnan(np.delete(filled.reshape(-1, 48), 6, axis=0)).any()
+
+def test_interpolate_gaps_without_gaps():
+    y = np.arange(12.).reshape(3, 4)
+    assert interpolate_gaps(y) is y
+
+def test_hourly_fluxes_pairs_half_hours():
+    sis = np.arange(24.).reshape(4, 2, 3)
+    sid = sis / 4.
+    fluxes = hourly_fluxes(sis, sid)
+    assert fluxes.shape == (2, 2, 2, 3)
+    np.testing.assert_array_equal(fluxes[0], (sid[0::2] + sid[1::2])/2)
+    np.testing.assert_array_equal(fluxes[0] + fluxes[1], (sis[0::2] + sis[1::2])/2)
+    with pytest.raises(AssertionError):
+        hourly_fluxes(sis[:3], sid[:3])
@@ -0,0 +1,41 @@
+import numpy as np
+import xarray as xr
+import pytest
+
+from atlite.pv.solar_panel_model import PowerTable, SolarPanelModel
+
+csi = dict(model='huld', name='CSi', c_temp_amb=1, c_temp_irrad=0.035,
+           r_tmod=298, r_irradiance=1000, k_1=-0.017162, k_2=-0.040289,
+           k_3=-0.004681, k_4=0.000148, k_5=0.000169, k_6=0.000005,
+           inverter_efficiency=0.9)
+
+bofinger = dict(model='bofinger', name='bofinger', A=0.1, B=-1e-5, C=0.01, D=-0.004,
+                NOCT=318., Tamb=293., Intc=800., Tstd=298., ta=0.9, threshold=20.,
+                inverter_efficiency=0.9)
+
+@pytest.mark.parametrize('pc', [csi, bofinger])
+def test_power_table_within_tolerance(pc):
+    rng = np.random.RandomState(0)
+    shape = (48, 10, 10)
+    irradiance = xr.DataArray(np.where(rng.rand(*shape) < 0.3, 0., rng.rand(*shape) * 1300.),
+                              dims=('time', 'y', 'x'))
+    # NaN, below, beyond and just above the lower end of the table
+    irradiance.values[0, 0, :5] = [np.nan, -5., 1600., 0.5, 1e-3]
+    temperature = 240. + rng.rand(*shape) * 80.
+    # beyond the temperature range of the table
+    temperature[1, 0, :2] = [150., 400.]
+    ds = xr.Dataset({'temperature': (('time', 'y', 'x'), temperature)})
+
+    exact = SolarPanelModel(ds, irradiance, pc)
+    table = SolarPanelModel(ds, irradiance, pc, power_table=1e-4)
+
+    np.testing.assert_array_equal(table.isnull().values, exact.isnull().values)
+    assert float(abs(table - exact).max()) <= 1e-4
+    # outside of the table the panel model is evaluated exactly
+    assert float(table[0, 0, 2]) == float(exact[0, 0, 2])
+    assert (table[1, 0, :2] == exact[1, 0, :2]).all()
+
+def test_power_table_rejects_non_finite_model():
+    pc = dict(bofinger, threshold=0.)
+    with pytest.raises(ValueError):
+        PowerTable(pc)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from atlite.pv import solar_position
+from atlite.pv.solar_position import SolarPosition
+
+def dataset(time, x, y, latlong=True):
+    coords = dict(time=time, x=x, y=y)
+    if latlong:
+        coords.update(lon=('x', x), lat=('y', y))
+    else:
+        # a skewed grid, f.ex. of a rotated pole
+        lon, lat = np.meshgrid(x, y)
+        lon = lon + 0.1 * (lat - lat.mean())
+        coords.update(lon=(('y', 'x'), lon), lat=(('y', 'x'), lat))
+    return xr.Dataset(coords=coords)
+
+@pytest.mark.parametrize('latlong', [True, False])
+def test_cached_solar_position_matches_uncached(latlong):
+    solar_position._solar_position_terms.clear()
+    time = pd.date_range('2011-06-01', periods=48, freq='h')
+    ds = dataset(time, np.arange(-10., 30., 2.5), np.arange(70., 35., -2.5), latlong)
+
+    expected = SolarPosition(ds, cache=False)
+    assert not solar_position._solar_position_terms
+
+    for _ in range(2):
+        xr.testing.assert_identical(SolarPosition(ds), expected)
+
+    # only the time and location terms are kept, no (time, y, x) arrays
+    terms = list(solar_position._solar_position_terms.values())
+    assert len(terms) == 2
+    assert max(a.size for t in terms for a in t.values()) < expected['altitude'].size / 10
+
+def test_solar_position_cache_is_bounded(monkeypatch):
+    solar_position._solar_position_terms.clear()
+    monkeypatch.setattr(solar_position.config, 'solar_position_cache_size', 2**12)
+    x, y = np.arange(0., 10.), np.arange(50., 40., -1.)
+    for month in range(1, 13):
+        SolarPosition(dataset(pd.date_range('2011-{:02}-01'.format(month), periods=48, freq='h'), x, y))
+    size = sum(a.nbytes for t in solar_position._solar_position_terms.values() for a in t.values())
+    assert size <= 2**12
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from atlite.wind import PowerCurve
+
+V = np.array([0., 3., 4., 12., 25., 25., 30.])
+POW = np.array([0., 0., 0.1, 1., 1., 0., 0.])
+
+@pytest.fixture
+def wnd():
+    wnd = np.random.RandomState(0).rand(1000) * 35.
+    wnd[:len(V)] = V
+    wnd[-1] = np.nan
+    return wnd
+
+def test_power_curve_matches_interp(wnd):
+    power_curve = PowerCurve(V, POW, 1.)
+    assert power_curve.exact
+    np.testing.assert_allclose(power_curve(wnd), np.interp(wnd, V, POW), rtol=0., atol=1e-12)
+
+@pytest.mark.parametrize('V, max_size', [(np.array([0., 3., np.pi, 12., 25., 25., 30.]), 2**16),
+                                         (V, 10)])
+def test_power_curve_falls_back_to_interp(wnd, V, max_size):
+    power_curve = PowerCurve(V, POW, 1., max_size=max_size)
+    assert not power_curve.exact
+    np.testing.assert_array_equal(power_curve(wnd), np.interp(wnd, V, POW))
+
+def test_power_curve_cache_is_bounded(monkeypatch):
+    from atlite import wind
+    monkeypatch.setattr(wind, '_power_curves', wind.OrderedDict())
+    turbines = [dict(V=V, POW=POW * scale, P=1.) for scale in np.linspace(0.5, 1., 40)]
+
+    curves = [wind.get_power_curve(t) for t in turbines]
+    assert len(wind._power_curves) == wind._power_curves_size
+    # the most recent curves are reused, the oldest ones evicted
+    assert wind.get_power_curve(turbines[-1]) is curves[-1]
+    assert wind.get_power_curve(turbines[0]) is not curves[0]